@@ -2,18 +2,15 @@ from __future__ import annotations
 
 from datetime import datetime, date
 from typing import cast, Optional
-from zoneinfo import ZoneInfo
 
 from aiogram import Router, F
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.types import Message, CallbackQuery
-from sqlalchemy import select
 
 from app.services.slot_service import SlotService
 from app.services.booking_service import BookingService
-from app.storage.models import Booking
 from app.bot.keyboards.common import (
     kb_days_with_counts,
     kb_times_for_day,
@@ -23,12 +20,10 @@ from app.bot.keyboards.common import (
     # kb_my_bookings,
 )
 from app.storage.db import SessionLocal
-from app.config import settings
-from app.utils.dates import format_day_ru, format_dt_ru
+from app.utils.dates import format_day_ru, format_dt_ru, minutes_to_hhmm, to_utc, utcnow
 from app.storage.models import WeeklySubscription
 
 router = Router(name="booking")
-TZ = ZoneInfo(settings.tz)
 
 class BookingFSM(StatesGroup):
     waiting_name = State()
@@ -39,13 +34,8 @@ class BookingFSM(StatesGroup):
 
 async def _busy_weekly_hhmm_for_day(session, weekday: int) -> set[str]:
     """Получаем занятые времена для дня недели в интервальных записях"""
-    rows = await session.execute(
-        select(Booking.time_hhmm).where(
-            Booking.lesson_type == "interval",
-            Booking.weekday == weekday,
-        )
-    )
-    return {row[0] for row in rows.all() if row[0] is not None}
+    bookings = await BookingService.interval_between(session, weekday, 0, 24 * 60 - 1)
+    return {minutes_to_hhmm(b.minute_of_day) for b in bookings}
 
 @router.callback_query(F.data.startswith("lesson_type:"))
 async def pick_lesson_type(cb: CallbackQuery, state: FSMContext):
@@ -116,13 +106,11 @@ async def pick_day(cb: CallbackQuery):
     day = date.fromisoformat(iso)
 
     async with SessionLocal() as session:
-        times = await SlotService.available_times_for_day(session, day)
-        busy = await _busy_weekly_hhmm_for_day(session, day)
-        times = [t for t in times if t.strftime("%H:%M") not in busy]
+        view = await SlotService.day_view(session, day)
 
     await msg.answer(
         f"Доступное время на {format_day_ru(day)}:",
-        reply_markup=kb_times_for_day(times),
+        reply_markup=kb_times_for_day(view.free),
     )
     await cb.answer()
 
@@ -170,11 +158,10 @@ async def confirm_booking(message: Message, state: FSMContext):
             await message.answer("Слот потерян. Начните заново: /start")
             return
 
-        start_at = datetime.fromisoformat(iso)
-        if start_at.tzinfo is None:
-            start_at = start_at.replace(tzinfo=TZ)
+        # В кнопках — локальное время слота
+        start_at = to_utc(datetime.fromisoformat(iso))
 
-        if start_at <= datetime.now(TZ):
+        if start_at <= utcnow():
             async with SessionLocal() as session:
                 days = await SlotService.available_days(session)
             await message.answer(
@@ -197,20 +184,15 @@ async def confirm_booking(message: Message, state: FSMContext):
                 await state.clear()
                 return
 
-            if booking.slot:
-                booked_at = booking.slot.start_at
-                if booked_at.tzinfo is None:
-                    booked_at = booked_at.replace(tzinfo=TZ)
-            else:
-                # Для интервальных занятий без слота
-                booked_at = None
+            # Для интервальных занятий без слота — None
+            booked_at = booking.slot.start_at if booking.slot else None
             student_name = booking.student_name
             contact = booking.student_contact
 
         await state.clear()
         if booked_at:
             await message.answer(
-                f"Вы записаны: {format_dt_ru(booked_at.astimezone(TZ))}\n"
+                f"Вы записаны: {format_dt_ru(booked_at)}\n"
                 f"Имя: {student_name}\nКонтакт: {contact}"
             )
         else:
@@ -277,10 +259,7 @@ async def my_bookings(message: Message):
             # Одиночное занятие - показываем конкретную дату и время
             if b.slot is None:
                 continue  # Пропускаем записи без слота (не должно происходить для single)
-            start_at: datetime = b.slot.start_at
-            if start_at.tzinfo is None:
-                start_at = start_at.replace(tzinfo=TZ)
-            when = format_dt_ru(start_at.astimezone(TZ))
+            when = format_dt_ru(b.slot.start_at)
         
         student = (b.student_name or "Ученик")
         contact = (b.student_contact or "")
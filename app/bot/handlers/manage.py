@@ -20,11 +20,15 @@ from app.bot.keyboards.common import (
 )
 from app.storage.models import Booking
 from app.storage.db import SessionLocal
-from app.utils.dates import format_dt_ru
+from app.utils.dates import format_dt_ru, to_local
 
 from zoneinfo import ZoneInfo
 from app.runtime import get_scheduler
 from app.services.reminder_service import ReminderService
+from app.services.calendar_mirror import CalendarMirrorService
+from app.services.email_outbox import EmailOutboxService
+from app.services.recurrence_service import RecurrenceService
+from app.utils.metrics import metrics
 
 TZ = ZoneInfo(settings.tz)
 router = Router(name="manage")
@@ -125,7 +129,7 @@ async def a_cancel(cb: CallbackQuery):
         
         # Формируем информацию о времени в зависимости от типа занятия
         if bk.lesson_type == "single" and bk.slot:
-            when = bk.slot.start_at
+            when = to_local(bk.slot.start_at)
             when_text = f"на дату {when:%d.%m %H:%M}"
         elif bk.lesson_type == "interval":
             weekday_names = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
@@ -202,11 +206,11 @@ async def a_edit_day_pick(cb: CallbackQuery):
     day = date.fromisoformat(date_iso)
 
     async with SessionLocal() as session:
-        times = await SlotService.available_times_for_day(session, day)
+        view = await SlotService.day_view(session, day)
 
     await msg.answer(
         f"Выберите новое время (#{booking_id}):",
-        reply_markup=kb_admin_times(times, booking_id),
+        reply_markup=kb_admin_times(view.free, booking_id),
     )
     await cb.answer()
 
@@ -297,7 +301,7 @@ async def admin_ids(message: Message):
     lines = []
     for b in bs:
         if b.lesson_type == "single" and b.slot:
-            lines.append(f"#{b.id} — {b.slot.start_at:%d.%m %H:%M} • {b.student_name} ({b.student_contact or '—'})")
+            lines.append(f"#{b.id} — {to_local(b.slot.start_at):%d.%m %H:%M} • {b.student_name} ({b.student_contact or '—'})")
         elif b.lesson_type == "interval":
             weekday_names = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
             weekday_name = weekday_names[b.weekday] if b.weekday is not None else "—"
@@ -336,5 +340,138 @@ async def admin_remind_now(message: Message):
     except Exception:
         await message.answer("Формат: /remindnow <booking_id>")
         return
-    await ReminderService.send_reminder_job(bid)
-    await message.answer(f"Ок, отправил напоминание для #{bid}")
\ No newline at end of file
+    sent = await ReminderService.send_reminder_job(bid)
+    if sent:
+        await message.answer(f"Ок, отправил напоминание для #{bid}")
+    else:
+        await message.answer(f"Напоминание для #{bid} уже отправлено или запись не найдена")
+
+
+@router.message(Command("metrics"))
+async def admin_metrics(message: Message):
+    assert message.from_user is not None
+    if not is_admin(message.from_user.id):
+        await message.answer("Нет прав")
+        return
+    lines = [metrics.render() or "Метрик пока нет"]
+    created = metrics.counter("gcal.events.created")
+    if created:
+        lines.append(f"\nВызовов Calendar API на созданное событие: {metrics.counter('gcal.calls') / created:.2f}")
+    await message.answer("\n".join(lines))
+
+@router.message(Command("gcal_refresh"))
+async def admin_gcal_refresh(message: Message):
+    assert message.from_user is not None
+    if not is_admin(message.from_user.id):
+        await message.answer("Нет прав")
+        return
+    if not settings.google_calendar_enabled:
+        await message.answer("Google Calendar отключён")
+        return
+    try:
+        stats = await CalendarMirrorService.refresh()
+    except Exception as e:
+        await message.answer(f"Не удалось обновить зеркало календаря: {e}")
+        return
+    missing = ", ".join(f"#{bid}" for bid in stats["missing"]) or "нет"
+    await message.answer(
+        f"Зеркало календаря обновлено\n"
+        f"Событий: {stats['events']}, записей с событием: {stats['bookings']}\n"
+        f"Записи без события в календаре: {missing}\n"
+        f"Вызовов API: {stats['api_calls']}, {stats['duration_ms']} мс"
+    )
+
+@router.message(Command("rebuild_reminders"))
+async def admin_rebuild_reminders(message: Message):
+    assert message.from_user is not None
+    if not is_admin(message.from_user.id):
+        await message.answer("Нет прав")
+        return
+    from app.scheduler.jobs import rebuild_reminders
+
+    stats = await rebuild_reminders(get_scheduler(), SessionLocal)
+    await message.answer(
+        f"Напоминания перестроены за {stats['duration_ms']} мс\n"
+        f"Будущих записей: {stats['scanned']}, с напоминаниями: {stats['scheduled']}\n"
+        f"Сброшено у прошедших: {stats['cleared']}"
+    )
+
+@router.message(Command("email_outbox"))
+async def admin_email_outbox(message: Message):
+    assert message.from_user is not None
+    if not is_admin(message.from_user.id):
+        await message.answer("Нет прав")
+        return
+    async with SessionLocal() as session:
+        stats = await EmailOutboxService.stats(session)
+        dead = await EmailOutboxService.dead(session)
+    lines = [
+        "Outbox писем: " + (", ".join(f"{status}={count}" for status, count in sorted(stats.items())) or "пусто")
+    ]
+    if dead:
+        lines.append("\nНе доставлены (dead):")
+        for row in dead:
+            created = to_local(row.created_at).strftime("%d.%m %H:%M") if row.created_at else "—"
+            lines.append(f"#{row.id} {row.kind} → {row.to_email} ({created}, попыток {row.attempts}): {row.last_error or '—'}")
+        lines.append("\nВернуть в очередь: /email_requeue <id …> или /email_requeue all")
+    await message.answer("\n".join(lines))
+
+@router.message(Command("email_requeue"))
+async def admin_email_requeue(message: Message):
+    assert message.from_user is not None
+    if not is_admin(message.from_user.id):
+        await message.answer("Нет прав")
+        return
+    args = (message.text or "").split()[1:]
+    try:
+        ids = None if args == ["all"] else [int(a.lstrip("#")) for a in args]
+    except ValueError:
+        ids = []
+    if not ids and ids is not None:
+        await message.answer("Формат: /email_requeue <id …> или /email_requeue all")
+        return
+    async with SessionLocal() as session:
+        count = await EmailOutboxService.requeue(session, ids)
+    EmailOutboxService.kick()
+    await message.answer(f"Возвращено в очередь писем: {count}")
+
+@router.message(Command("interval_skip"))
+async def admin_interval_skip(message: Message):
+    assert message.from_user is not None
+    if not is_admin(message.from_user.id):
+        await message.answer("Нет прав")
+        return
+    try:
+        _, bid, day = (message.text or "").split()
+        booking_id = int(bid.lstrip("#"))
+        on = datetime.strptime(day, "%d.%m.%Y").date()
+    except ValueError:
+        await message.answer("Формат: /interval_skip <booking_id> <ДД.ММ.ГГГГ>")
+        return
+    async with SessionLocal() as session:
+        ok = await RecurrenceService.skip(session, booking_id, on)
+    if ok:
+        await message.answer(f"Занятие #{booking_id} {on:%d.%m.%Y} пропущено")
+    else:
+        await message.answer(f"У записи #{booking_id} нет интервального занятия {on:%d.%m.%Y}")
+
+@router.message(Command("interval_move"))
+async def admin_interval_move(message: Message):
+    assert message.from_user is not None
+    if not is_admin(message.from_user.id):
+        await message.answer("Нет прав")
+        return
+    try:
+        _, bid, day, new_day, new_time = (message.text or "").split()
+        booking_id = int(bid.lstrip("#"))
+        on = datetime.strptime(day, "%d.%m.%Y").date()
+        new_start_at = datetime.strptime(f"{new_day} {new_time}", "%d.%m.%Y %H:%M")
+    except ValueError:
+        await message.answer("Формат: /interval_move <booking_id> <ДД.ММ.ГГГГ> <ДД.ММ.ГГГГ ЧЧ:ММ>")
+        return
+    async with SessionLocal() as session:
+        ok = await RecurrenceService.move(session, booking_id, on, new_start_at)
+    if ok:
+        await message.answer(f"Занятие #{booking_id} {on:%d.%m.%Y} перенесено на {format_dt_ru(new_start_at)}")
+    else:
+        await message.answer("Не удалось перенести: нет такого занятия, время в прошлом или уже занято")
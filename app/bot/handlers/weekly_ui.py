@@ -12,10 +12,11 @@ from app.bot.keyboards.weekly_kb import weekdays_kb, times_kb_for_weekday, TIMES
 from app.config import settings
 from app.runtime import get_scheduler
 from app.services.booking_service import BookingService
-from app.services.google_calendar_service import GoogleCalendarService
+from app.integrations.google_calendar import GoogleCalendar
 from app.services.reminder_service import ReminderService
 from app.storage.db import SessionLocal
 from app.storage.models import WeeklySubscription, User
+from app.utils.dates import hhmm_to_minutes, minutes_to_hhmm
 
 router = Router(name="weekly_ui")
 log = logging.getLogger("weekly")
@@ -34,12 +35,12 @@ PENDING: Dict[int, Tuple[int, str]] = {}
 
 async def _busy_times_for_weekday(session, weekday: int) -> List[str]:
     rows = await session.execute(
-        select(WeeklySubscription.time_hhmm).where(
+        select(WeeklySubscription.minute_of_day).where(
             WeeklySubscription.weekday == weekday,
             WeeklySubscription.is_active == True,
         )
     )
-    return sorted({r[0] for r in rows.all()})
+    return [minutes_to_hhmm(m) for m in sorted({r[0] for r in rows.all() if r[0] is not None})]
 
 def _times_kb_filtered(weekday: int, busy: List[str]) -> types.InlineKeyboardMarkup:
     if not busy:
@@ -90,7 +91,7 @@ async def weekly_list(message: types.Message) -> None:
 
     lines = []
     for s in subs:
-        link = GoogleCalendarService.get_event_html_link(s.gcal_event_id) if s.gcal_event_id else None
+        link = await GoogleCalendar.get_event_html_link(s.gcal_event_id) if s.gcal_event_id else None
         lnk = f" — {link}" if link else ""
         lines.append(f"#{s.id}: {_weekday_title(s.weekday)} {s.time_hhmm}{lnk}")
     await message.answer("Ваши еженедельные записи:\n" + "\n".join(lines))
@@ -129,7 +130,7 @@ async def weekly_del(message: types.Message) -> None:
 
         try:
             if sub.gcal_event_id:
-                GoogleCalendarService.delete_event(sub.gcal_event_id)
+                await GoogleCalendar.delete_event(sub.gcal_event_id)
         except Exception:
             pass
         try:
@@ -244,12 +245,12 @@ async def weekly_confirm(message: types.Message, state: FSMContext):
         user = await BookingService.ensure_user(session, u.id, (u.full_name or ""))
         sub = WeeklySubscription(
             user_id=user.id, student_name=name, student_contact=contact,
-            weekday=wday, time_hhmm=hhmm, duration_min=90, is_active=True
+            weekday=wday, time_hhmm=hhmm, minute_of_day=hhmm_to_minutes(hhmm), duration_min=90, is_active=True
         )
         session.add(sub); await session.flush()
 
         try:
-            gcal_id = GoogleCalendarService.create_recurring_event(
+            gcal_id = await GoogleCalendar.create_recurring_event(
                 summary=f"Занятие (еженедельное): {name}",
                 weekday=wday, time_hhmm=hhmm, duration_min=90,
                 attendee_email=contact if ("@" in contact) else None,
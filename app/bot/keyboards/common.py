@@ -6,7 +6,7 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
 from app.storage.models import Booking
-from app.utils.dates import format_day_ru
+from app.utils.dates import format_day_ru, to_local
 
 def kb_days_with_counts(days: Sequence[tuple[date, int]]) -> InlineKeyboardMarkup:
     kb = InlineKeyboardBuilder()
@@ -35,7 +35,7 @@ def kb_my_bookings(bookings: Sequence[Booking]) -> InlineKeyboardMarkup:
             else:
                 if b.slot is None:
                     continue  # Пропускаем записи без слота
-                dt = b.slot.start_at
+                dt = to_local(b.slot.start_at)
                 text = f"{dt:%d.%m %H:%M} • {b.student_name}"
             kb.button(text=text, callback_data="noop")
     kb.adjust(1)
@@ -54,7 +54,7 @@ def kb_admin_bookings(bookings: Sequence[Booking]) -> InlineKeyboardMarkup:
         b.row(InlineKeyboardButton(text="=== ОДИНОЧНЫЕ ЗАНЯТИЯ ===", callback_data="noop"))
         for bk in single_bookings:
             if bk.slot:
-                dt = bk.slot.start_at
+                dt = to_local(bk.slot.start_at)
                 text = f"{dt:%d.%m %H:%M} • {bk.student_name}"
             else:
                 text = f"Без слота • {bk.student_name}"
@@ -0,0 +1,224 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+from urllib.parse import quote
+
+import aiohttp
+
+from app.config import settings
+from app.utils.metrics import metrics
+
+log = logging.getLogger("gcal.async")
+
+DEFAULT_API_URL = "https://www.googleapis.com/calendar/v3"
+
+TokenProvider = Callable[[bool], Awaitable[Optional[str]]]
+
+
+class CalendarApiError(Exception):
+    def __init__(self, status: int, detail: Any):
+        super().__init__(f"Calendar API {status}: {detail}")
+        self.status = status
+        self.detail = detail
+
+
+class _OAuthTokenProvider:
+    """Токен доступа из тех же файлов, что и GoogleCalendarService._service_oauth.
+
+    Обновление токена (google-auth, requests) блокирующее — выполняется в потоке.
+    """
+
+    def __init__(self) -> None:
+        self._creds = None
+        self._token_path: Optional[Path] = None
+        self._lock = asyncio.Lock()
+
+    def _load(self):
+        from google.oauth2.credentials import Credentials as UserCreds
+        from google.oauth2.service_account import Credentials as SvcCreds
+
+        from app.services.google_calendar_service import (
+            SCOPES,
+            _DEFAULT_CREDS_PATH,
+            _DEFAULT_SA_PATH,
+            _DEFAULT_TOKEN_PATH,
+            _fix_user_token_if_needed,
+        )
+
+        token_path = Path((getattr(settings, "google_oauth_token_path", "") or "").strip() or _DEFAULT_TOKEN_PATH)
+        creds_path = Path((getattr(settings, "google_credentials_json_path", "") or "").strip() or _DEFAULT_CREDS_PATH)
+
+        if token_path.exists():
+            data = _fix_user_token_if_needed(token_path, creds_path)
+            if not data.get("refresh_token"):
+                log.error("gcal: token.json has no refresh_token — пройдите авторизацию заново")
+                return None
+            log.info("gcal: using OAuth user token (%s)", token_path)
+            self._token_path = token_path
+            return UserCreds.from_authorized_user_info(data, scopes=SCOPES)
+
+        if getattr(settings, "google_calendar_allow_service_account", False):
+            sa_path = Path((getattr(settings, "google_credentials_json_path", "") or "").strip() or _DEFAULT_SA_PATH)
+            if sa_path.exists():
+                creds = SvcCreds.from_service_account_file(str(sa_path), scopes=SCOPES)
+                delegate = (getattr(settings, "google_sa_delegate", "") or "").strip()
+                return creds.with_subject(delegate) if delegate else creds
+
+        log.warning("gcal: OAuth token file not found: %s", token_path)
+        return None
+
+    def _refresh(self) -> None:
+        from google.auth.transport.requests import Request
+
+        self._creds.refresh(Request())
+        if self._token_path is not None:
+            try:
+                self._token_path.write_text(self._creds.to_json(), encoding="utf-8")
+            except Exception as e:
+                log.warning("gcal: can't persist refreshed token: %s", e)
+
+    async def __call__(self, force_refresh: bool = False) -> Optional[str]:
+        async with self._lock:
+            if self._creds is None:
+                self._creds = await asyncio.to_thread(self._load)
+                if self._creds is None:
+                    return None
+            if force_refresh or not self._creds.valid:
+                await asyncio.to_thread(self._refresh)
+            return self._creds.token
+
+
+class AsyncCalendarClient:
+    """Асинхронный клиент Google Calendar API v3 поверх aiohttp.
+
+    Одна ClientSession на процесс (keep-alive соединений), таймаут на каждый
+    вызов, повтор запроса с обновлённым токеном при 401. base_url и
+    token_provider можно подменить — так клиент проверяется на локальном
+    HTTP-сервере (scripts/test_async_calendar_client.py).
+    """
+
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        token_provider: Optional[TokenProvider] = None,
+        calendar_id: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ) -> None:
+        self.base_url = (base_url or settings.google_calendar_api_url or DEFAULT_API_URL).rstrip("/")
+        self.calendar_id = calendar_id or getattr(settings, "google_calendar_id", "primary")
+        self.timeout = timeout if timeout is not None else settings.google_calendar_timeout_seconds
+        self._token_provider: TokenProvider = token_provider or _OAuthTokenProvider()
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    # --- транспорт ---
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=10, keepalive_timeout=60),
+                headers={"Accept": "application/json"},
+            )
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def _events_url(self, event_id: Optional[str] = None) -> str:
+        url = f"{self.base_url}/calendars/{quote(self.calendar_id, safe='')}/events"
+        return f"{url}/{quote(event_id, safe='')}" if event_id else url
+
+    async def _request(
+        self,
+        method: str,
+        url: str,
+        *,
+        params: Optional[Dict[str, Any]] = None,
+        json: Optional[Dict[str, Any]] = None,
+        timeout: Optional[float] = None,
+    ) -> Optional[Dict[str, Any]]:
+        params = {k: str(v) for k, v in (params or {}).items() if v is not None}
+        client_timeout = aiohttp.ClientTimeout(total=timeout if timeout is not None else self.timeout)
+
+        for attempt in (1, 2):
+            token = await self._token_provider(attempt == 2)
+            if not token:
+                raise CalendarApiError(401, "no usable credentials (OAuth token missing/invalid)")
+
+            # Каждый HTTP-вызов расходует квоту Calendar API — считаем все, включая повторы
+            metrics.incr("gcal.calls")
+            metrics.incr(f"gcal.calls.{method}")
+            with metrics.timer("gcal.latency"):
+                resp = await self._get_session().request(
+                    method, url,
+                    params=params, json=json, timeout=client_timeout,
+                    headers={"Authorization": f"Bearer {token}"},
+                )
+            async with resp:
+                if resp.status == 401 and attempt == 1:
+                    log.info("gcal.async: 401 on %s %s — refreshing token", method, url)
+                    continue
+                if resp.status == 204:
+                    return None
+                try:
+                    data = await resp.json(content_type=None)
+                except Exception:
+                    data = await resp.text()
+                if resp.status >= 400:
+                    metrics.incr("gcal.errors")
+                    detail = data.get("error", data) if isinstance(data, dict) else data
+                    raise CalendarApiError(resp.status, detail)
+                return data
+        return None
+
+    # --- события ---
+
+    async def insert_event(self, body: Dict[str, Any], *, send_updates: str = "all", **params: Any) -> Dict[str, Any]:
+        return await self._request("POST", self._events_url(), params={"sendUpdates": send_updates, **params}, json=body)
+
+    async def get_event(self, event_id: str) -> Dict[str, Any]:
+        return await self._request("GET", self._events_url(event_id))
+
+    async def update_event(self, event_id: str, body: Dict[str, Any], *, send_updates: str = "all") -> Dict[str, Any]:
+        return await self._request("PUT", self._events_url(event_id), params={"sendUpdates": send_updates}, json=body)
+
+    async def patch_event(self, event_id: str, body: Dict[str, Any], *, send_updates: str = "all") -> Dict[str, Any]:
+        return await self._request("PATCH", self._events_url(event_id), params={"sendUpdates": send_updates}, json=body)
+
+    async def delete_event(self, event_id: str, *, send_updates: str = "all") -> None:
+        await self._request("DELETE", self._events_url(event_id), params={"sendUpdates": send_updates})
+
+    async def list_events(self, time_min: datetime, time_max: datetime, **params: Any) -> Dict[str, Any]:
+        query = {
+            "timeMin": time_min.isoformat(),
+            "timeMax": time_max.isoformat(),
+            "singleEvents": "true",
+            "orderBy": "startTime",
+            **params,
+        }
+        return await self._request("GET", self._events_url(), params=query)
+
+    async def freebusy(
+        self, time_min: datetime, time_max: datetime, calendar_ids: Optional[Iterable[str]] = None,
+    ) -> Dict[str, Any]:
+        body = {
+            "timeMin": time_min.isoformat(),
+            "timeMax": time_max.isoformat(),
+            "items": [{"id": cid} for cid in (calendar_ids or [self.calendar_id])],
+        }
+        return await self._request("POST", f"{self.base_url}/freeBusy", json=body)
+
+
+_client: Optional[AsyncCalendarClient] = None
+
+
+def get_client() -> AsyncCalendarClient:
+    global _client
+    if _client is None:
+        _client = AsyncCalendarClient()
+    return _client
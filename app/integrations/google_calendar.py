@@ -1,51 +1,165 @@
-from app.config import settings
-from app.services.google_calendar_service import GoogleCalendarService
 import logging
+from datetime import datetime
+from typing import Iterable, Optional
+
+from app.config import settings
+from app.integrations.gcal_client import CalendarApiError, get_client
+from app.services.google_calendar_service import GoogleCalendarService, _TZ_NAME
+from app.utils.metrics import metrics
 
 log = logging.getLogger(__name__)
 
+# Google Calendar отвечает 404/410 на уже удалённое событие
+_GONE = (404, 410)
+
+
 class GoogleCalendar:
-    enabled = settings.google_calendar_enabled
+    """Асинхронный фасад Google Calendar поверх AsyncCalendarClient.
+
+    Не блокирует event loop бота. Тела событий собирает GoogleCalendarService,
+    поэтому события из sync- и async-пути совпадают.
+    """
 
     @staticmethod
-    async def upsert_event(booking_id: int, start_at, student: str, contact: str = None):
-        if not GoogleCalendar.enabled:
+    def enabled() -> bool:
+        return bool(settings.google_calendar_enabled)
+
+    @staticmethod
+    async def upsert_event(booking_id: int, start_at, student: str, contact: str = None, event_id: str = None):
+        """Создаёт событие записи и возвращает его id.
+
+        С event_id (строчные a-v и цифры, 5–1024 символа) событие создаётся
+        под этим id, и повтор вызова не создаёт второе: Google отвечает 409,
+        а событие уже есть.
+        """
+        if not GoogleCalendar.enabled():
             return None
-        
+
         try:
             # Создаем новое событие в календаре
-            event_id = GoogleCalendarService.create_event(booking_id, start_at, student, contact)
+            body = GoogleCalendarService._create_body(booking_id, start_at, student, contact)
+            if event_id:
+                body["id"] = event_id
+            ev = await get_client().insert_event(body, send_updates="all", conferenceDataVersion=1)
+            event_id = (ev or {}).get("id")
             if event_id:
+                metrics.incr("gcal.events.created")
                 log.info(f"Created Google Calendar event: {event_id} for booking {booking_id}")
+            else:
+                log.error(f"No event ID returned for booking {booking_id}")
             return event_id
+        except CalendarApiError as e:
+            if event_id and e.status == 409:
+                log.info(f"Google Calendar event {event_id} for booking {booking_id} already exists")
+                return event_id
+            log.error(f"Failed to create Google Calendar event: {e}")
+            return None
         except Exception as e:
             log.error(f"Failed to create Google Calendar event: {e}")
             return None
 
     @staticmethod
     async def delete_event(event_id: str):
-        if not GoogleCalendar.enabled:
+        if not GoogleCalendar.enabled() or not event_id:
             return False
-        
+
         try:
-            success = GoogleCalendarService.delete_event(event_id)
-            if success:
-                log.info(f"Deleted Google Calendar event: {event_id}")
-            return success
+            await get_client().delete_event(event_id, send_updates="all")
+            log.info(f"Deleted Google Calendar event: {event_id}")
+            return True
+        except CalendarApiError as e:
+            if e.status in _GONE:
+                log.warning(f"Google Calendar event {event_id} not found (already deleted?)")
+                return True  # Считаем успехом если событие уже удалено
+            log.error(f"Failed to delete Google Calendar event: {e}")
+            return False
         except Exception as e:
             log.error(f"Failed to delete Google Calendar event: {e}")
             return False
 
     @staticmethod
     async def update_event(event_id: str, start_at, student: str, contact: str = None):
-        if not GoogleCalendar.enabled:
+        if not GoogleCalendar.enabled() or not event_id:
             return False
-        
+
         try:
-            success = GoogleCalendarService.update_event(event_id, start_at, student, contact)
-            if success:
-                log.info(f"Updated Google Calendar event: {event_id}")
-            return success
+            client = get_client()
+            existing = await client.get_event(event_id)
+            body = GoogleCalendarService._event_body(start_at, student, contact)
+            # Сохраняем служебные поля существующего события
+            for key in ("id", "status", "created", "creator", "organizer", "htmlLink"):
+                if key in existing:
+                    body[key] = existing[key]
+            await client.update_event(event_id, body, send_updates="all")
+            log.info(f"Updated Google Calendar event: {event_id}")
+            return True
         except Exception as e:
             log.error(f"Failed to update Google Calendar event: {e}")
-            return False
\ No newline at end of file
+            return False
+
+    @staticmethod
+    async def patch_event(
+        event_id: str,
+        start_at: datetime,
+        student: str,
+        contact: Optional[str],
+        booking_id: int = None,
+        fields: Optional[Iterable[str]] = None,
+    ) -> Optional[str]:
+        """PATCH изменённых полей одним вызовом; пересоздание только при 404/410.
+
+        Возвращает id актуального события (новый, если событие пересоздано).
+        """
+        if not GoogleCalendar.enabled() or not event_id:
+            return None
+
+        body = GoogleCalendarService._patch_body(booking_id, start_at, student, contact, fields)
+        try:
+            await get_client().patch_event(event_id, body, send_updates="all")
+            log.info(f"Patched Google Calendar event {event_id}: fields={sorted(body)}")
+            return event_id
+        except CalendarApiError as e:
+            if e.status in _GONE:
+                log.warning(f"Google Calendar event {event_id} is gone, recreating")
+                return await GoogleCalendar.upsert_event(booking_id, start_at, student, contact)
+            log.error(f"Failed to patch Google Calendar event: {e}")
+            return None
+        except Exception as e:
+            log.error(f"Failed to patch Google Calendar event: {e}")
+            return None
+
+    @staticmethod
+    async def get_event_html_link(event_id: str) -> Optional[str]:
+        if not GoogleCalendar.enabled() or not event_id:
+            return None
+        try:
+            ev = await get_client().get_event(event_id)
+            return (ev or {}).get("htmlLink")
+        except Exception as e:
+            log.warning(f"Failed to get Google Calendar event link: {e}")
+            return None
+
+    @staticmethod
+    async def create_recurring_event(
+        summary: str,
+        weekday: int,
+        time_hhmm: str,
+        duration_min: int,
+        attendee_email: Optional[str],
+        timezone: str = _TZ_NAME,
+    ) -> Optional[str]:
+        if not GoogleCalendar.enabled():
+            return None
+        try:
+            body = GoogleCalendarService._recurring_body(
+                summary, weekday, time_hhmm, duration_min, attendee_email, timezone
+            )
+            ev = await get_client().insert_event(body, send_updates="all")
+            return (ev or {}).get("id")  # master/series id
+        except Exception as e:
+            log.error(f"Failed to create recurring Google Calendar event: {e}")
+            return None
+
+    @staticmethod
+    async def delete_recurring_series(event_id: str) -> bool:
+        return await GoogleCalendar.delete_event(event_id)
@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import smtplib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage
+from typing import List, Optional
+
+from app.config import settings
+from app.utils.metrics import metrics
+
+log = logging.getLogger("smtp.sender")
+
+
+class _Connection:
+    """Одно авторизованное SMTP-соединение, живущее между письмами.
+
+    Методы блокирующие и вызываются только из пула потоков, причём каждым
+    соединением в любой момент пользуется ровно один воркер.
+    """
+
+    def __init__(self, idle_seconds: float) -> None:
+        self.idle_seconds = idle_seconds
+        self._smtp: Optional[smtplib.SMTP] = None
+        self._last_used = 0.0
+
+    def _open(self) -> smtplib.SMTP:
+        timeout = settings.smtp_timeout_seconds
+        if settings.smtp_port == 465:
+            smtp = smtplib.SMTP_SSL(settings.smtp_host, settings.smtp_port, timeout=timeout)
+        else:
+            smtp = smtplib.SMTP(settings.smtp_host, settings.smtp_port, timeout=timeout)
+            if settings.smtp_starttls:
+                smtp.starttls()
+        if settings.smtp_user and settings.smtp_password:
+            smtp.login(settings.smtp_user, settings.smtp_password)
+        metrics.incr("smtp.connects")
+        return smtp
+
+    def send(self, msg: EmailMessage) -> None:
+        # Серверы закрывают простаивающие соединения — не ждём, пока это всплывёт ошибкой
+        if self._smtp is not None and time.monotonic() - self._last_used > self.idle_seconds:
+            self.close()
+        if self._smtp is None:
+            self._smtp = self._open()
+        try:
+            self._smtp.send_message(msg)
+        except (smtplib.SMTPServerDisconnected, smtplib.SMTPResponseException) as e:
+            # Соединение закрыли раньше нашего таймаута (обрыв или 421): одна попытка на свежем
+            if isinstance(e, smtplib.SMTPResponseException) and e.smtp_code != 421:
+                raise
+            self.close()
+            self._smtp = self._open()
+            self._smtp.send_message(msg)
+        self._last_used = time.monotonic()
+
+    def close(self) -> None:
+        smtp, self._smtp = self._smtp, None
+        if smtp is None:
+            return
+        try:
+            smtp.quit()
+        except Exception:
+            smtp.close()
+
+
+def _permanent(e: Exception) -> bool:
+    """5xx и отказ по всем получателям повторять бессмысленно"""
+    if isinstance(e, smtplib.SMTPRecipientsRefused):
+        return True
+    return isinstance(e, smtplib.SMTPResponseException) and 500 <= e.smtp_code < 600
+
+
+class SmtpSender:
+    """Асинхронная отправка писем через пул постоянных SMTP-соединений.
+
+    SMTP_POOL_SIZE воркеров, у каждого своё авторизованное соединение, которое
+    переоткрывается после SMTP_IDLE_SECONDS простоя. Очередь ограничена
+    SMTP_QUEUE_SIZE: при переполнении send ждёт места. Временные ошибки
+    повторяются с экспоненциальной паузой до SMTP_MAX_RETRIES раз.
+    """
+
+    def __init__(
+        self,
+        pool_size: Optional[int] = None,
+        queue_size: Optional[int] = None,
+        max_retries: Optional[int] = None,
+        idle_seconds: Optional[float] = None,
+        backoff_seconds: float = 1.0,
+    ) -> None:
+        self.pool_size = pool_size or settings.smtp_pool_size
+        self.queue_size = queue_size or settings.smtp_queue_size
+        self.max_retries = settings.smtp_max_retries if max_retries is None else max_retries
+        self.idle_seconds = settings.smtp_idle_seconds if idle_seconds is None else idle_seconds
+        self.backoff_seconds = backoff_seconds
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._connections: List[_Connection] = []
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    async def send(self, msg: EmailMessage) -> bool:
+        """Ставит письмо в очередь и ждёт результата: True — письмо принято сервером"""
+        loop = asyncio.get_running_loop()
+        self._ensure_workers()
+        future = loop.create_future()
+        await self._queue.put((msg, future))
+        metrics.set("smtp.queue.depth", self._queue.qsize())
+        return await future
+
+    async def close(self) -> None:
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self._executor is not None:
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(
+                *(loop.run_in_executor(self._executor, c.close) for c in self._connections),
+                return_exceptions=True,
+            )
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        self._connections = []
+
+    # --- внутреннее ---
+
+    def _ensure_workers(self) -> None:
+        if self._workers and not any(task.done() for task in self._workers):
+            return
+        if self._executor is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+            self._executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix="smtp")
+            self._connections = [_Connection(self.idle_seconds) for _ in range(self.pool_size)]
+            self._workers = [
+                asyncio.create_task(self._run(conn), name=f"smtp-{i}") for i, conn in enumerate(self._connections)
+            ]
+            return
+        # Упавший воркер перезапускается на своём соединении и той же очереди
+        for i, task in enumerate(self._workers):
+            if task.done():
+                if not task.cancelled() and task.exception():
+                    log.error(f"smtp-{i} worker died: {task.exception()!r}, restarting")
+                self._workers[i] = asyncio.create_task(self._run(self._connections[i]), name=f"smtp-{i}")
+
+    async def _run(self, conn: _Connection) -> None:
+        while True:
+            msg, future = await self._queue.get()
+            metrics.set("smtp.queue.depth", self._queue.qsize())
+            if future.done():  # отправитель уже не ждёт
+                continue
+            ok = await self._deliver(conn, msg)
+            if not future.done():
+                future.set_result(ok)
+
+    async def _deliver(self, conn: _Connection, msg: EmailMessage) -> bool:
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.max_retries + 1):
+            try:
+                with metrics.timer("smtp.send.latency"):
+                    await loop.run_in_executor(self._executor, conn.send, msg)
+                metrics.incr("smtp.sent")
+                return True
+            except Exception as e:
+                await loop.run_in_executor(self._executor, conn.close)
+                if _permanent(e) or attempt == self.max_retries:
+                    metrics.incr("smtp.errors")
+                    log.error(f"Failed to send email to {msg['To']}: {e}")
+                    return False
+                metrics.incr("smtp.retries")
+                delay = self.backoff_seconds * 2 ** attempt
+                log.warning(f"SMTP error for {msg['To']}: {e}; retry in {delay:g}s")
+                await asyncio.sleep(delay)
+        return False
+
+
+_sender: Optional[SmtpSender] = None
+
+
+def get_sender() -> SmtpSender:
+    global _sender
+    if _sender is None:
+        _sender = SmtpSender()
+    return _sender
@@ -0,0 +1,253 @@
+from __future__ import annotations
+
+import asyncio
+import itertools
+import logging
+from contextvars import ContextVar
+from dataclasses import dataclass
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+from app.config import settings
+from app.utils.metrics import metrics
+
+log = logging.getLogger("telegram.queue")
+
+# Вызов Bot API выполняет сама очередь — middleware его не перехватывает
+_dispatching: ContextVar[bool] = ContextVar("telegram_queue_dispatching", default=False)
+
+
+class Priority(IntEnum):
+    """Чем меньше, тем раньше уходит сообщение"""
+
+    INTERACTIVE = 0  # ответы и уведомления по действию пользователя
+    REMINDER = 1     # напоминания о занятиях
+    BROADCAST = 2    # массовые рассылки
+
+
+@dataclass
+class _Outgoing:
+    chat_id: int
+    call: Callable[[], Awaitable[Any]]
+    priority: Priority
+    future: asyncio.Future
+    enqueued_at: float
+    seq: int = 0
+    attempts: int = 0
+
+
+class _TokenBucket:
+    """Глобальный лимит: rate сообщений в секунду с запасом burst"""
+
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self._tokens = self.burst
+        self._updated = 0.0
+        self._paused_until = 0.0
+
+    def delay(self, now: float) -> float:
+        """Забирает токен и возвращает 0 или сколько ждать до следующего"""
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self._updated:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    def pause(self, until: float) -> None:
+        self._paused_until = max(self._paused_until, until)
+        self._tokens = 0.0
+
+
+class TelegramQueue:
+    """Общая очередь исходящих сообщений бота.
+
+    Глобальный token bucket (TELEGRAM_RATE_PER_SECOND), не чаще одного
+    сообщения в чат за TELEGRAM_CHAT_INTERVAL_SECONDS, приоритеты и
+    повтор после 429 с паузой на retry_after для всей очереди. Сообщения
+    одного приоритета уходят в порядке постановки. send_message ждёт
+    фактической отправки и возвращает Message либо пробрасывает ошибку.
+
+    Ответы хендлеров попадают сюда через QueueRequestMiddleware с
+    приоритетом INTERACTIVE. Интервал на чат их не задерживает — это ответ
+    на действие самого пользователя, — но они тратят общий лимит и сдвигают
+    следующую фоновую отправку в тот же чат.
+    """
+
+    def __init__(
+        self,
+        rate: Optional[float] = None,
+        chat_interval: Optional[float] = None,
+        concurrency: Optional[int] = None,
+        max_retries: Optional[int] = None,
+    ) -> None:
+        rate = rate or settings.telegram_rate_per_second
+        self._bucket = _TokenBucket(rate, burst=rate)
+        self._chat_interval = settings.telegram_chat_interval_seconds if chat_interval is None else chat_interval
+        self._concurrency = concurrency or settings.telegram_send_concurrency
+        self._max_retries = settings.telegram_max_retries if max_retries is None else max_retries
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._chat_ready: Dict[int, float] = {}
+        self._inflight: set[asyncio.Task] = set()
+        self._seq = itertools.count()
+
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    async def send_message(
+        self, chat_id: int, text: str, priority: Priority = Priority.REMINDER, **kwargs: Any
+    ):
+        from app.runtime import get_bot
+
+        return await self.submit(chat_id, lambda: get_bot().send_message(chat_id, text, **kwargs), priority)
+
+    async def submit(self, chat_id: int, call: Callable[[], Awaitable[Any]], priority: Priority):
+        """Любой вызов Bot API в чат через очередь; call может быть повторён после 429"""
+        loop = asyncio.get_running_loop()
+        self._ensure_worker()
+        item = _Outgoing(
+            chat_id=int(chat_id), call=call, priority=priority,
+            future=loop.create_future(), enqueued_at=loop.time(), seq=next(self._seq),
+        )
+        self._put(item)
+        return await item.future
+
+    async def close(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, *self._inflight, return_exceptions=True)
+            self._worker = None
+        # Не оставляем отправителей ждать вечно
+        while self._queue is not None and not self._queue.empty():
+            _, _, item = self._queue.get_nowait()
+            item.future.cancel()
+        self._queue = self._slots = None
+
+    # --- внутреннее ---
+
+    def _ensure_worker(self) -> None:
+        if self._worker is not None and not self._worker.done():
+            return
+        if self._worker is not None and not self._worker.cancelled() and self._worker.exception():
+            log.error(f"telegram.queue: worker died: {self._worker.exception()!r}, restarting")
+        # Новый воркер берёт ту же очередь: отправители, которые уже в ней, дождутся ответа
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+            self._slots = asyncio.Semaphore(self._concurrency)
+        self._worker = asyncio.create_task(self._run(), name="telegram-queue")
+
+    def _put(self, item: _Outgoing) -> None:
+        self._queue.put_nowait((item.priority, item.seq, item))
+        metrics.set("telegram.queue.depth", self._queue.qsize())
+
+    def _put_later(self, item: _Outgoing, delay: float) -> None:
+        asyncio.get_running_loop().call_later(delay, self._put, item)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            _, _, item = await self._queue.get()
+            metrics.set("telegram.queue.depth", self._queue.qsize())
+            if item.future.done():  # отправитель уже не ждёт (отмена, таймаут)
+                continue
+
+            # Чат ещё «остывает» — откладываем, не задерживая остальные чаты
+            chat_wait = self._chat_ready.get(item.chat_id, 0.0) - loop.time()
+            if chat_wait > 0 and item.priority != Priority.INTERACTIVE:
+                self._put_later(item, chat_wait)
+                continue
+
+            try:
+                while (wait := self._bucket.delay(loop.time())) > 0:
+                    await asyncio.sleep(wait)
+                await self._slots.acquire()
+            except asyncio.CancelledError:
+                # Сообщение ещё не ушло — возвращаем его в очередь: его заберёт
+                # перезапущенный воркер или отменит close()
+                self._put(item)
+                raise
+
+            now = loop.time()
+            self._chat_ready[item.chat_id] = now + self._chat_interval
+            if len(self._chat_ready) > 10_000:
+                self._chat_ready = {c: t for c, t in self._chat_ready.items() if t > now}
+            metrics.observe("telegram.queue.wait", now - item.enqueued_at)
+
+            task = asyncio.create_task(self._send(item))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _send(self, item: _Outgoing) -> None:
+        loop = asyncio.get_running_loop()
+        _dispatching.set(True)
+        try:
+            with metrics.timer("telegram.send.latency"):
+                result = await item.call()
+            metrics.incr("telegram.sent")
+            metrics.incr(f"telegram.sent.{item.priority.name.lower()}")
+            if not item.future.done():
+                item.future.set_result(result)
+        except TelegramRetryAfter as e:
+            metrics.incr("telegram.retry_after")
+            # Лимит Telegram общий — замолкаем целиком на retry_after
+            resume_at = loop.time() + e.retry_after
+            self._bucket.pause(resume_at)
+            self._chat_ready[item.chat_id] = resume_at
+            item.attempts += 1
+            if item.attempts <= self._max_retries:
+                log.warning(f"telegram.queue: 429 for chat {item.chat_id}, retry in {e.retry_after}s")
+                self._put(item)
+            elif not item.future.done():
+                item.future.set_exception(e)
+        except Exception as e:
+            metrics.incr("telegram.errors")
+            if not item.future.done():
+                item.future.set_exception(e)
+        finally:
+            self._slots.release()
+
+
+class QueueRequestMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: отправки и правки сообщений хендлеров — через очередь.
+
+    Регистрируется в main.py (bot.session.middleware). Остальные методы
+    (answerCallbackQuery, getMe, sendChatAction…) идут напрямую: это не
+    сообщения, и лимит рассылок на них не распространяется.
+    """
+
+    _PREFIXES = ("Send", "Edit", "Copy", "Forward")
+    _DIRECT = {"SendChatAction"}
+
+    def __init__(self, queue: TelegramQueue) -> None:
+        self._queue = queue
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        chat_id = getattr(method, "chat_id", None)
+        if (
+            _dispatching.get()
+            or not isinstance(chat_id, int)
+            or name in self._DIRECT
+            or not name.startswith(self._PREFIXES)
+        ):
+            return await make_request(bot, method)
+        return await self._queue.submit(chat_id, lambda: make_request(bot, method), Priority.INTERACTIVE)
+
+
+_queue: Optional[TelegramQueue] = None
+
+
+def get_queue() -> TelegramQueue:
+    global _queue
+    if _queue is None:
+        _queue = TelegramQueue()
+    return _queue
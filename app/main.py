@@ -12,7 +12,12 @@ from sqlalchemy import text
 
 from app.config import settings
 from app.storage.db import engine, Base, SessionLocal
+from app.storage.migrations import lock_schema, run_migrations
 from app.scheduler.jobs import setup_scheduler
+from app.services.availability_index import availability_index
+from app.integrations.gcal_client import get_client as get_calendar_client
+from app.integrations.telegram_queue import QueueRequestMiddleware, get_queue as get_telegram_queue
+from app.integrations.smtp_sender import get_sender as get_smtp_sender
 
 from app.bot.handlers import start, courses, calendar, booking, weekly_ui, manage
 
@@ -40,15 +45,21 @@ async def _set_commands(bot: Bot) -> None:
 
 async def init_db() -> None:
     async with engine.begin() as conn:
+        await conn.run_sync(lock_schema)
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(run_migrations)
     async with engine.begin() as conn:
         await conn.execute(text("select 1"))
+    async with SessionLocal() as session:
+        await availability_index.rebuild(session)
 
 async def main() -> None:
     logging.basicConfig(level=logging.INFO, stream=sys.stdout)
     await init_db()
 
     bot = Bot(token=settings.bot_token, default=DefaultBotProperties(parse_mode="HTML"))
+    # Ответы хендлеров — через общую очередь с приоритетом INTERACTIVE
+    bot.session.middleware(QueueRequestMiddleware(get_telegram_queue()))
     rt_set_bot(bot)
 
     dp = Dispatcher(storage=MemoryStorage())
@@ -70,7 +81,12 @@ async def main() -> None:
     rt_set_scheduler(scheduler)
 
     await _set_commands(bot)
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await get_telegram_queue().close()
+        await get_smtp_sender().close()
+        await get_calendar_client().close()
 
 if __name__ == "__main__":
     try:
@@ -1,153 +1,198 @@
 from __future__ import annotations
 
 import logging
+import time
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 
-from sqlalchemy import select
-from sqlalchemy.orm import selectinload
+from sqlalchemy import select, update
 
 from app.config import settings
-from app.storage.models import Booking
+from app.storage.models import Booking, Occurrence, Slot
 from app.services.reminder_service import ReminderService
-from app.services.google_calendar_service import GoogleCalendarService
-from app.services.email_service import EmailService
-from app.utils.dates import format_dt_ru
+from app.services.calendar_mirror import CalendarMirrorService
+from app.services.calendar_outbox import CalendarOutboxService
+from app.services.email_outbox import EmailOutboxService
+from app.services.recurrence_service import RecurrenceService
+from app.utils.dates import utcnow
 
 log = logging.getLogger("reminders.setup")
 TZ = ZoneInfo(settings.tz)
 
+# Размер пачки при потоковом чтении записей в rebuild_reminders
+_REBUILD_CHUNK = 1000
+
+
+async def rebuild_reminders(scheduler, SessionLocal) -> dict:
+    """Пересчитывает next_remind_at по записям и занятиям серий в будущем.
+
+    В обычной работе не нужна — колонку ведут BookingService и диспетчер.
+    Это ремонт (команда /rebuild_reminders), например после смены
+    REMIND_OFFSETS_MINUTES. Читает только будущие занятия и потоково,
+    пачками по _REBUILD_CHUNK, так что время и память не растут с историей.
+    """
+    started = time.perf_counter()
+    now = utcnow()
+    scanned = scheduled = 0
+
+    async with SessionLocal() as session:
+        # Прошедшие занятия: напоминаний больше не будет
+        cleared = (
+            await session.execute(
+                update(Booking)
+                .where(
+                    Booking.next_remind_at.is_not(None),
+                    Booking.slot_id.in_(select(Slot.id).where(Slot.start_at <= now)),
+                )
+                .values(next_remind_at=None)
+                .execution_options(synchronize_session=False)
+            )
+        ).rowcount
+
+        result = await session.stream(
+            select(Booking.id, Slot.start_at)
+            .join(Slot, Slot.id == Booking.slot_id)
+            .where(Slot.start_at > now)
+            .execution_options(yield_per=_REBUILD_CHUNK)
+        )
+        async for chunk in result.partitions():
+            rows = [
+                {"id": booking_id, "next_remind_at": ReminderService.next_remind_at(start_at, now)}
+                for booking_id, start_at in chunk
+            ]
+            await session.execute(update(Booking), rows)
+            scanned += len(rows)
+            scheduled += sum(1 for r in rows if r["next_remind_at"] is not None)
+
+        # То же для материализованных занятий интервальных серий
+        cleared += (
+            await session.execute(
+                update(Occurrence)
+                .where(Occurrence.next_remind_at.is_not(None), Occurrence.start_at <= now)
+                .values(next_remind_at=None)
+                .execution_options(synchronize_session=False)
+            )
+        ).rowcount
+        result = await session.stream(
+            select(Occurrence.id, Occurrence.start_at)
+            .where(Occurrence.start_at > now)
+            .execution_options(yield_per=_REBUILD_CHUNK)
+        )
+        async for chunk in result.partitions():
+            rows = [
+                {"id": occurrence_id, "next_remind_at": ReminderService.next_remind_at(start_at, now)}
+                for occurrence_id, start_at in chunk
+            ]
+            await session.execute(update(Occurrence), rows)
+            scanned += len(rows)
+            scheduled += sum(1 for r in rows if r["next_remind_at"] is not None)
+        await session.commit()
+
+    stats = {
+        "scanned": scanned,
+        "scheduled": scheduled,
+        "cleared": cleared,
+        "duration_ms": round((time.perf_counter() - started) * 1000),
+    }
+    log.info(
+        "reminders.rebuild done: %s upcoming bookings, %s with reminders, %s past cleared, %s ms",
+        scanned, scheduled, cleared, stats["duration_ms"],
+    )
+    return stats
+
+
 def setup_scheduler(scheduler, SessionLocal, bot) -> None:
-    async def rebuild() -> None:
+    async def bootstrap() -> None:
+        # Занятия серий, до которых дошёл горизонт за время простоя
         try:
-            async with SessionLocal() as session:
-                res = await session.execute(
-                    select(Booking).options(selectinload(Booking.slot))
-                )
-                bookings = list(res.scalars().all())
+            await RecurrenceService.materialize()
+        except Exception:
+            log.exception("recurrence.materialize failed")
 
-            for b in bookings:
-                await ReminderService.schedule_for_booking(scheduler, b)
+        if not settings.reminders_enabled:
+            return
+
+        # Сначала досылаем пропущенное за время простоя, иначе первый тик
+        # диспетчера посчитает эти напоминания просроченными и пропустит
+        try:
+            await ReminderService.catch_up()
+        except Exception:
+            log.exception("reminders.catch_up failed")
 
-            log.info("reminders.rebuild done: %s bookings", len(bookings))
+        # Задачи еженедельных подписок живут в памяти — после рестарта их нет
+        try:
+            await ReminderService.restore_weekly(scheduler)
         except Exception:
-            log.exception("reminders.rebuild failed")
+            log.exception("reminders.weekly restore failed")
+
+        # Диспетчер напоминаний: одна задача на все записи
+        scheduler.add_job(
+            ReminderService.dispatch,
+            trigger="interval",
+            seconds=settings.reminder_tick_seconds,
+            next_run_time=datetime.now(TZ),
+            id="reminders.dispatch",
+            replace_existing=True,
+            coalesce=True,
+            max_instances=1,
+        )
 
     run_at = datetime.now(TZ) + timedelta(seconds=1)
     scheduler.add_job(
-        rebuild,
+        bootstrap,
         trigger="date",
         run_date=run_at,
-        id="reminders.rebuild",
+        id="reminders.bootstrap",
         replace_existing=True,
     )
-    log.info("reminders.rebuild scheduled at %s", run_at)
 
+    # Раскладка интервальных серий на горизонт вперёд — раз в сутки ночью
+    scheduler.add_job(
+        RecurrenceService.materialize,
+        trigger="cron",
+        hour=3,
+        minute=0,
+        id="recurrence.materialize",
+        replace_existing=True,
+        coalesce=True,
+        max_instances=1,
+    )
 
-async def schedule_interval_event_creation(booking_id: int, next_start_at: datetime):
-    """Планирует создание следующего события для интервального занятия"""
-    try:
-        from app.main import get_scheduler
-        scheduler = get_scheduler()
-        if not scheduler:
-            log.error("Scheduler not available for interval event creation")
-            return
-        
-        # Планируем создание события за день до занятия (в воскресенье)
-        notification_time = next_start_at - timedelta(days=1)
-        notification_time = notification_time.replace(hour=12, minute=0, second=0, microsecond=0)
-        
-        # Если время уже прошло, планируем на следующее воскресенье
-        now = datetime.now(TZ)
-        if notification_time <= now:
-            notification_time += timedelta(days=7)
-        
-        job_id = f"interval_event_{booking_id}_{next_start_at.strftime('%Y%m%d')}"
-        
+    # Воркер outbox Google Calendar: забирает то, что не успел kick()
+    # (в т.ч. строки, оставшиеся с прошлого запуска) и повторы после ошибок
+    if settings.google_calendar_enabled:
         scheduler.add_job(
-            create_next_interval_event,
-            trigger="date",
-            run_date=notification_time,
-            args=[booking_id, next_start_at],
-            id=job_id,
+            CalendarOutboxService.drain,
+            trigger="interval",
+            seconds=settings.calendar_outbox_interval_seconds,
+            next_run_time=run_at,
+            id="calendar.outbox",
             replace_existing=True,
+            coalesce=True,
+            max_instances=1,
+        )
+
+    # Воркер outbox писем: повторы после ошибок SMTP и строки с прошлого запуска
+    if settings.smtp_enabled:
+        scheduler.add_job(
+            EmailOutboxService.drain,
+            trigger="interval",
+            seconds=settings.email_outbox_interval_seconds,
+            next_run_time=run_at,
+            id="email.outbox",
+            replace_existing=True,
+            coalesce=True,
+            max_instances=1,
+        )
+
+    # Зеркало календаря — только если включено явно
+    if settings.google_calendar_enabled and settings.google_calendar_mirror_minutes > 0:
+        scheduler.add_job(
+            CalendarMirrorService.refresh,
+            trigger="interval",
+            minutes=settings.google_calendar_mirror_minutes,
+            id="calendar.mirror",
+            replace_existing=True,
+            coalesce=True,
+            max_instances=1,
         )
-        
-        log.info(f"Scheduled interval event creation for booking {booking_id} at {notification_time}")
-        
-    except Exception as e:
-        log.error(f"Failed to schedule interval event creation for booking {booking_id}: {e}")
-
-
-async def create_next_interval_event(booking_id: int, start_at: datetime):
-    """Создает следующее событие для интервального занятия и отправляет уведомление"""
-    try:
-        from app.storage.db import SessionLocal
-        
-        async with SessionLocal() as session:
-            # Получаем запись
-            booking = await session.scalar(
-                select(Booking).where(Booking.id == booking_id)
-            )
-            
-            if not booking or booking.lesson_type != "interval":
-                log.warning(f"Interval booking {booking_id} not found or not interval type")
-                return
-            
-            # Создаем событие в календаре
-            if settings.google_calendar_enabled:
-                weekday_names = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье"]
-                weekday_name = weekday_names[start_at.weekday()]
-                
-                # Создаем новый слот для следующего события
-                from app.storage.models import Slot
-                slot = Slot(start_at=start_at)
-                session.add(slot)
-                await session.flush()
-                
-                # Обновляем слот в записи
-                booking.slot_id = slot.id
-                
-                ev_id = GoogleCalendarService.create_event(
-                    booking.id,
-                    start_at,
-                    f"{booking.student_name} ({weekday_name})",
-                    booking.student_contact,
-                )
-                
-                if ev_id:
-                    # Обновляем ID события в базе
-                    booking.gcal_event_id = ev_id
-                    await session.flush()
-                    log.info(f"Created next interval event: {ev_id} for {start_at}")
-                    
-                    # Планируем следующее событие через неделю
-                    from app.services.booking_service import _schedule_next_interval_event
-                    await _schedule_next_interval_event(session, booking, start_at)
-            
-            # Отправляем уведомление на email
-            if settings.smtp_enabled and EmailService.is_email(booking.student_contact):
-                try:
-                    when_txt = format_dt_ru(start_at.astimezone(TZ))
-                    
-                    success = EmailService.send(
-                        to_email=booking.student_contact,
-                        subject="Напоминание о занятии на следующей неделе",
-                        body=f"Здравствуйте!\n\nНапоминаем о предстоящем занятии:\n"
-                             f"Дата и время: {when_txt}\n"
-                             f"Ученик: {booking.student_name}\n"
-                             f"Контакт: {booking.student_contact}\n\n"
-                             f"Запись #{booking.id}\n\n"
-                             f"С уважением,\nРепетитор"
-                    )
-                    if success:
-                        log.info(f"Sent weekly reminder email to {booking.student_contact} for booking {booking.id}")
-                    else:
-                        log.warning(f"Failed to send weekly reminder email to {booking.student_contact} for booking {booking.id}")
-                except Exception as e:
-                    log.error(f"Failed to send weekly reminder email to {booking.student_contact}: {e}")
-            
-            await session.commit()
-            
-    except Exception as e:
-        log.error(f"Failed to create next interval event for booking {booking_id}: {e}")
\ No newline at end of file
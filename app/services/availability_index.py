@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time as _time
+from datetime import date, datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.services.slot_service import WINDOW_DAYS, _occupied_grid
+from app.services.week_grid import SlotGrid
+from app.utils.dates import to_naive_local, utcnow
+
+log = logging.getLogger("availability")
+
+
+def _naive_local(dt: datetime) -> datetime:
+    """Сетка адресуется локальным временем без tzinfo; в БД и сервисах время — UTC"""
+    return to_naive_local(dt).replace(second=0, microsecond=0)
+
+
+class AvailabilityIndex:
+    """Процессный индекс занятости слотов.
+
+    Строится при старте из таблиц slots/bookings/occurrences (только окно WINDOW_DAYS от
+    текущего дня) и дальше обновляется инкрементально из BookingService
+    и RecurrenceService.
+    Занятость хранится в битовой сетке SlotGrid, свободные слоты дня считаются
+    popcount'ом. Любое изменение увеличивает version; invalidate() помечает
+    индекс устаревшим, и следующее чтение делает полную перестройку из БД.
+    Дополнительно индекс перестраивается по возрасту
+    (settings.availability_rebuild_minutes), чтобы не расходиться с таблицами.
+
+    Индекс у каждого процесса свой: при нескольких репликах изменения другой
+    реплики видны только после перестройки, то есть до
+    AVAILABILITY_REBUILD_MINUTES с опозданием, поэтому индекс — только для
+    показа свободных слотов. Двойную запись разовых занятий не допускают
+    уникальные slots.start_at и bookings.slot_id; занятия серий (occurrences)
+    ими не покрыты, и пересечение с ними проверяют BookingService и
+    RecurrenceService.move в транзакции изменения.
+    """
+
+    def __init__(self) -> None:
+        self._grid: Optional[SlotGrid] = None
+        self._built_at: float = 0.0
+        self._stale = True
+        self._lock = asyncio.Lock()
+        self.version = 0
+
+    # --- чтение ---
+
+    @property
+    def is_stale(self) -> bool:
+        if self._stale or self._grid is None:
+            return True
+        # Индекс хранит только окно WINDOW_DAYS — с наступлением нового дня
+        # в окно входит день, которого нет в снимке
+        if self._grid.start != to_naive_local(utcnow()).date():
+            return True
+        max_age = settings.availability_rebuild_minutes * 60
+        return max_age > 0 and _time.monotonic() - self._built_at > max_age
+
+    async def ensure(self, session: AsyncSession) -> "AvailabilityIndex":
+        if self.is_stale:
+            await self.rebuild(session)
+        return self
+
+    def free_counts(self, now: datetime) -> Dict[date, int]:
+        if self._grid is None:
+            return {}
+        return self._grid.free_counts(_naive_local(now))
+
+    def free_times(self, day: date, now: datetime) -> List[datetime]:
+        if self._grid is None:
+            return []
+        return self._grid.free_times(day, _naive_local(now))
+
+    def weekly_times(self, day: date) -> List[datetime]:
+        if self._grid is None:
+            return []
+        return self._grid.weekly_times(day)
+
+    # --- инкрементальные обновления ---
+
+    def occupy(self, start_at: datetime) -> None:
+        dt = _naive_local(start_at)
+        if self._grid is not None:
+            self._grid.occupy(dt)
+        self._bump("occupy", dt)
+
+    def release(self, start_at: datetime) -> None:
+        dt = _naive_local(start_at)
+        if self._grid is not None:
+            self._grid.release(dt)
+        self._bump("release", dt)
+
+    def move(self, old_start_at: Optional[datetime], new_start_at: datetime) -> None:
+        if old_start_at is not None:
+            self.release(old_start_at)
+        self.occupy(new_start_at)
+
+    def occupy_recurring(self, start_at: datetime) -> None:
+        dt = _naive_local(start_at)
+        if self._grid is not None:
+            self._grid.occupy_recurring(dt)
+        self._bump("occupy_recurring", dt)
+
+    def release_recurring(self, start_at: datetime) -> None:
+        dt = _naive_local(start_at)
+        if self._grid is not None:
+            self._grid.release_recurring(dt)
+        self._bump("release_recurring", dt)
+
+    def move_recurring(self, old_start_at: Optional[datetime], new_start_at: datetime) -> None:
+        if old_start_at is not None:
+            self.release_recurring(old_start_at)
+        self.occupy_recurring(new_start_at)
+
+    def invalidate(self, reason: str = "") -> None:
+        self._stale = True
+        self.version += 1
+        log.info("availability.invalidate version=%s reason=%s", self.version, reason or "—")
+
+    # --- полная перестройка ---
+
+    async def rebuild(self, session: AsyncSession) -> None:
+        async with self._lock:
+            if not self.is_stale:
+                return  # уже перестроен параллельным запросом
+            started = _time.perf_counter()
+            version = self.version
+
+            self._grid = await _occupied_grid(session, to_naive_local(utcnow()).date(), WINDOW_DAYS)
+            self._built_at = _time.monotonic()
+
+            # Если пока мы читали БД индекс успели изменить — снимок мог пропустить
+            # это изменение, поэтому оставляем его устаревшим до следующего чтения
+            self._stale = self.version != version
+            log.info(
+                "availability.rebuild version=%s took=%.1fms",
+                self.version, (_time.perf_counter() - started) * 1000,
+            )
+
+    # --- внутреннее ---
+
+    def _bump(self, what: str, key) -> None:
+        self.version += 1
+        log.debug("availability.%s %s version=%s", what, key, self.version)
+
+
+availability_index = AvailabilityIndex()
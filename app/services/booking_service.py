@@ -4,25 +4,23 @@ import logging
 from datetime import datetime
 from typing import List, Optional
 
-from sqlalchemy import select
-from sqlalchemy.orm import selectinload
-
-from app.config import settings
-from app.storage.models import Booking, Slot, User
+from sqlalchemy import delete, exists, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app.storage.db import dialect_insert
+from app.storage.models import Booking, Occurrence, ReminderDelivery, Slot, User
+from app.services.availability_index import availability_index
+from app.services.calendar_outbox import CalendarOutboxService
+from app.services.email_outbox import EmailOutboxService
+from app.services.recurrence_service import WEEKDAY_NAMES, RecurrenceService
 from app.services.reminder_service import ReminderService
-from app.services.google_calendar_service import GoogleCalendarService
+from app.utils.dates import format_dt_ru, hhmm_to_minutes, to_utc, utcnow
 
 log = logging.getLogger(__name__)
 
 
-def _get_scheduler_safe():
-    try:
-        from app.main import get_scheduler  # импорт только в момент вызова
-        return get_scheduler()
-    except Exception:
-        return None
-
-
 class BookingService:
     @staticmethod
     async def ensure_user(session, tg_id: int, full_name: str) -> User:
@@ -47,98 +45,74 @@ class BookingService:
         contact: Optional[str] = None,
         lesson_type: str = "single",
     ) -> Optional[Booking]:
-        
-        booked_id = await session.scalar(
-            select(Booking.id)
-            .join(Slot, Slot.id == Booking.slot_id)
-            .where(Slot.start_at == start_at)
-            .limit(1)
-        )
-        if booked_id is not None:
-            return None
-
-        slot_id = await session.scalar(
-            select(Slot.id).where(Slot.start_at == start_at).limit(1)
-        )
-        if slot_id is None:
-            new_slot = Slot(start_at=start_at)
-            session.add(new_slot)
-            await session.flush()
-            slot_id = new_slot.id
+        """Атомарная запись на слот.
 
-        booking = Booking(
-            user_id=user.id,
-            slot_id=slot_id,
-            student_name=student_name,
-            student_contact=(contact or None),
-            lesson_type=lesson_type,
-        )
-        session.add(booking)
-        await session.flush()
-        await session.commit()
-
-        booked = await session.scalar(
-            select(Booking)
-            .options(selectinload(Booking.slot))
-            .where(Booking.id == booking.id)
-        )
+        Слот занимается upsert'ом по slots.start_at, запись — вставкой с
+        ON CONFLICT DO NOTHING по uq_booking_slot, поэтому гонка двух учеников
+        за один слот решается базой: проигравший получает None («слот занят»).
+        Занятие серии на это время проверяется в той же транзакции.
+        """
+        insert = dialect_insert(session)
+        start_at = to_utc(start_at)
 
         try:
-            if settings.google_calendar_enabled and booked:
-                ev_id = GoogleCalendarService.create_event(
-                    booked.id,
-                    booked.slot.start_at,
-                    booked.student_name,
-                    booked.student_contact,
+            slot_stmt = insert(Slot).values(start_at=start_at, is_active=True)
+            slot = await session.scalar(
+                slot_stmt.on_conflict_do_update(
+                    index_elements=[Slot.start_at],
+                    set_={"is_active": slot_stmt.excluded.is_active},
+                ).returning(Slot),
+                execution_options={"populate_existing": True},
+            )
+            # Время может быть занято серией — её занятия не в slots
+            if await RecurrenceService.occupied_at(session, start_at):
+                await session.rollback()
+                availability_index.invalidate("book_at: occurrence at slot")
+                return None
+
+            booked = await session.scalar(
+                insert(Booking)
+                .values(
+                    user_id=user.id,
+                    slot_id=slot.id,
+                    student_name=student_name,
+                    student_contact=(contact or None),
+                    lesson_type=lesson_type,
+                    next_remind_at=ReminderService.next_remind_at(start_at),
                 )
-                if ev_id:
-                    booked.gcal_event_id = ev_id
-                    await session.commit()
-                    log.info(f"Created Google Calendar event: {ev_id} for booking {booked.id}")
-                else:
-                    log.error(f"Failed to create Google Calendar event for booking {booked.id}")
-        except Exception as e:
-            log.error(f"Exception creating Google Calendar event for booking {booked.id}: {e}")
+                .on_conflict_do_nothing(index_elements=[Booking.slot_id])
+                .returning(Booking)
+            )
+            if booked is None:
+                await session.rollback()
+                return None
+            CalendarOutboxService.enqueue_create(session, booked.id)
+            # Подтверждение уйдёт из outbox после commit — SMTP не держит запись
+            EmailOutboxService.enqueue(
+                session,
+                booked.student_contact,
+                subject="Подтверждение записи на занятие",
+                body=f"Здравствуйте!\n\nВы успешно записаны на занятие:\n"
+                     f"Дата и время: {format_dt_ru(start_at)}\n"
+                     f"Ученик: {booked.student_name}\n"
+                     f"Контакт: {booked.student_contact}\n\n"
+                     f"Запись #{booked.id}\n\n"
+                     f"С уважением,\nРепетитор",
+                booking_id=booked.id,
+                kind="confirmation",
+            )
+            await session.commit()
+        except IntegrityError as e:
+            await session.rollback()
+            log.warning(f"Slot {start_at} is already taken: {e.orig}")
+            return None
 
-        try:
-            if booked:
-                sched = _get_scheduler_safe()
-                if sched:
-                    await ReminderService.schedule_for_booking(sched, booked)
-                
-                # Отправляем немедленное уведомление на email
-                from app.services.email_service import EmailService
-                if settings.smtp_enabled and EmailService.is_email(booked.student_contact):
-                    try:
-                        from app.utils.dates import format_dt_ru
-                        from zoneinfo import ZoneInfo
-                        
-                        start_at = booked.slot.start_at
-                        if start_at.tzinfo is None:
-                            start_at = start_at.replace(tzinfo=ZoneInfo(settings.tz))
-                        
-                        when_txt = format_dt_ru(start_at.astimezone(ZoneInfo(settings.tz)))
-                        
-                        success = EmailService.send(
-                            to_email=booked.student_contact,
-                            subject="Подтверждение записи на занятие",
-                            body=f"Здравствуйте!\n\nВы успешно записаны на занятие:\n"
-                                 f"Дата и время: {when_txt}\n"
-                                 f"Ученик: {booked.student_name}\n"
-                                 f"Контакт: {booked.student_contact}\n\n"
-                                 f"Запись #{booked.id}\n\n"
-                                 f"С уважением,\nРепетитор"
-                        )
-                        if success:
-                            log.info(f"Sent confirmation email to {booked.student_contact} for booking {booked.id}")
-                        else:
-                            log.warning(f"Failed to send confirmation email to {booked.student_contact} for booking {booked.id}")
-                    except Exception as e:
-                        log.error(f"Failed to send confirmation email to {booked.student_contact}: {e}")
-                else:
-                    log.info(f"Email disabled or invalid email address: {booked.student_contact}")
-        except Exception as e:
-            log.error(f"Exception scheduling reminders for booking {booked.id}: {e}")
+        # Слот уже загружен — связываем без повторного SELECT
+        set_committed_value(booked, "slot", slot)
+        availability_index.occupy(start_at)
+
+        CalendarOutboxService.kick()
+        EmailOutboxService.kick()
 
         return booked
 
@@ -152,6 +126,20 @@ class BookingService:
         )
         return list(res.scalars().all())
 
+    @staticmethod
+    async def interval_between(session, weekday: int, from_minute: int, to_minute: int) -> List[Booking]:
+        """Интервальные записи дня недели со временем в [from_minute, to_minute] (минуты от начала суток)"""
+        res = await session.execute(
+            select(Booking)
+            .where(
+                Booking.lesson_type == "interval",
+                Booking.weekday == weekday,
+                Booking.minute_of_day.between(from_minute, to_minute),
+            )
+            .order_by(Booking.minute_of_day)
+        )
+        return list(res.scalars().all())
+
     @staticmethod
     async def admin_cancel(session, booking_id: int) -> bool:
         booking = await session.scalar(
@@ -164,47 +152,25 @@ class BookingService:
 
         # Сохраняем ID события для удаления из календаря
         gcal_event_id = booking.gcal_event_id
-        gcal_event_ids = booking.gcal_event_ids
         slot = booking.slot
 
-        try:
-            if settings.google_calendar_enabled:
-                # Для одиночных занятий удаляем одно событие
-                if booking.lesson_type == "single" and gcal_event_id:
-                    GoogleCalendarService.delete_event(gcal_event_id)
-                    log.info(f"Deleted Google Calendar event: {gcal_event_id}")
-                
-                # Для интервальных занятий удаляем текущее событие и отменяем запланированные
-                elif booking.lesson_type == "interval":
-                    # Удаляем текущее событие
-                    if gcal_event_id:
-                        GoogleCalendarService.delete_event(gcal_event_id)
-                        log.info(f"Deleted current Google Calendar event: {gcal_event_id}")
-                    
-                    # Отменяем все запланированные задачи для этого занятия
-                    try:
-                        from app.main import get_scheduler
-                        scheduler = get_scheduler()
-                        if scheduler:
-                            # Удаляем все задачи с префиксом для этого занятия
-                            jobs = scheduler.get_jobs()
-                            cancelled_count = 0
-                            for job in jobs:
-                                if job.id.startswith(f"interval_event_{booking_id}_"):
-                                    scheduler.remove_job(job.id)
-                                    cancelled_count += 1
-                            log.info(f"Cancelled {cancelled_count} scheduled interval events for booking {booking_id}")
-                    except Exception as e:
-                        log.error(f"Failed to cancel scheduled interval events: {e}")
-        except Exception as e:
-            log.error(f"Failed to delete Google Calendar events: {e}")
+        # Событие удалит воркер outbox после commit
+        CalendarOutboxService.enqueue_delete(session, booking_id, gcal_event_id)
 
-        try:
-            sched = _get_scheduler_safe()
-            if sched:
-                await ReminderService.cancel_for_booking(sched, booking_id)
-        except Exception as e:
-            log.error(f"Exception canceling reminders for booking {booking_id}: {e}")
+        # Серию и её занятия удаляем явно; события будущих занятий — через outbox
+        released: List[datetime] = []
+        if booking.lesson_type == "interval":
+            released = list(
+                (
+                    await session.scalars(
+                        select(Occurrence.start_at).where(Occurrence.booking_id == booking_id)
+                    )
+                ).all()
+            )
+            await RecurrenceService.cancel(session, booking_id)
+
+        # Журнал напоминаний больше не нужен (id записи может переиспользоваться)
+        await session.execute(delete(ReminderDelivery).where(ReminderDelivery.booking_id == booking_id))
 
         # Удаляем запись
         await session.delete(booking)
@@ -215,35 +181,24 @@ class BookingService:
             log.info(f"Deleted slot {slot.id} for cancelled booking {booking_id}")
         
         await session.commit()
-        return True
+        CalendarOutboxService.kick()
 
-    @staticmethod
-    async def _schedule_next_interval_event(session, booking: Booking, current_start_at: datetime):
-        """Планирует создание следующего события для интервального занятия через неделю"""
-        try:
-            from datetime import timedelta
-            from zoneinfo import ZoneInfo
-            
-            # Вычисляем дату следующего события (через неделю)
-            next_start_at = current_start_at + timedelta(days=7)
-            
-            # Проверяем, что не превышаем лимит (июнь 2026)
-            end_date = datetime(2026, 6, 26, tzinfo=ZoneInfo(settings.tz))
-            if next_start_at > end_date:
-                log.info(f"Interval booking {booking.id} reached end date, no more events scheduled")
-                return
-            
-            # Планируем создание события через неделю
-            from app.scheduler.jobs import schedule_interval_event_creation
-            await schedule_interval_event_creation(booking.id, next_start_at)
-            
-            log.info(f"Scheduled next interval event for booking {booking.id} on {next_start_at}")
-            
-        except Exception as e:
-            log.error(f"Failed to schedule next interval event for booking {booking.id}: {e}")
+        if slot is not None:
+            availability_index.release(slot.start_at)
+        for start_at in released:
+            availability_index.release_recurring(start_at)
+        return True
 
     @staticmethod
     async def reschedule_to(session, booking_id: int, new_start_at: datetime) -> bool:
+        """Атомарный перенос записи на new_start_at.
+
+        Слот занимается upsert'ом по slots.start_at, запись переносится
+        update'ом с условием «слот свободен». Если параллельный перенос или
+        запись заняли слот между ними, uq_booking_slot даёт IntegrityError —
+        транзакция откатывается, результат False, как у занятого слота.
+        Занятие серии на это время проверяется в той же транзакции.
+        """
         booking = await session.scalar(
             select(Booking)
             .options(selectinload(Booking.slot))
@@ -252,66 +207,44 @@ class BookingService:
         if booking is None:
             return False
 
-        new_slot = await session.scalar(
-            select(Slot).where(Slot.start_at == new_start_at).limit(1)
-        )
-        if new_slot is None:
-            new_slot = Slot(start_at=new_start_at)
-            session.add(new_slot)
-            await session.flush()
+        insert = dialect_insert(session)
+        new_start_at = to_utc(new_start_at)
+        old_start_at = booking.slot.start_at if booking.slot is not None else None
+        taken = aliased(Booking)
 
-        taken_id = await session.scalar(
-            select(Booking.id).where(Booking.slot_id == new_slot.id).limit(1)
-        )
-        if taken_id is not None:
+        try:
+            slot_stmt = insert(Slot).values(start_at=new_start_at, is_active=True)
+            new_slot = await session.scalar(
+                slot_stmt.on_conflict_do_update(
+                    index_elements=[Slot.start_at],
+                    set_={"is_active": slot_stmt.excluded.is_active},
+                ).returning(Slot),
+                execution_options={"populate_existing": True},
+            )
+            if await RecurrenceService.occupied_at(session, new_start_at):
+                await session.rollback()
+                availability_index.invalidate("reschedule_to: occurrence at slot")
+                return False
+
+            moved = await session.execute(
+                update(Booking)
+                .where(Booking.id == booking_id, ~exists().where(taken.slot_id == new_slot.id))
+                .values(slot_id=new_slot.id, next_remind_at=ReminderService.next_remind_at(new_start_at))
+                .execution_options(synchronize_session=False)
+            )
+            if moved.rowcount == 0:
+                await session.rollback()
+                return False
+            # Событие в календаре перенесёт воркер outbox после commit (PATCH start/end)
+            CalendarOutboxService.enqueue_update(session, booking_id, fields=("time",))
+            await session.commit()
+        except IntegrityError as e:
+            await session.rollback()
+            log.warning(f"Slot {new_start_at} is already taken: {e.orig}")
             return False
 
-        booking.slot_id = new_slot.id
-        await session.flush()
-        await session.commit()
-
-        booked = await session.scalar(
-            select(Booking)
-            .options(selectinload(Booking.slot))
-            .where(Booking.id == booking_id)
-        )
-
-        if booked:
-            try:
-                if settings.google_calendar_enabled and booked.gcal_event_id:
-                    log.info(f"Force rescheduling event {booked.gcal_event_id} - recreating to ensure calendar update")
-                    
-                    # Используем принудительное обновление с пересозданием
-                    # ВАЖНО: передаем НОВОЕ время (new_start_at), а не старое из базы
-                    new_event_id = GoogleCalendarService.force_update_event(
-                        booked.gcal_event_id,
-                        new_start_at,  # Используем НОВОЕ время, а не booked.slot.start_at
-                        booked.student_name,
-                        booked.student_contact,
-                        booked.id  # Передаем правильный booking_id
-                    )
-                    
-                    if new_event_id:
-                        log.info(f"Successfully force updated Google Calendar event for rescheduling")
-                        # Обновляем ID события в базе данных
-                        booked.gcal_event_id = new_event_id
-                        await session.commit()
-                        log.info(f"Updated booking with new event ID after reschedule: {new_event_id}")
-                    else:
-                        log.error(f"Failed to force update Google Calendar event for rescheduling")
-            except Exception as e:
-                log.error(f"Exception updating Google Calendar event: {e}")
-                import traceback
-                log.error(f"Traceback: {traceback.format_exc()}")
-
-            try:
-                sched = _get_scheduler_safe()
-                if sched:
-                    await ReminderService.cancel_for_booking(sched, booking_id)
-                    await ReminderService.schedule_for_booking(sched, booked)
-            except Exception as e:
-                log.error(f"Exception rescheduling reminders for booking {booking_id}: {e}")
-
+        CalendarOutboxService.kick()
+        availability_index.move(old_start_at, new_start_at)
         return True
 
     @staticmethod
@@ -330,7 +263,6 @@ class BookingService:
         if booking is None:
             return False
 
-        old_contact = booking.student_contact
         changed = False
         if student_name is not None and booking.student_name != student_name:
             booking.student_name = student_name
@@ -340,36 +272,25 @@ class BookingService:
             changed = True
 
         if changed:
+            # Событие в календаре обновит воркер outbox после commit
+            if booking.lesson_type == "interval":
+                occurrence_ids = (
+                    await session.scalars(
+                        select(Occurrence.id).where(
+                            Occurrence.booking_id == booking.id,
+                            Occurrence.start_at > utcnow(),
+                        )
+                    )
+                ).all()
+                for occurrence_id in occurrence_ids:
+                    CalendarOutboxService.enqueue_update(
+                        session, booking.id, fields=("content",), occurrence_id=occurrence_id
+                    )
+            else:
+                CalendarOutboxService.enqueue_update(session, booking.id, fields=("content",))
             await session.commit()
+            CalendarOutboxService.kick()
             log.info(f"Updated booking {booking_id}: student_name={booking.student_name}, contact={booking.student_contact}")
-            
-            try:
-                if settings.google_calendar_enabled and booking.gcal_event_id:
-                    log.info(f"Force updating Google Calendar event {booking.gcal_event_id} for booking {booking_id}")
-                    
-                    # Используем принудительное обновление с пересозданием
-                    new_event_id = GoogleCalendarService.force_update_event(
-                        booking.gcal_event_id,
-                        booking.slot.start_at,
-                        booking.student_name,
-                        booking.student_contact,
-                        booking.id  # Передаем правильный booking_id
-                    )
-                    
-                    if new_event_id:
-                        log.info(f"Successfully force updated Google Calendar event for booking {booking_id}")
-                        # Обновляем ID события в базе данных
-                        booking.gcal_event_id = new_event_id
-                        await session.commit()
-                        log.info(f"Updated booking with new event ID: {new_event_id}")
-                    else:
-                        log.error(f"Failed to force update Google Calendar event for booking {booking_id}")
-                else:
-                    log.warning(f"Google Calendar disabled or no event ID for booking {booking_id}")
-            except Exception as e:
-                log.error(f"Exception updating Google Calendar event content: {e}")
-                import traceback
-                log.error(f"Traceback: {traceback.format_exc()}")
         else:
             log.info(f"No changes detected for booking {booking_id}")
         return True
@@ -384,14 +305,15 @@ class BookingService:
         contact: Optional[str] = None,
     ) -> Optional[Booking]:
         """Бронирование интервального занятия"""
-        
+        minute_of_day = hhmm_to_minutes(time_str)
+
         # Проверяем, не занято ли уже это время для интервальных занятий
         existing = await session.scalar(
             select(Booking.id)
             .where(
                 Booking.lesson_type == "interval",
                 Booking.weekday == weekday,
-                Booking.time_hhmm == time_str
+                Booking.minute_of_day == minute_of_day,
             )
             .limit(1)
         )
@@ -407,87 +329,32 @@ class BookingService:
             lesson_type="interval",
             weekday=weekday,
             time_hhmm=time_str,
+            minute_of_day=minute_of_day,
         )
         session.add(booking)
         await session.flush()
-        await session.commit()
-
-        booked = await session.scalar(
-            select(Booking)
-            .where(Booking.id == booking.id)
+        # Занятия серии на горизонт вперёд — в той же транзакции, события календаря через outbox
+        created = await RecurrenceService.create(session, booking)
+        weekday_name = WEEKDAY_NAMES[weekday] if weekday is not None else "Неизвестно"
+        EmailOutboxService.enqueue(
+            session,
+            booking.student_contact,
+            subject="Подтверждение записи на интервальное занятие",
+            body=f"Здравствуйте!\n\nВы успешно записаны на интервальное занятие:\n"
+                 f"День недели: {weekday_name}\n"
+                 f"Время: {time_str}\n"
+                 f"Ученик: {booking.student_name}\n"
+                 f"Контакт: {booking.student_contact}\n\n"
+                 f"Занятие будет повторяться каждую неделю в это время.\n"
+                 f"Запись #{booking.id}\n\n"
+                 f"С уважением,\nРепетитор",
+            booking_id=booking.id,
+            kind="confirmation",
         )
-
-        # Создаем события в Google Calendar для интервальных занятий
-        try:
-            if settings.google_calendar_enabled and booked:
-                # Создаем только одно событие на ближайшую дату
-                from datetime import datetime, timedelta, time
-                from zoneinfo import ZoneInfo
-                
-                now = datetime.now(ZoneInfo(settings.tz))
-                weekday_names = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье"]
-                
-                # Находим ближайшую дату с этим днем недели
-                days_ahead = (weekday - now.weekday()) % 7
-                if days_ahead == 0:  # Если сегодня тот же день недели
-                    days_ahead = 7  # Берем следующую неделю
-                
-                target_date = now.date() + timedelta(days=days_ahead)
-                hour, minute = map(int, time_str.split(':'))
-                start_at = datetime.combine(target_date, time(hour=hour, minute=minute))
-                start_at = start_at.replace(tzinfo=ZoneInfo(settings.tz))
-                
-                # Создаем событие только для будущих дат
-                if start_at > now:
-                    # Создаем слот для интервального занятия
-                    slot = Slot(start_at=start_at)
-                    session.add(slot)
-                    await session.flush()
-                    
-                    # Связываем слот с записью
-                    booked.slot_id = slot.id
-                    
-                    ev_id = GoogleCalendarService.create_event(
-                        booked.id,
-                        start_at,
-                        f"{booked.student_name} ({weekday_names[weekday]})",
-                        booked.student_contact,
-                    )
-                    if ev_id:
-                        booked.gcal_event_id = ev_id  # Сохраняем ID текущего события
-                        await session.flush()
-                        log.info(f"Created Google Calendar event for interval booking: {ev_id} for {start_at}")
-                        
-                        # Планируем создание следующего события через неделю
-                        await _schedule_next_interval_event(session, booked, start_at)
-        except Exception as e:
-            log.error(f"Exception creating Google Calendar events for interval booking {booked.id}: {e}")
-
-        # Отправляем немедленное уведомление на email для интервальных занятий
-        try:
-            if booked and settings.smtp_enabled and EmailService.is_email(booked.student_contact):
-                weekday_names = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье"]
-                weekday_name = weekday_names[weekday] if weekday is not None else "Неизвестно"
-                
-                success = EmailService.send(
-                    to_email=booked.student_contact,
-                    subject="Подтверждение записи на интервальное занятие",
-                    body=f"Здравствуйте!\n\nВы успешно записаны на интервальное занятие:\n"
-                         f"День недели: {weekday_name}\n"
-                         f"Время: {time_str}\n"
-                         f"Ученик: {booked.student_name}\n"
-                         f"Контакт: {booked.student_contact}\n\n"
-                         f"Занятие будет повторяться каждую неделю в это время.\n"
-                         f"Запись #{booked.id}\n\n"
-                         f"С уважением,\nРепетитор"
-                )
-                if success:
-                    log.info(f"Sent confirmation email to {booked.student_contact} for interval booking {booked.id}")
-                else:
-                    log.warning(f"Failed to send confirmation email to {booked.student_contact} for interval booking {booked.id}")
-            else:
-                log.info(f"Email disabled or invalid email address for interval booking: {booked.student_contact if booked else 'None'}")
-        except Exception as e:
-            log.error(f"Failed to send confirmation email for interval booking {booked.id if booked else 'None'}: {e}")
-
-        return booked
\ No newline at end of file
+        await session.commit()
+        CalendarOutboxService.kick()
+        EmailOutboxService.kick()
+        for start_at in created:
+            availability_index.occupy_recurring(start_at)
+        log.info(f"Interval booking {booking.id}: {len(created)} occurrences materialized")
+        return booking
@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import select
+
+from app.config import settings
+from app.integrations.gcal_client import get_client
+from app.storage.models import Booking, Slot
+from app.utils.metrics import metrics
+
+log = logging.getLogger("gcal.mirror")
+
+TZ = ZoneInfo(settings.tz)
+
+# Максимум, который Calendar API отдаёт за одну страницу events.list
+_PAGE_SIZE = 2500
+
+
+class CalendarMirrorService:
+    """Локальное зеркало событий календаря на google_calendar_mirror_days вперёд.
+
+    Обновляется по расписанию (GOOGLE_CALENDAR_MIRROR_MINUTES > 0) или по
+    команде /gcal_refresh — и больше никогда: создание события в календаре
+    больше не делает попутный events.list. После обновления сверяет зеркало
+    с записями в БД и считает записи, чьих событий в календаре нет.
+    """
+
+    _events: Dict[str, Dict[str, Any]] = {}
+    _refreshed_at: Optional[datetime] = None
+    _lock = asyncio.Lock()
+
+    @classmethod
+    def get(cls, event_id: str) -> Optional[Dict[str, Any]]:
+        return cls._events.get(event_id)
+
+    @classmethod
+    def refreshed_at(cls) -> Optional[datetime]:
+        return cls._refreshed_at
+
+    @classmethod
+    async def refresh(cls, days: Optional[int] = None) -> Dict[str, Any]:
+        from app.storage.db import SessionLocal
+
+        days = days or settings.google_calendar_mirror_days
+        time_min = datetime.now(TZ)
+        time_max = time_min + timedelta(days=days)
+
+        async with cls._lock:
+            started = time.perf_counter()
+            calls_before = metrics.counter("gcal.calls")
+            try:
+                events: Dict[str, Dict[str, Any]] = {}
+                page_token = None
+                while True:
+                    page = await get_client().list_events(
+                        time_min, time_max, maxResults=_PAGE_SIZE, pageToken=page_token,
+                    )
+                    for ev in page.get("items", []):
+                        events[ev["id"]] = ev
+                    page_token = page.get("nextPageToken")
+                    if not page_token:
+                        break
+            except Exception as e:
+                metrics.incr("gcal.mirror.errors")
+                log.error(f"gcal.mirror refresh failed: {e}")
+                raise
+
+            async with SessionLocal() as session:
+                rows = (
+                    await session.execute(
+                        select(Booking.id, Booking.gcal_event_id)
+                        .join(Slot, Slot.id == Booking.slot_id)
+                        .where(
+                            Booking.gcal_event_id.is_not(None),
+                            Slot.start_at.between(time_min, time_max),
+                        )
+                    )
+                ).all()
+            missing = [bid for bid, ev_id in rows if ev_id not in events]
+
+            cls._events = events
+            cls._refreshed_at = datetime.now(TZ)
+            elapsed = time.perf_counter() - started
+
+        metrics.incr("gcal.mirror.refreshes")
+        metrics.observe("gcal.mirror.duration", elapsed)
+        metrics.set("gcal.mirror.events", len(events))
+        metrics.set("gcal.mirror.missing", len(missing))
+
+        stats = {
+            "events": len(events),
+            "bookings": len(rows),
+            "missing": missing,
+            "api_calls": metrics.counter("gcal.calls") - calls_before,
+            "duration_ms": round(elapsed * 1000),
+        }
+        log.info(
+            "gcal.mirror refreshed: %s events, %s bookings, %s missing, %s calls, %s ms",
+            stats["events"], stats["bookings"], len(missing), stats["api_calls"], stats["duration_ms"],
+        )
+        return stats
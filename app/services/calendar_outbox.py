@@ -0,0 +1,258 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, Optional
+
+from sqlalchemy import exists, select, update
+from sqlalchemy.orm import aliased, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app.config import settings
+from app.storage.models import Booking, CalendarOutbox, Occurrence
+from app.integrations.google_calendar import GoogleCalendar
+from app.utils.dates import utcnow
+
+log = logging.getLogger("gcal.outbox")
+
+_BACKOFF_BASE_SECONDS = 30
+_BACKOFF_MAX_SECONDS = 3600
+
+
+def _event_id(row: CalendarOutbox) -> str:
+    """Id нового события, детерминированный по строке outbox.
+
+    Повтор операции после сбоя (ответ API потерян, запись id в базу не
+    прошла) создаёт событие под тем же id, и Google не даёт дубль.
+    created_at в основе — чтобы id не совпали после пересоздания базы.
+    Hex-символы входят в алфавит id событий Google (a-v, 0-9).
+    """
+    seed = f"calendar_outbox:{row.id}:{row.booking_id}:{row.created_at.isoformat()}"
+    return hashlib.sha1(seed.encode()).hexdigest()
+
+
+class CalendarOutboxService:
+    """Transactional outbox для Google Calendar.
+
+    BookingService только добавляет строку в calendar_outbox в той же
+    транзакции, что и изменение записи, и сразу отвечает пользователю.
+    Воркер drain() выполняет операции по порядку id с повторами и пишет
+    gcal_event_id обратно в запись (или в занятие серии, если в операции
+    есть occurrence_id). Очередь лежит в БД и переживает рестарт; строки
+    забираются по одной через FOR UPDATE SKIP LOCKED, так что реплики на
+    общей PostgreSQL не выполняют одну операцию дважды.
+    """
+
+    _lock = asyncio.Lock()
+    _tasks: set[asyncio.Task] = set()
+
+    # --- постановка в очередь (вызывается до commit) ---
+
+    @staticmethod
+    def _enqueue(session, action: str, booking_id: Optional[int], **payload: Any) -> None:
+        if not settings.google_calendar_enabled:
+            return
+        session.add(
+            CalendarOutbox(
+                booking_id=booking_id,
+                action=action,
+                payload=json.dumps(payload, ensure_ascii=False, default=str),
+            )
+        )
+
+    @classmethod
+    def enqueue_create(
+        cls,
+        session,
+        booking_id: int,
+        start_at: Optional[datetime] = None,
+        student: Optional[str] = None,
+        occurrence_id: Optional[int] = None,
+    ) -> None:
+        """Создать событие; без start_at/student берутся текущие данные записи"""
+        cls._enqueue(
+            session, "create", booking_id,
+            start_at=start_at.isoformat() if start_at else None,
+            student=student,
+            occurrence_id=occurrence_id,
+        )
+
+    @classmethod
+    def enqueue_update(
+        cls,
+        session,
+        booking_id: int,
+        fields: Optional[Iterable[str]] = None,
+        occurrence_id: Optional[int] = None,
+    ) -> None:
+        """Обновить событие по текущему состоянию записи на момент выполнения.
+
+        fields — группы полей из PATCH_FIELDS ("time", "content"); без них
+        отправляются все поля. occurrence_id — событие занятия серии.
+        """
+        cls._enqueue(
+            session, "update", booking_id,
+            fields=sorted(fields) if fields else None,
+            occurrence_id=occurrence_id,
+        )
+
+    @classmethod
+    def enqueue_delete(cls, session, booking_id: int, event_id: Optional[str]) -> None:
+        if event_id:
+            cls._enqueue(session, "delete", booking_id, event_id=event_id)
+
+    # --- воркер ---
+
+    @classmethod
+    def kick(cls) -> None:
+        """Запускает воркер сразу после commit, не дожидаясь планового тика"""
+        if not settings.google_calendar_enabled:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        task = loop.create_task(cls.drain())
+        cls._tasks.add(task)
+        task.add_done_callback(cls._tasks.discard)
+
+    @staticmethod
+    def _next_row_query(now: datetime):
+        """Первая готовая к выполнению операция, по одной за транзакцию.
+
+        Операции одной записи выполняются строго по порядку: строка берётся,
+        только если у её записи нет более ранней pending-операции — ни ждущей
+        повтора, ни выполняемой сейчас другой репликой. Повторы с отложенным
+        next_attempt_at отсекаются в WHERE и не занимают выборку.
+        """
+        earlier = aliased(CalendarOutbox)
+        return (
+            select(CalendarOutbox)
+            .where(
+                CalendarOutbox.status == "pending",
+                CalendarOutbox.next_attempt_at <= now,
+                ~exists().where(
+                    earlier.booking_id == CalendarOutbox.booking_id,
+                    earlier.status == "pending",
+                    earlier.id < CalendarOutbox.id,
+                ),
+            )
+            .order_by(CalendarOutbox.id)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        )
+
+    @classmethod
+    async def drain(cls, limit: int = 50) -> int:
+        """Выполняет до limit операций.
+
+        Каждая операция — отдельная транзакция: строка заблокирована
+        (FOR UPDATE SKIP LOCKED) до commit её результата, поэтому другая
+        реплика не повторит тот же вызов API.
+        """
+        from app.storage.db import SessionLocal
+
+        done = 0
+        async with cls._lock:
+            try:
+                async with SessionLocal() as session:
+                    for _ in range(limit):
+                        row = await session.scalar(cls._next_row_query(utcnow()))
+                        if row is None:
+                            break
+
+                        try:
+                            await cls._apply(session, row)
+                            row.status = "done"
+                            row.done_at = utcnow()
+                            row.last_error = None
+                            done += 1
+                        except Exception as e:
+                            row.attempts = (row.attempts or 0) + 1
+                            row.last_error = str(e)[:1000]
+                            if row.attempts >= settings.calendar_outbox_max_attempts:
+                                row.status = "failed"
+                                log.error(f"gcal.outbox #{row.id} {row.action} booking={row.booking_id} failed permanently: {e}")
+                            else:
+                                delay = min(_BACKOFF_BASE_SECONDS * 2 ** (row.attempts - 1), _BACKOFF_MAX_SECONDS)
+                                row.next_attempt_at = utcnow() + timedelta(seconds=delay)
+                                log.warning(f"gcal.outbox #{row.id} {row.action} booking={row.booking_id} retry in {delay}s: {e}")
+                        await session.commit()
+            except Exception:
+                log.exception("gcal.outbox drain failed")
+
+        if done:
+            log.info("gcal.outbox drained %s operations", done)
+        return done
+
+    @staticmethod
+    async def _apply(session, row: CalendarOutbox) -> None:
+        payload: Dict[str, Any] = json.loads(row.payload or "{}")
+
+        if row.action == "delete":
+            ok = await GoogleCalendar.delete_event(payload["event_id"])
+            if not ok:
+                raise RuntimeError(f"delete_event {payload['event_id']} failed")
+            return
+
+        booking = await session.scalar(
+            select(Booking).options(selectinload(Booking.slot)).where(Booking.id == row.booking_id)
+        )
+        if booking is None:
+            log.info(f"gcal.outbox #{row.id}: booking {row.booking_id} no longer exists, skip {row.action}")
+            return
+
+        # Событие занятия серии живёт в occurrences, разовой записи — в bookings
+        target = booking
+        if payload.get("occurrence_id"):
+            target = await session.get(Occurrence, payload["occurrence_id"])
+            if target is None:
+                log.info(f"gcal.outbox #{row.id}: occurrence {payload['occurrence_id']} no longer exists, skip {row.action}")
+                return
+
+        if target is not booking:
+            # Текущее время занятия: перенос мог случиться, пока операция ждала в очереди
+            start_at = target.start_at
+        elif payload.get("start_at"):
+            start_at = datetime.fromisoformat(payload["start_at"])
+        elif booking.slot is not None:
+            start_at = booking.slot.start_at
+        else:
+            log.info(f"gcal.outbox #{row.id}: booking {booking.id} has no slot, skip {row.action}")
+            return
+        student = payload.get("student") or booking.student_name
+
+        if row.action == "create" or not target.gcal_event_id:
+            ev_id = await GoogleCalendar.upsert_event(
+                booking.id, start_at, student, booking.student_contact, event_id=_event_id(row)
+            )
+        elif row.action == "update":
+            ev_id = await GoogleCalendar.patch_event(
+                target.gcal_event_id, start_at, student, booking.student_contact, booking.id,
+                fields=payload.get("fields"),
+            )
+        else:
+            raise ValueError(f"unknown outbox action {row.action!r}")
+
+        if not ev_id:
+            raise RuntimeError(f"{row.action} for booking {booking.id} returned no event id")
+
+        # Запись (или занятие) могли удалить, пока шёл вызов API: тогда их
+        # удаление не знало id события, и событие удаляется отдельной операцией
+        model = type(target)
+        written = await session.execute(
+            update(model)
+            .where(model.id == target.id)
+            .values(gcal_event_id=ev_id)
+            .execution_options(synchronize_session=False)
+        )
+        if not written.rowcount:
+            CalendarOutboxService.enqueue_delete(session, booking.id, ev_id)
+            log.info(f"gcal.outbox #{row.id}: {model.__name__.lower()} {target.id} deleted meanwhile, event {ev_id} queued for delete")
+            return
+        # Следующие операции этой записи в том же drain() читают объект из сессии
+        set_committed_value(target, "gcal_event_id", ev_id)
+        log.info(f"gcal.outbox #{row.id}: {row.action} booking={booking.id} -> event {ev_id}")
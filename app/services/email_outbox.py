@@ -0,0 +1,174 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from datetime import timedelta
+from typing import List, Optional, Sequence
+
+from sqlalchemy import func, select, update
+
+from app.config import settings
+from app.services.email_service import EmailService
+from app.storage.models import EmailOutbox
+from app.utils.dates import utcnow
+from app.utils.metrics import metrics
+
+log = logging.getLogger("email.outbox")
+
+_BACKOFF_BASE_SECONDS = 60
+_BACKOFF_MAX_SECONDS = 6 * 3600
+
+
+class EmailOutboxService:
+    """Transactional outbox для писем.
+
+    BookingService и ReminderService только добавляют строку в email_outbox
+    в своей транзакции — SMTP не участвует ни в записи, ни в ответе бота.
+    Воркер drain() отправляет письма через пул SMTP-соединений, при ошибке
+    откладывает с экспоненциальной паузой, а после
+    EMAIL_OUTBOX_MAX_ATTEMPTS попыток переводит в 'dead'. Строки
+    забираются через FOR UPDATE SKIP LOCKED (в SQLite — обычный SELECT),
+    поэтому реплики на общей PostgreSQL не отправляют одно письмо дважды.
+    """
+
+    _lock = asyncio.Lock()
+    _tasks: set[asyncio.Task] = set()
+
+    # --- постановка в очередь (вызывается до commit) ---
+
+    @staticmethod
+    def enqueue(
+        session,
+        to_email: Optional[str],
+        subject: str,
+        body: str,
+        booking_id: Optional[int] = None,
+        kind: str = "other",
+    ) -> bool:
+        if not settings.smtp_enabled or not EmailService.is_email(to_email):
+            return False
+        session.add(
+            EmailOutbox(booking_id=booking_id, kind=kind, to_email=to_email, subject=subject, body=body)
+        )
+        return True
+
+    @classmethod
+    async def submit(cls, to_email: Optional[str], subject: str, body: str, **kwargs) -> bool:
+        """enqueue в отдельной транзакции — для кода без своей сессии"""
+        from app.storage.db import SessionLocal
+
+        async with SessionLocal() as session:
+            if not cls.enqueue(session, to_email, subject, body, **kwargs):
+                return False
+            await session.commit()
+        cls.kick()
+        return True
+
+    # --- воркер ---
+
+    @classmethod
+    def kick(cls) -> None:
+        """Запускает воркер сразу после commit, не дожидаясь планового тика"""
+        if not settings.smtp_enabled:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        task = loop.create_task(cls.drain())
+        cls._tasks.add(task)
+        task.add_done_callback(cls._tasks.discard)
+
+    @classmethod
+    async def drain(cls, limit: int = 100) -> int:
+        from app.storage.db import SessionLocal
+
+        if not settings.smtp_enabled:
+            return 0
+        sent = 0
+        async with cls._lock:
+            try:
+                async with SessionLocal() as session:
+                    now = utcnow()
+                    rows = (
+                        await session.scalars(
+                            select(EmailOutbox)
+                            .where(EmailOutbox.status == "pending", EmailOutbox.next_attempt_at <= now)
+                            .order_by(EmailOutbox.id)
+                            .limit(limit)
+                            # Несколько реплик на PostgreSQL делят очередь без двойной отправки
+                            .with_for_update(skip_locked=True)
+                        )
+                    ).all()
+                    if not rows:
+                        return 0
+
+                    # Письма независимы — отправляем пачкой через пул соединений
+                    outcomes = await asyncio.gather(
+                        *(EmailService.send_async(r.to_email, r.subject, r.body) for r in rows),
+                        return_exceptions=True,
+                    )
+                    for row, outcome in zip(rows, outcomes):
+                        row.attempts = (row.attempts or 0) + 1
+                        if outcome is True:
+                            row.status = "sent"
+                            row.sent_at = utcnow()
+                            row.last_error = None
+                            sent += 1
+                            continue
+                        row.last_error = (str(outcome) if isinstance(outcome, BaseException) else "SMTP send failed")[:1000]
+                        if row.attempts >= settings.email_outbox_max_attempts:
+                            row.status = "dead"
+                            metrics.incr("email.outbox.dead")
+                            log.error(f"email.outbox #{row.id} to {row.to_email} is dead after {row.attempts} attempts: {row.last_error}")
+                        else:
+                            delay = min(_BACKOFF_BASE_SECONDS * 2 ** (row.attempts - 1), _BACKOFF_MAX_SECONDS)
+                            row.next_attempt_at = utcnow() + timedelta(seconds=delay)
+                            log.warning(f"email.outbox #{row.id} to {row.to_email} retry in {delay}s: {row.last_error}")
+                    await session.commit()
+
+                    metrics.set(
+                        "email.outbox.pending",
+                        await session.scalar(select(func.count()).where(EmailOutbox.status == "pending")) or 0,
+                    )
+            except Exception:
+                log.exception("email.outbox drain failed")
+
+        if sent:
+            metrics.incr("email.outbox.sent", sent)
+            log.info("email.outbox sent %s emails", sent)
+        return sent
+
+    # --- администрирование ---
+
+    @staticmethod
+    async def stats(session) -> dict[str, int]:
+        rows = await session.execute(select(EmailOutbox.status, func.count()).group_by(EmailOutbox.status))
+        return dict(rows.all())
+
+    @staticmethod
+    async def dead(session, limit: int = 20) -> List[EmailOutbox]:
+        return list(
+            (
+                await session.scalars(
+                    select(EmailOutbox)
+                    .where(EmailOutbox.status == "dead")
+                    .order_by(EmailOutbox.id.desc())
+                    .limit(limit)
+                )
+            ).all()
+        )
+
+    @staticmethod
+    async def requeue(session, ids: Optional[Sequence[int]] = None) -> int:
+        """Возвращает dead-письма (все или по id) в очередь с обнулёнными попытками"""
+        stmt = (
+            update(EmailOutbox)
+            .where(EmailOutbox.status == "dead")
+            .values(status="pending", attempts=0, next_attempt_at=utcnow(), last_error=None)
+        )
+        if ids:
+            stmt = stmt.where(EmailOutbox.id.in_(ids))
+        result = await session.execute(stmt)
+        await session.commit()
+        return result.rowcount or 0
@@ -13,26 +13,42 @@ class EmailService:
         return "@" in value and "." in value
 
     @staticmethod
-    def send(to_email: str, subject: str, body: str) -> bool:
-        if not settings.smtp_enabled:
-            return False
+    def _message(to_email: str, subject: str, body: str) -> EmailMessage:
         msg = EmailMessage()
         msg["From"] = settings.smtp_from
         msg["To"] = to_email
         msg["Subject"] = subject
         msg.set_content(body)
+        return msg
+
+    @staticmethod
+    async def send_async(to_email: str, subject: str, body: str) -> bool:
+        """Отправка из асинхронного кода: пул постоянных соединений, event loop не блокируется"""
+        if not settings.smtp_enabled:
+            return False
+        from app.integrations.smtp_sender import get_sender
+
+        return await get_sender().send(EmailService._message(to_email, subject, body))
+
+    @staticmethod
+    def send(to_email: str, subject: str, body: str) -> bool:
+        """Синхронная отправка отдельным соединением — для скриптов и синхронного кода"""
+        if not settings.smtp_enabled:
+            return False
+        msg = EmailService._message(to_email, subject, body)
 
         try:
             if settings.smtp_port == 465:
                 # Для порта 465 используем SSL
-                with smtplib.SMTP_SSL(settings.smtp_host, settings.smtp_port) as s:
+                with smtplib.SMTP_SSL(settings.smtp_host, settings.smtp_port, timeout=settings.smtp_timeout_seconds) as s:
                     if settings.smtp_user and settings.smtp_password:
                         s.login(settings.smtp_user, settings.smtp_password)
                     s.send_message(msg)
             else:
                 # Для других портов используем TLS
-                with smtplib.SMTP(settings.smtp_host, settings.smtp_port) as s:
-                    s.starttls()
+                with smtplib.SMTP(settings.smtp_host, settings.smtp_port, timeout=settings.smtp_timeout_seconds) as s:
+                    if settings.smtp_starttls:
+                        s.starttls()
                     if settings.smtp_user and settings.smtp_password:
                         s.login(settings.smtp_user, settings.smtp_password)
                     s.send_message(msg)
@@ -41,4 +57,4 @@ class EmailService:
             import logging
             log = logging.getLogger(__name__)
             log.error(f"Failed to send email: {e}")
-            return False
\ No newline at end of file
+            return False
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 from datetime import datetime, timedelta
-from typing import Optional, Any, Dict
+from typing import Optional, Any, Dict, Iterable
 from pathlib import Path
 from zoneinfo import ZoneInfo
 import os
@@ -27,8 +27,15 @@ _DEFAULT_SA_PATH = _ROOT / "integrations" / "service_account.json"
 _TZ_NAME = (getattr(settings, "tz", None) or "UTC").strip() or "UTC"
 _TZ = ZoneInfo(_TZ_NAME)
 
+# Группы полей события, которые меняются при PATCH-обновлении записи
+PATCH_FIELDS: Dict[str, tuple] = {
+    "time": ("start", "end"),
+    "content": ("summary", "description", "attendees"),
+}
+
 def _ensure_aware(dt: datetime) -> datetime:
-    return dt.replace(tzinfo=_TZ) if dt.tzinfo is None else dt
+    """Время события в поясе календаря; из БД приходит UTC, наивное — уже локальное"""
+    return dt.replace(tzinfo=_TZ) if dt.tzinfo is None else dt.astimezone(_TZ)
 
 def _rfc3339(dt: datetime) -> str:
     return _ensure_aware(dt).isoformat()
@@ -156,6 +163,38 @@ class GoogleCalendarService:
             "sendUpdates": "all",  # Отправляем уведомления всем
         }
 
+    @classmethod
+    def _create_body(cls, booking_id: int, start_at: datetime, student: str, contact: Optional[str]):
+        """Тело нового события записи — общее для sync- и async-клиента"""
+        body = cls._event_body(start_at, student, contact)
+        body["description"] += f"\nBooking #{booking_id}"
+
+        # Добавляем настройки для правильной работы с приглашениями
+        body["guestsCanModify"] = False
+        body["guestsCanInviteOthers"] = False
+        body["guestsCanSeeOtherGuests"] = False
+
+        # Добавляем настройки для отправки уведомлений
+        body["sendUpdates"] = "all"  # Отправляем уведомления всем участникам
+
+        # Добавляем уникальный идентификатор для избежания дублирования
+        body["source"] = {"title": f"TutorSlot Bot - Booking #{booking_id}", "url": "https://t.me/tutorslot_bot"}
+        return body
+
+    @classmethod
+    def _patch_body(
+        cls,
+        booking_id: int,
+        start_at: datetime,
+        student: str,
+        contact: Optional[str],
+        fields: Optional[Iterable[str]] = None,
+    ) -> Dict[str, Any]:
+        """Только изменённые поля события; fields — группы из PATCH_FIELDS (по умолчанию все)"""
+        body = cls._create_body(booking_id, start_at, student, contact)
+        keys = [k for group in (fields or PATCH_FIELDS) for k in PATCH_FIELDS[group]]
+        return {k: body[k] for k in keys}
+
     @classmethod
     def create_event(
         cls, booking_id: int, start_at: datetime, student: str, contact: Optional[str]
@@ -167,22 +206,10 @@ class GoogleCalendarService:
         try:
             log.info(f"Creating event for booking {booking_id}: student={student}, contact={contact}, start_at={start_at}")
             
-            body = cls._event_body(start_at, student, contact)
-            body["description"] += f"\nBooking #{booking_id}"
+            body = cls._create_body(booking_id, start_at, student, contact)
             
             log.info(f"Event body prepared: summary={body.get('summary')}, description={body.get('description')}")
             
-            # Добавляем настройки для правильной работы с приглашениями
-            body["guestsCanModify"] = False
-            body["guestsCanInviteOthers"] = False
-            body["guestsCanSeeOtherGuests"] = False
-            
-            # Добавляем настройки для отправки уведомлений
-            body["sendUpdates"] = "all"  # Отправляем уведомления всем участникам
-            
-            # Добавляем уникальный идентификатор для избежания дублирования
-            body["source"] = {"title": f"TutorSlot Bot - Booking #{booking_id}", "url": "https://t.me/tutorslot_bot"}
-            
             ev = (
                 svc.events()
                 .insert(
@@ -199,9 +226,6 @@ class GoogleCalendarService:
                 log.info(f"Event details: summary={ev.get('summary')}, description={ev.get('description')}")
                 log.info(f"Event attendees: {ev.get('attendees', [])}")
                 log.info(f"Event reminders: {ev.get('reminders', {})}")
-                
-                # Принудительно обновляем календарь
-                cls._force_calendar_refresh(svc)
             else:
                 log.error(f"gcal.create: no event ID returned for booking {booking_id}")
             return event_id
@@ -295,70 +319,52 @@ class GoogleCalendarService:
             log.error(f"Calendar permissions check unexpected error: {e}")
             return False
 
-    @classmethod
-    def _force_calendar_refresh(cls, svc):
-        """Принудительно обновляет календарь"""
-        try:
-            # Получаем список событий для принудительного обновления
-            now = datetime.now()
-            time_min = now.isoformat() + 'Z'
-            time_max = (now + timedelta(days=30)).isoformat() + 'Z'
-            
-            events_result = svc.events().list(
-                calendarId=getattr(settings, "google_calendar_id", "primary"),
-                timeMin=time_min,
-                timeMax=time_max,
-                maxResults=10,
-                singleEvents=True,
-                orderBy='startTime'
-            ).execute()
-            
-            log.info(f"Calendar refreshed, found {len(events_result.get('items', []))} events")
-        except Exception as e:
-            log.warning(f"Failed to force calendar refresh: {e}")
-
     @classmethod
     def force_update_event(
-        cls, event_id: str, start_at: datetime, student: str, contact: Optional[str], booking_id: int = None
+        cls,
+        event_id: str,
+        start_at: datetime,
+        student: str,
+        contact: Optional[str],
+        booking_id: int = None,
+        fields: Optional[Iterable[str]] = None,
     ) -> Optional[str]:
-        """Принудительное обновление события с пересозданием"""
+        """Обновление события на месте через PATCH изменённых полей.
+
+        Пересоздаёт событие, только если оно пропало из календаря (404/410).
+        Возвращает id актуального события.
+        """
         svc = cls._get_service()
         if not svc or not event_id:
             log.warning("gcal.force_update: no service or event_id")
             return None
-        
+
+        body = cls._patch_body(booking_id, start_at, student, contact, fields)
         try:
-            log.info(f"Force updating event {event_id} by recreation")
-            
-            # Сначала удаляем старое событие
-            delete_success = cls.delete_event(event_id)
-            if not delete_success:
-                log.warning(f"Failed to delete old event {event_id} - may already be deleted")
-                # Продолжаем выполнение, так как событие могло быть уже удалено
-            
-            # Ждем немного для синхронизации
-            import time
-            time.sleep(2)
-            
-            # Создаем новое событие с правильным booking_id
-            new_event_id = cls.create_event(
-                booking_id=booking_id or 999,  # Используем переданный ID или временный
-                start_at=start_at,
-                student=student,
-                contact=contact
+            log.info(f"Patching event {event_id}: fields={sorted(body)}")
+            (
+                svc.events()
+                .patch(
+                    calendarId=getattr(settings, "google_calendar_id", "primary"),
+                    eventId=event_id,
+                    body=body,
+                    sendUpdates="all",  # Участники получают уведомление об изменении
+                )
+                .execute()
             )
-            
-            if new_event_id:
-                log.info(f"Successfully recreated event: {new_event_id}")
-                return new_event_id  # Возвращаем новый ID события
-            else:
-                log.error("Failed to recreate event")
-                return None
-                
+            return event_id
+        except HttpError as e:
+            if e.resp.status in (404, 410):
+                log.warning(f"gcal.force_update: event {event_id} is gone, recreating")
+                return cls.create_event(booking_id, start_at, student, contact)
+            try:
+                detail = json.loads(e.content.decode())
+            except Exception:
+                detail = str(e)
+            log.error("gcal.force_update error: %s", detail)
+            return None
         except Exception as e:
-            log.error(f"Force update failed: {e}")
-            import traceback
-            log.error(f"Traceback: {traceback.format_exc()}")
+            log.error(f"gcal.force_update unexpected error: {e}")
             return None
 
     @classmethod
@@ -488,7 +494,7 @@ class GoogleCalendarService:
     WEEKDAY_TO_BYDAY = ["MO", "TU", "WE", "TH", "FR", "SA", "SU"]
 
     @classmethod
-    def create_recurring_event(
+    def _recurring_body(
         cls,
         summary: str,
         weekday: int,
@@ -496,11 +502,7 @@ class GoogleCalendarService:
         duration_min: int,
         attendee_email: Optional[str],
         timezone: str = _TZ_NAME,
-    ) -> Optional[str]:
-        svc = cls._get_service()
-        if not svc:
-            return None
-
+    ) -> Dict[str, Any]:
         now = datetime.now(ZoneInfo(timezone))
         days_ahead = (weekday - now.weekday()) % 7
         start_dt = (now + timedelta(days=days_ahead)).replace(
@@ -519,6 +521,23 @@ class GoogleCalendarService:
         }
         if attendee_email and "@" in attendee_email:
             body["attendees"] = [{"email": attendee_email}]
+        return body
+
+    @classmethod
+    def create_recurring_event(
+        cls,
+        summary: str,
+        weekday: int,
+        time_hhmm: str,
+        duration_min: int,
+        attendee_email: Optional[str],
+        timezone: str = _TZ_NAME,
+    ) -> Optional[str]:
+        svc = cls._get_service()
+        if not svc:
+            return None
+
+        body = cls._recurring_body(summary, weekday, time_hhmm, duration_min, attendee_email, timezone)
 
         try:
             ev = (
@@ -0,0 +1,292 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import time as _time
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterator, List, Optional
+
+from sqlalchemy import delete, select
+from sqlalchemy.orm import selectinload
+
+from app.config import settings
+from app.storage.db import dialect_insert
+from app.storage.models import Booking, Occurrence, Recurrence, Slot
+from app.services.availability_index import availability_index
+from app.services.calendar_outbox import CalendarOutboxService
+from app.services.reminder_service import ReminderService
+from app.services.slot_service import WINDOW_DAYS
+from app.utils.dates import to_local, to_naive_local, to_utc, utcnow
+
+log = logging.getLogger("recurrence")
+
+WEEKDAY_NAMES = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье"]
+
+
+def _exceptions(rec: Recurrence) -> Dict[str, Optional[str]]:
+    try:
+        return json.loads(rec.exceptions or "{}")
+    except ValueError:
+        log.warning("recurrence #%s: broken exceptions JSON, ignored", rec.id)
+        return {}
+
+
+def rule_starts(rec: Recurrence, lo: date, hi: date) -> Iterator[datetime]:
+    """Времена занятий по правилу (без исключений, в UTC) с локальной датой в [lo, hi].
+
+    Правило задано в локальном времени: занятие в 19:30 остаётся в 19:30 и
+    после перехода на летнее время, меняется его момент в UTC.
+    """
+    step = 7 * max(1, rec.interval_weeks or 1)
+    first = rec.starts_on + timedelta(days=(rec.weekday - rec.starts_on.weekday()) % 7)
+    hh, mm = divmod(rec.minute_of_day, 60)
+
+    k = max(0, -(-(lo - first).days // step))
+    while True:
+        if rec.count is not None and k >= rec.count:
+            return
+        day = first + timedelta(days=k * step)
+        if day > hi or (rec.until is not None and day > rec.until):
+            return
+        yield to_utc(datetime.combine(day, time(hh, mm)))
+        k += 1
+
+
+class RecurrenceService:
+    """Серии интервальных занятий: правило в recurrences, занятия в occurrences.
+
+    materialize() раскладывает правила на RECURRENCE_HORIZON_DAYS вперёд —
+    ночной задачей и сразу при создании серии. Дальше индекс свободных
+    слотов, напоминания и календарь работают с occurrences как с обычными
+    занятиями. Пропуск недели и разовый перенос — исключения в правиле,
+    поэтому ночная материализация их не откатывает.
+    """
+
+    _lock = asyncio.Lock()
+
+    @staticmethod
+    def student_label(booking: Booking) -> str:
+        if booking.weekday is None:
+            return booking.student_name
+        return f"{booking.student_name} ({WEEKDAY_NAMES[booking.weekday]})"
+
+    @staticmethod
+    async def create(session, booking: Booking, starts_on: Optional[date] = None) -> List[datetime]:
+        """Серия для новой интервальной записи; занятия раскладываются сразу (до commit).
+
+        Возвращает времена созданных занятий — их отмечает индекс после commit.
+        """
+        rec = Recurrence(
+            booking_id=booking.id,
+            weekday=booking.weekday,
+            time_hhmm=booking.time_hhmm,
+            minute_of_day=booking.minute_of_day,
+            starts_on=starts_on or ReminderService.now_local().date(),
+        )
+        rec.booking = booking
+        session.add(rec)
+        await session.flush()
+        return await RecurrenceService._materialize_one(session, rec, utcnow())
+
+    @classmethod
+    async def materialize(cls, horizon_days: Optional[int] = None, now: Optional[datetime] = None) -> dict:
+        """Докладывает недостающие занятия всех серий до горизонта"""
+        from app.storage.db import SessionLocal
+
+        started = _time.perf_counter()
+        now = now or utcnow()
+        created = series = 0
+        async with cls._lock, SessionLocal() as session:
+            recs = (
+                await session.scalars(
+                    select(Recurrence)
+                    .options(selectinload(Recurrence.booking))
+                    .where((Recurrence.until.is_(None)) | (Recurrence.until >= to_local(now).date()))
+                )
+            ).all()
+            for rec in recs:
+                series += 1
+                created += len(await cls._materialize_one(session, rec, now, horizon_days))
+            await session.commit()
+
+        if created:
+            CalendarOutboxService.kick()
+            availability_index.invalidate("recurrence.materialize")
+        stats = {"series": series, "created": created, "duration_ms": round((_time.perf_counter() - started) * 1000)}
+        log.info("recurrence.materialize: %s series, %s occurrences created, %s ms", series, created, stats["duration_ms"])
+        return stats
+
+    @staticmethod
+    async def _materialize_one(
+        session, rec: Recurrence, now: datetime, horizon_days: Optional[int] = None
+    ) -> List[datetime]:
+        today = to_local(now).date()
+        horizon = today + timedelta(days=max(horizon_days or settings.recurrence_horizon_days, WINDOW_DAYS))
+        existing = set(
+            (
+                await session.scalars(
+                    select(Occurrence.original_start_at).where(
+                        Occurrence.recurrence_id == rec.id, Occurrence.original_start_at >= to_utc(datetime.combine(today, time()))
+                    )
+                )
+            ).all()
+        )
+        exceptions = _exceptions(rec)
+        insert = dialect_insert(session)
+
+        created: List[datetime] = []
+        for original in rule_starts(rec, today, horizon):
+            if original <= now or original in existing:
+                continue
+            key = to_local(original).date().isoformat()
+            if key in exceptions and exceptions[key] is None:
+                continue  # неделя пропущена
+            start_at = to_utc(datetime.fromisoformat(exceptions[key])) if exceptions.get(key) else original
+            # Время занято разовой записью или занятием другой серии — неделю не
+            # раскладываем; освободится — её доложит следующая материализация
+            if await RecurrenceService._taken(session, start_at):
+                log.warning("recurrence #%s: %s is taken, occurrence not created", rec.id, start_at)
+                continue
+
+            # Реплики на общей базе могут раскладывать одну серию одновременно —
+            # занятие создаёт только та, чья вставка прошла
+            occurrence_id = await session.scalar(
+                insert(Occurrence)
+                .values(
+                    recurrence_id=rec.id,
+                    booking_id=rec.booking_id,
+                    original_start_at=original,
+                    start_at=start_at,
+                    next_remind_at=ReminderService.next_remind_at(start_at, now),
+                )
+                .on_conflict_do_nothing(index_elements=[Occurrence.recurrence_id, Occurrence.original_start_at])
+                .returning(Occurrence.id)
+            )
+            if occurrence_id is None:
+                continue
+            # Событие создаст воркер outbox после commit
+            CalendarOutboxService.enqueue_create(
+                session, rec.booking_id, start_at=start_at,
+                student=RecurrenceService.student_label(rec.booking), occurrence_id=occurrence_id,
+            )
+            created.append(start_at)
+        return created
+
+    @staticmethod
+    async def occupied_at(session, start_at: datetime) -> bool:
+        """Занято ли время занятием какой-либо серии.
+
+        Разовые записи и переносы лежат в slots, а занятия серий — в occurrences,
+        и уникальные ограничения slots их не покрывают. Поэтому BookingService
+        проверяет это в своей транзакции, а не по индексу свободных слотов,
+        который у реплики может отставать.
+        """
+        occurrence_id = await session.scalar(select(Occurrence.id).where(Occurrence.start_at == start_at).limit(1))
+        return occurrence_id is not None
+
+    @staticmethod
+    async def _taken(session, start_at: datetime, original: Optional[datetime] = None) -> bool:
+        """Занято ли время разовой записью или занятием серии (кроме занятия с original_start_at == original)"""
+        taken = await session.scalar(
+            select(Booking.id).join(Slot, Slot.id == Booking.slot_id).where(Slot.start_at == start_at).limit(1)
+        )
+        if taken is not None:
+            return True
+        query = select(Occurrence.id).where(Occurrence.start_at == start_at)
+        if original is not None:
+            query = query.where(Occurrence.original_start_at != original)
+        return await session.scalar(query.limit(1)) is not None
+
+    # --- исключения ---
+
+    @staticmethod
+    async def _series(session, booking_id: int, on: date):
+        """Серия записи и время занятия по правилу в день on (None, если в этот день занятия нет)"""
+        rec = await session.scalar(
+            select(Recurrence).options(selectinload(Recurrence.booking)).where(Recurrence.booking_id == booking_id)
+        )
+        if rec is None:
+            return None, None
+        original = next(rule_starts(rec, on, on), None)
+        return rec, original
+
+    @staticmethod
+    async def skip(session, booking_id: int, on: date) -> bool:
+        """Пропуск одной недели серии"""
+        rec, original = await RecurrenceService._series(session, booking_id, on)
+        if original is None:
+            return False
+
+        exceptions = _exceptions(rec)
+        exceptions[on.isoformat()] = None
+        rec.exceptions = json.dumps(exceptions, sort_keys=True)
+
+        occ = await session.scalar(
+            select(Occurrence).where(Occurrence.recurrence_id == rec.id, Occurrence.original_start_at == original)
+        )
+        released = None
+        if occ is not None:
+            released = occ.start_at
+            CalendarOutboxService.enqueue_delete(session, booking_id, occ.gcal_event_id)
+            await session.delete(occ)
+        await session.commit()
+        CalendarOutboxService.kick()
+        if released is not None:
+            availability_index.release_recurring(released)
+        log.info("recurrence #%s: skip %s", rec.id, on)
+        return True
+
+    @staticmethod
+    async def move(session, booking_id: int, on: date, new_start_at: datetime) -> bool:
+        """Разовый перенос занятия серии из дня on на new_start_at"""
+        new_start_at = to_utc(new_start_at)
+        rec, original = await RecurrenceService._series(session, booking_id, on)
+        if original is None or new_start_at <= utcnow():
+            return False
+
+        # Новое время не должно быть занято ни разовой записью, ни другим занятием серии
+        if await RecurrenceService._taken(session, new_start_at, original):
+            return False
+
+        exceptions = _exceptions(rec)
+        # Исключения хранятся в локальном времени, как и само правило
+        exceptions[on.isoformat()] = to_naive_local(new_start_at).isoformat(timespec="minutes")
+        rec.exceptions = json.dumps(exceptions, sort_keys=True)
+
+        occ = await session.scalar(
+            select(Occurrence).where(Occurrence.recurrence_id == rec.id, Occurrence.original_start_at == original)
+        )
+        old_start_at = None
+        if occ is not None:
+            old_start_at = occ.start_at
+            occ.start_at = new_start_at
+            occ.next_remind_at = ReminderService.next_remind_at(new_start_at)
+            # Событие в календаре перенесёт воркер outbox после commit (PATCH start/end)
+            CalendarOutboxService.enqueue_update(session, booking_id, fields=("time",), occurrence_id=occ.id)
+        await session.commit()
+        CalendarOutboxService.kick()
+        if occ is not None:
+            availability_index.move_recurring(old_start_at, new_start_at)
+        log.info("recurrence #%s: move %s -> %s", rec.id, on, new_start_at)
+        return True
+
+    # --- отмена серии ---
+
+    @staticmethod
+    async def cancel(session, booking_id: int) -> None:
+        """Удаляет серию и её занятия; будущие события календаря — через outbox (до commit)"""
+        now = utcnow()
+        event_ids = (
+            await session.scalars(
+                select(Occurrence.gcal_event_id).where(
+                    Occurrence.booking_id == booking_id,
+                    Occurrence.start_at > now,
+                    Occurrence.gcal_event_id.is_not(None),
+                )
+            )
+        ).all()
+        for event_id in event_ids:
+            CalendarOutboxService.enqueue_delete(session, booking_id, event_id)
+        await session.execute(delete(Occurrence).where(Occurrence.booking_id == booking_id))
+        await session.execute(delete(Recurrence).where(Recurrence.booking_id == booking_id))
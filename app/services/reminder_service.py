@@ -1,148 +1,572 @@
 from __future__ import annotations
+import asyncio
 import logging
+import time
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Awaitable, Optional
 
-from aiogram import Bot
+from sqlalchemy import and_, or_, select, update
+from sqlalchemy.orm import selectinload
 from zoneinfo import ZoneInfo
 
 from app.config import settings
-from app.storage.models import Booking, WeeklySubscription
+from app.integrations.telegram_queue import Priority, get_queue
+from app.storage.models import Booking, Occurrence, ReminderDelivery, Slot, WeeklySubscription
+from app.services.email_outbox import EmailOutboxService
 from app.services.email_service import EmailService
-from app.utils.dates import format_dt_ru
+from app.utils.dates import format_dt_ru, to_utc, utcnow
+from app.utils.metrics import metrics
 
 log = logging.getLogger("reminders")
 TZ = ZoneInfo(settings.tz)
 
+# Сколько раз пробуем доставить одно напоминание одному получателю
+_MAX_ATTEMPTS = 3
+
+# Offset ручной отправки (/remindnow) в журнале: у неё своя строка, поэтому
+# она не закрывает плановое напоминание и повторяется только сама с собой
+_MANUAL_OFFSET = -1
+
+# Старые флаги в bookings, которые по-прежнему выставляются для своих offsets
+# (только у разовых записей — у интервальных занятий много)
+_LEGACY_FLAGS = {1440: "remind_24h_sent", 60: "remind_1h_sent"}
+
+# Одно напоминание пачки: запись, время занятия и offset в минутах
+_Item = tuple[Booking, datetime, int]
+
+
+class _NoResponse(str):
+    """Ошибка отправки, не ответившей за таймаут: исход неизвестен, строка журнала остаётся pending"""
+
+
+# Записи исхода отправок, досланных после таймаута (ссылки, чтобы задачи не собрал GC)
+_late_records: set[asyncio.Task] = set()
+
 class ReminderService:
-    @staticmethod
-    async def schedule_for_booking(scheduler, booking: Booking):
-        if not settings.reminders_enabled or scheduler is None or booking is None:
-            return
+    """Напоминания о занятиях.
 
-        # Интервальные занятия теперь имеют напоминания для текущего события
-        # (напоминания отключаются только для старых записей без slot)
+    Вместо отдельной задачи планировщика на каждую запись и каждый offset у
+    записи (и у каждого занятия интервальной серии в occurrences) есть
+    индексированная колонка next_remind_at — время ближайшего
+    неотправленного напоминания (в UTC, как slots.start_at).
+    Одна периодическая задача dispatch() раз в reminder_tick_seconds забирает
+    всё, что наступило, отправляет и сдвигает колонку на следующий offset.
 
-        if booking.slot is None:
-            log.warning("reminders.skip booking=%s - no slot", booking.id)
-            return
+    Каждая отправка сначала записывается в журнал reminder_deliveries
+    (запись × занятие × offset × канал × получатель), и только потом
+    уходит сообщение — так повторы, рестарты и /remindnow не дублируют
+    напоминания, а неудачные отправки можно безопасно повторить.
+    """
 
-        start_at: datetime = booking.slot.start_at
-        if start_at.tzinfo is None:
-            start_at = start_at.replace(tzinfo=TZ)
-        now = datetime.now(TZ)
+    @staticmethod
+    def now_local() -> datetime:
+        """Локальное время без tzinfo — для локальных дат и миграций по старым данным"""
+        return datetime.now(TZ).replace(tzinfo=None)
 
-        # Проверяем что занятие еще не прошло
-        if start_at <= now:
-            log.info("reminders.skip booking=%s - lesson already passed: %s <= %s",
-                     booking.id, start_at, now)
-            return
+    @staticmethod
+    def offsets() -> list[int]:
+        """Offsets в минутах от большего к меньшему — в порядке наступления"""
+        return sorted({int(m) for m in settings.remind_offsets_minutes}, reverse=True)
 
-        for minutes in settings.remind_offsets_minutes:
-            minutes = int(minutes)
+    @staticmethod
+    def next_remind_at(start_at: Optional[datetime], after: Optional[datetime] = None) -> Optional[datetime]:
+        """Ближайшее время напоминания строго позже after (по умолчанию — сейчас).
+
+        Offsets отсчитываются в абсолютном времени: «за 24 часа» остаётся
+        24 часами и в ночь перехода на летнее время. Наивный start_at
+        (миграции до перевода в UTC) сравнивается с локальным «сейчас».
+        """
+        if start_at is None:
+            return None
+        if after is None:
+            after = utcnow() if start_at.tzinfo else ReminderService.now_local()
+        for minutes in ReminderService.offsets():
             when = start_at - timedelta(minutes=minutes)
-            
-            # Проверяем что время напоминания еще не прошло
-            if when <= now:
-                log.info("reminders.skip booking=%s offset=%s when=%s <= now=%s",
-                         booking.id, minutes, when, now)
-                continue
-
-            job_id = f"remind:{booking.id}:{minutes}"
-            try:
-                scheduler.remove_job(job_id)
-            except Exception:
-                pass
+            if when > after:
+                return when
+        return None
 
-            scheduler.add_job(
-                ReminderService.send_reminder_job,
-                trigger="date",
-                run_date=when,
-                id=job_id,
-                kwargs={"booking_id": booking.id},
-                misfire_grace_time=60,
-                coalesce=True,
-                replace_existing=True,
-            )
-            log.info("reminders.schedule booking=%s offset=%s run_at=%s",
-                     booking.id, minutes, when)
+    @staticmethod
+    def _grace() -> timedelta:
+        # Напоминание, опоздавшее сильнее пары тиков, уже неактуально
+        return timedelta(seconds=max(60, 2 * settings.reminder_tick_seconds))
 
     @staticmethod
-    async def cancel_for_booking(scheduler, booking_id: int):
-        if not settings.reminders_enabled or scheduler is None:
-            return
-        for minutes in settings.remind_offsets_minutes:
-            job_id = f"remind:{booking_id}:{int(minutes)}"
-            try:
-                scheduler.remove_job(job_id)
-            except Exception:
-                pass
-        log.info("reminders.cancel booking=%s", booking_id)
+    async def dispatch(now: Optional[datetime] = None, limit: int = 500) -> int:
+        """Один тик диспетчера: отправляет наступившие напоминания пачкой"""
+        from app.storage.db import SessionLocal
+
+        if not settings.reminders_enabled:
+            return 0
+        # Наивный now — локальное время, как и у колонок UTCDateTime
+        now = to_utc(now) if now else utcnow()
+
+        async with SessionLocal() as session:
+            bookings = (
+                await session.scalars(
+                    select(Booking)
+                    .options(selectinload(Booking.slot), selectinload(Booking.user))
+                    .where(Booking.next_remind_at <= now)
+                    .order_by(Booking.next_remind_at)
+                    .limit(limit)
+                    # Реплики на PostgreSQL разбирают наступившее без пересечений
+                    .with_for_update(skip_locked=True)
+                )
+            ).all()
+            occurrences = (
+                await session.scalars(
+                    select(Occurrence)
+                    .options(selectinload(Occurrence.booking).selectinload(Booking.user))
+                    .where(Occurrence.next_remind_at <= now)
+                    .order_by(Occurrence.next_remind_at)
+                    .limit(limit)
+                    .with_for_update(skip_locked=True)
+                )
+            ).all()
+
+            due: list[_Item] = []
+            for owner, booking, start_at in [
+                *((b, b, b.slot.start_at if b.slot is not None else None) for b in bookings),
+                *((o, o.booking, o.start_at) for o in occurrences),
+            ]:
+                fire_at = owner.next_remind_at
+                # Колонка сдвигается до отправки: сбой посреди тика не приведёт к повтору,
+                # а брошенные строки журнала (см. ниже) подхватит повтор
+                owner.next_remind_at = ReminderService.next_remind_at(start_at, now)
+                if start_at is None:
+                    log.warning("reminders.skip booking=%s - no slot", booking.id)
+                elif now - fire_at > ReminderService._grace():
+                    log.info("reminders.skip booking=%s due=%s - missed", booking.id, fire_at)
+                else:
+                    due.append((booking, start_at, round((start_at - fire_at).total_seconds() / 60)))
+            # Журнал пишется в той же транзакции, что и сдвиг колонки: после
+            # падения до отправки напоминание останется pending-строкой
+            due_claims = await ReminderService._claim_in(session, due)
+            if bookings or occurrences:
+                await session.commit()
+
+            retry = await ReminderService._failed_to_retry(session, now)
+        retry_claims = await ReminderService._claim(retry)
+
+        # Всё, что наступило в этот тик, — одной пачкой
+        reminded = await ReminderService._deliver(due + retry, claims=due_claims + retry_claims)
+        if due or retry:
+            log.info("reminders.dispatch: %s due, %s retried, %s reminded", len(due), len(retry), reminded)
+        return reminded
 
     @staticmethod
-    async def send_reminder_job(booking_id: int):
-        from sqlalchemy import select
-        from sqlalchemy.orm import selectinload
+    async def catch_up(now: Optional[datetime] = None) -> dict:
+        """Досылает напоминания, пропущенные за время простоя бота.
+
+        Берёт записи и занятия серий, у которых next_remind_at уже в
+        прошлом, а занятие ещё впереди. По каждому отправляет одно — самое
+        позднее из наступивших — напоминание с пометкой «запоздалое»: два
+        подряд (за сутки и за час) были бы лишними. Отправка ограничена
+        reminder_catchup_per_second.
+        """
+        from app.storage.db import SessionLocal
+
+        now = to_utc(now) if now else utcnow()
+        async with SessionLocal() as session:
+            bookings = (
+                await session.scalars(
+                    select(Booking)
+                    .join(Slot, Slot.id == Booking.slot_id)
+                    .options(selectinload(Booking.slot), selectinload(Booking.user))
+                    .where(Booking.next_remind_at <= now, Slot.start_at > now)
+                    .order_by(Slot.start_at)
+                    .with_for_update(skip_locked=True, of=Booking)
+                )
+            ).all()
+            occurrences = (
+                await session.scalars(
+                    select(Occurrence)
+                    .options(selectinload(Occurrence.booking).selectinload(Booking.user))
+                    .where(Occurrence.next_remind_at <= now, Occurrence.start_at > now)
+                    .order_by(Occurrence.start_at)
+                    .with_for_update(skip_locked=True)
+                )
+            ).all()
+
+            missed: list[_Item] = []
+            for owner, booking, start_at in [
+                *((b, b, b.slot.start_at) for b in bookings),
+                *((o, o.booking, o.start_at) for o in occurrences),
+            ]:
+                offset_min = min(
+                    (m for m in ReminderService.offsets() if start_at - timedelta(minutes=m) <= now), default=None
+                )
+                owner.next_remind_at = ReminderService.next_remind_at(start_at, now)
+                if offset_min is not None:
+                    missed.append((booking, start_at, offset_min))
+            missed.sort(key=lambda item: item[1])
+            # Как в dispatch(): журнал — в одной транзакции со сдвигом колонки
+            claims = await ReminderService._claim_in(session, missed)
+            if bookings or occurrences:
+                await session.commit()
+
+        # Пачки по reminder_catchup_per_second записей раз в секунду
+        chunk = max(1, int(settings.reminder_catchup_per_second))
+        recovered = 0
+        for i in range(0, len(missed), chunk):
+            if i:
+                await asyncio.sleep(1)
+            recovered += await ReminderService._deliver(missed[i:i + chunk], late=True, claims=claims[i:i + chunk])
+
+        metrics.incr("reminders.catchup.recovered", recovered)
+        log.info("reminders.catch_up: %s missed, %s recovered", len(missed), recovered)
+        return {"missed": len(missed), "recovered": recovered}
+
+    @staticmethod
+    async def send_reminder_job(booking_id: int) -> int:
+        """Ручная отправка (/remindnow) напоминания о ближайшем занятии.
+
+        Пишется в журнал под _MANUAL_OFFSET: повторный /remindnow по тому
+        же занятию не продублируется, а плановые напоминания уйдут как
+        обычно. Возвращает 1, если что-то ушло.
+        """
         from app.storage.db import SessionLocal
-        from app.storage.models import Booking as B
-        from app.runtime import get_bot
 
         async with SessionLocal() as session:
             res = await session.execute(
-                select(B).options(selectinload(B.slot), selectinload(B.user)).where(B.id == booking_id)
+                select(Booking).options(selectinload(Booking.slot), selectinload(Booking.user)).where(Booking.id == booking_id)
             )
-            booking: Optional[B] = res.scalar_one_or_none()
-            if not booking:
+            booking: Optional[Booking] = res.scalar_one_or_none()
+            start_at = None
+            if booking is not None and booking.slot is not None:
+                start_at = booking.slot.start_at
+            elif booking is not None and booking.lesson_type == "interval":
+                # У интервальной записи — ближайшее предстоящее занятие серии
+                occ = await session.scalar(
+                    select(Occurrence)
+                    .where(Occurrence.booking_id == booking.id, Occurrence.start_at > utcnow())
+                    .order_by(Occurrence.start_at)
+                    .limit(1)
+                )
+                if occ is not None:
+                    start_at = occ.start_at
+            if start_at is None:
                 log.info("reminders.fire booking=%s -> not found", booking_id)
-                return
+                return 0
 
-            student = booking.student_name or "Ученик"
-            dt = booking.slot.start_at
-            if dt.tzinfo is None:
-                dt = dt.replace(tzinfo=TZ)
-            when_txt = format_dt_ru(dt)
+        return await ReminderService._deliver([(booking, start_at, _MANUAL_OFFSET)])
 
-            bot: Bot = get_bot()
+    # --- журнал отправок и рассылка ---
 
-            try:
-                if booking.user and booking.user.tg_id:
-                    await bot.send_message(
-                        booking.user.tg_id, f"Напоминание о занятии\n{when_txt}\nИмя: {student}"
+    @staticmethod
+    def _targets(booking: Booking) -> list[tuple[str, str]]:
+        targets: list[tuple[str, str]] = []
+        if booking.user and booking.user.tg_id:
+            targets.append(("user", str(booking.user.tg_id)))
+        targets += [("admin", str(admin_id)) for admin_id in settings.admins]
+        if settings.smtp_enabled and EmailService.is_email(booking.student_contact):
+            targets.append(("email", booking.student_contact))
+        return targets
+
+    @staticmethod
+    def _retryable():
+        """Условие повтора строки журнала: неудачная или брошенная отправка.
+
+        Брошенная — pending дольше аренды: строку захватили, но результат не
+        записали (падение процесса, отменённая задача).
+        """
+        stale = utcnow() - timedelta(seconds=settings.reminder_claim_lease_seconds)
+        return and_(
+            ReminderDelivery.attempts < _MAX_ATTEMPTS,
+            or_(
+                ReminderDelivery.status == "failed",
+                and_(ReminderDelivery.status == "pending", ReminderDelivery.claimed_at < stale),
+            ),
+        )
+
+    @staticmethod
+    async def _claim(items: list[_Item]) -> list[list[tuple[str, str]]]:
+        """_claim_in() в своей транзакции"""
+        from app.storage.db import SessionLocal
+
+        if not items:
+            return []
+        async with SessionLocal() as session:
+            claimed_all = await ReminderService._claim_in(session, items)
+            await session.commit()
+        return claimed_all
+
+    @staticmethod
+    async def _claim_in(session, items: list[_Item]) -> list[list[tuple[str, str]]]:
+        """Записывает в журнал намерение отправить; для каждой записи возвращает ещё не отправленные цели.
+
+        Строки пишутся в транзакцию session (commit — за вызывающим) до
+        отправки. Уже отправленные (или отправляемые прямо сейчас)
+        пропускаются; неудачные и брошенные (см. _retryable) забираются
+        повторно, пока не исчерпан лимит попыток.
+        """
+        from app.storage.db import dialect_insert
+
+        claimed_all: list[list[tuple[str, str]]] = []
+        insert = dialect_insert(session)
+        for booking, start_at, offset_min in items:
+            claimed: list[tuple[str, str]] = []
+            for channel, recipient in ReminderService._targets(booking):
+                key = {
+                    "booking_id": booking.id, "start_at": start_at,
+                    "offset_min": offset_min, "channel": channel, "recipient": recipient,
+                }
+                row_id = await session.scalar(
+                    insert(ReminderDelivery)
+                    .values(**key)
+                    .on_conflict_do_nothing(
+                        index_elements=[
+                            ReminderDelivery.booking_id, ReminderDelivery.start_at, ReminderDelivery.offset_min,
+                            ReminderDelivery.channel, ReminderDelivery.recipient,
+                        ]
                     )
-            except Exception as e:
-                log.error(f"Failed to send reminder to user {booking.user.tg_id}: {e}")
+                    .returning(ReminderDelivery.id)
+                )
+                if row_id is None:
+                    retried = await session.execute(
+                        update(ReminderDelivery)
+                        .where(
+                            *(getattr(ReminderDelivery, k) == v for k, v in key.items()),
+                            ReminderService._retryable(),
+                        )
+                        .values(status="pending", attempts=ReminderDelivery.attempts + 1, claimed_at=utcnow())
+                    )
+                    if retried.rowcount == 0:
+                        continue
+                claimed.append((channel, recipient))
+            claimed_all.append(claimed)
+        return claimed_all
 
-            for admin_id in settings.admins:
-                try:
-                    await bot.send_message(
-                        admin_id,
-                        f"Напоминание (ученик): {student}\nКогда: {when_txt}\nКонтакт: {booking.student_contact or '—'}",
+    @staticmethod
+    async def _record(
+        items: list[_Item], results: list[dict[tuple[str, str], Optional[str]]]
+    ) -> None:
+        from app.storage.db import SessionLocal
+
+        now = utcnow()
+        async with SessionLocal() as session:
+            for (booking, start_at, offset_min), booking_results in zip(items, results):
+                for (channel, recipient), error in booking_results.items():
+                    stmt = update(ReminderDelivery).where(
+                        ReminderDelivery.booking_id == booking.id,
+                        ReminderDelivery.start_at == start_at,
+                        ReminderDelivery.offset_min == offset_min,
+                        ReminderDelivery.channel == channel,
+                        ReminderDelivery.recipient == recipient,
                     )
-                except Exception as e:
-                    log.error(f"Failed to send reminder to admin {admin_id}: {e}")
+                    if isinstance(error, _NoResponse):
+                        # Исход уже мог записать _record_late — его не затираем
+                        stmt = stmt.where(ReminderDelivery.status == "pending").values(last_error=error)
+                    else:
+                        stmt = stmt.values(
+                            status="failed" if error else "sent",
+                            last_error=error,
+                            sent_at=None if error else now,
+                        )
+                    await session.execute(stmt)
+                flag = _LEGACY_FLAGS.get(offset_min) if booking.lesson_type != "interval" else None
+                if flag and any(error is None for error in booking_results.values()):
+                    await session.execute(update(Booking).where(Booking.id == booking.id).values({flag: True}))
+            await session.commit()
 
-            if EmailService.is_email(booking.student_contact):
-                try:
-                    EmailService.send(
-                        to_email=booking.student_contact,
-                        subject="Напоминание о занятии",
-                        body=f"Здравствуйте!\nНапоминаем о занятии: {when_txt}\nУченик: {student}",
+    @staticmethod
+    async def _failed_to_retry(session, now: datetime, limit: int = 50) -> list[_Item]:
+        """Неудачные и брошенные отправки по занятиям, которые ещё не начались и не перенесены"""
+        rows = (
+            await session.execute(
+                select(ReminderDelivery.booking_id, ReminderDelivery.start_at, ReminderDelivery.offset_min)
+                .where(ReminderService._retryable(), ReminderDelivery.start_at > now)
+                .distinct()
+                .limit(limit)
+            )
+        ).all()
+        if not rows:
+            return []
+        booking_ids = {booking_id for booking_id, _, _ in rows}
+        bookings = {
+            b.id: b
+            for b in (
+                await session.scalars(
+                    select(Booking)
+                    .options(selectinload(Booking.slot), selectinload(Booking.user))
+                    .where(Booking.id.in_(booking_ids))
+                )
+            ).all()
+        }
+        # Занятие в журнале должно совпадать с текущим: слотом записи или занятием серии
+        current = {(b.id, b.slot.start_at) for b in bookings.values() if b.slot is not None}
+        current |= set(
+            (
+                await session.execute(
+                    select(Occurrence.booking_id, Occurrence.start_at).where(
+                        Occurrence.booking_id.in_(booking_ids), Occurrence.start_at > now
                     )
-                except Exception as e:
-                    log.error(f"Failed to send email reminder to {booking.student_contact}: {e}")
+                )
+            ).all()
+        )
+        return [
+            (bookings[booking_id], start_at, offset_min)
+            for booking_id, start_at, offset_min in rows
+            if booking_id in bookings and (booking_id, start_at) in current
+        ]
+
+    @staticmethod
+    def _timeout(channel: str) -> float:
+        return {
+            "user": settings.reminder_user_timeout_seconds,
+            "admin": settings.reminder_admin_timeout_seconds,
+        }[channel]
+
+    @staticmethod
+    async def _timed(channel: str, send: Awaitable) -> tuple[object, float]:
+        """Результат (или исключение) отправки и её длительность; время пишется в reminders.latency.<канал>.
+
+        По таймауту канала отправка не отменяется (запрос мог уже уйти в
+        Telegram) — вместо результата возвращается сама задача.
+        """
+        started = time.perf_counter()
+        task = asyncio.ensure_future(send)
+        done, _ = await asyncio.wait({task}, timeout=ReminderService._timeout(channel))
+        outcome: object = task
+        if done:
+            outcome = task.exception() or task.result()
+        elapsed = time.perf_counter() - started
+        metrics.observe(f"reminders.latency.{channel}", elapsed)
+        return outcome, elapsed
+
+    @staticmethod
+    def _record_late(send: asyncio.Task, entries: list[tuple[_Item, tuple[str, str]]]) -> None:
+        """Записывает в журнал исход отправки, которая завершилась после таймаута"""
 
-            log.info("reminders.fire booking=%s -> sent", booking_id)
+        async def record() -> None:
+            try:
+                await send
+                error = None
+            except Exception as e:
+                error = str(e)[:1000] or type(e).__name__
+            await ReminderService._record([item for item, _ in entries], [{key: error} for _, key in entries])
+            log.info("reminders.late %s -> %s", entries[0][1], error or "sent")
+
+        task = asyncio.create_task(record())
+        _late_records.add(task)
+        task.add_done_callback(_late_records.discard)
+
+    @staticmethod
+    async def _deliver(
+        items: list[_Item], late: bool = False, claims: Optional[list[list[tuple[str, str]]]] = None
+    ) -> int:
+        """Отправляет пачку напоминаний одновременно.
+
+        Ученикам — по сообщению на запись, каждому администратору — одно
+        общее сообщение со всеми учениками пачки; письма ставятся в outbox
+        и в журнале считаются отправленными. claims — уже захваченные цели
+        (_claim_in), иначе захват здесь. Возвращает число записей, по
+        которым ушло хотя бы одно сообщение.
+        """
+        if not items:
+            return 0
+        if claims is None:
+            claims = await ReminderService._claim(items)
+        batch = [(item, claimed) for item, claimed in zip(items, claims) if claimed]
+        for (booking, _, offset_min), claimed in zip(items, claims):
+            if not claimed:
+                log.info("reminders.fire booking=%s offset=%s -> already sent", booking.id, offset_min)
+        if not batch:
+            return 0
+
+        # Пометка для напоминаний, досланных после простоя
+        title = "Запоздалое напоминание" if late else "Напоминание"
+
+        # (отправка, [(номер записи в пачке, цель)]) — общее сообщение админу закрывает цели нескольких записей
+        sends: list[tuple[Awaitable, list[tuple[int, tuple[str, str]]]]] = []
+        admin_lines: dict[str, list[tuple[int, str]]] = {}
+        emails: list[tuple[int, int, str, str]] = []
+        telegram = get_queue()
+        for i, ((booking, dt, _), claimed) in enumerate(batch):
+            student = booking.student_name or "Ученик"
+            when_txt = format_dt_ru(dt)
+
+            for channel, recipient in claimed:
+                if channel == "user":
+                    send = telegram.send_message(
+                        int(recipient), f"{title} о занятии\n{when_txt}\nИмя: {student}", Priority.REMINDER
+                    )
+                elif channel == "admin":
+                    admin_lines.setdefault(recipient, []).append(
+                        (i, f"{student}\nКогда: {when_txt}\nКонтакт: {booking.student_contact or '—'}")
+                    )
+                    continue
+                else:
+                    emails.append((i, booking.id, recipient, f"Здравствуйте!\nНапоминаем о занятии: {when_txt}\nУченик: {student}"))
+                    continue
+                sends.append((send, [(i, (channel, recipient))]))
+
+        for recipient, lines in admin_lines.items():
+            if len(lines) == 1:
+                text = f"{title} (ученик): {lines[0][1]}"
+            else:
+                text = f"{title}: {len(lines)} занятий\n\n" + "\n\n".join(line for _, line in lines)
+            sends.append((telegram.send_message(int(recipient), text, Priority.REMINDER), [(i, ("admin", recipient)) for i, _ in lines]))
+
+        results: list[dict[tuple[str, str], Optional[str]]] = [{} for _ in batch]
+
+        # Письма — одной транзакцией в outbox: доставку и повторы ведёт его воркер
+        if emails:
+            from app.storage.db import SessionLocal
+
+            async with SessionLocal() as session:
+                for i, booking_id, recipient, body in emails:
+                    EmailOutboxService.enqueue(
+                        session, recipient, f"{title} о занятии", body, booking_id=booking_id, kind="reminder"
+                    )
+                    results[i][("email", recipient)] = None
+                await session.commit()
+            EmailOutboxService.kick()
+
+        # Каждый чат со своим таймаутом: медленный чат не задерживает остальных
+        outcomes = await asyncio.gather(
+            *(ReminderService._timed(keys[0][1][0], send) for send, keys in sends)
+        )
+
+        latency: list[dict[str, float]] = [{} for _ in batch]
+        for (_, keys), (outcome, elapsed) in zip(sends, outcomes):
+            channel = keys[0][1][0]
+            for i, _ in keys:
+                latency[i][channel] = max(latency[i].get(channel, 0.0), elapsed)
+            error = None
+            if isinstance(outcome, asyncio.Task):
+                # Сообщение может ещё уйти: повтор сейчас дал бы дубль, поэтому
+                # строка остаётся pending, а исход запишется по факту
+                metrics.incr(f"reminders.timeouts.{channel}")
+                error = _NoResponse(f"no response in {ReminderService._timeout(channel):g}s")
+                ReminderService._record_late(outcome, [(batch[i][0], key) for i, key in keys])
+                log.warning(f"Reminder to {channel} {keys[0][1][1]}: {error}, waiting for the outcome")
+            elif isinstance(outcome, BaseException):
+                error = str(outcome)[:1000] or type(outcome).__name__
+                log.error(f"Failed to send reminder to {channel} {keys[0][1][1]}: {error}")
+            for i, key in keys:
+                results[i][key] = error
+
+        for ((booking, _, offset_min), _), channels in zip(batch, latency):
+            log.info(
+                "reminders.latency booking=%s offset=%s %s", booking.id, offset_min,
+                " ".join(f"{channel}={ms * 1000:.0f}ms" for channel, ms in sorted(channels.items())),
+            )
+
+        await ReminderService._record([item for item, _ in batch], results)
+        reminded = sum(1 for r in results if any(error is None for error in r.values()))
+        log.info("reminders.fire %s bookings, %s messages -> %s bookings reminded", len(batch), len(sends), reminded)
+        return reminded
 
     @staticmethod
     async def schedule_for_weekly(scheduler, sub: WeeklySubscription, tz_name: str = settings.tz):
         if not settings.reminders_enabled or scheduler is None or sub is None or not sub.is_active:
             return
 
-        try:
-            hh, mm = map(int, sub.time_hhmm.split(":"))
-        except Exception:
-            log.warning("weekly.schedule: bad time_hhmm=%s for sub=%s", sub.time_hhmm, sub.id)
+        if sub.minute_of_day is None:
+            log.warning("weekly.schedule: no minute_of_day (time_hhmm=%s) for sub=%s", sub.time_hhmm, sub.id)
             return
+        hh, mm = divmod(sub.minute_of_day, 60)
 
         dow_24 = (sub.weekday - 1) % 7
 
@@ -190,6 +614,26 @@ class ReminderService:
         log.info("reminders.schedule weekly sub=%s -> d24@dow=%s %02d:%02d, d1@dow=%s %02d:%02d",
                  sub.id, dow_24, hh, mm, dow_1, hh_1, mm_1)
 
+    @staticmethod
+    async def restore_weekly(scheduler) -> int:
+        """Ставит заново cron-задачи всех активных еженедельных подписок.
+
+        Планировщик хранит задачи только в памяти — после рестарта их нет,
+        поэтому вызывается при старте (bootstrap в app/scheduler/jobs.py).
+        """
+        from app.storage.db import SessionLocal
+
+        if not settings.reminders_enabled or scheduler is None:
+            return 0
+        async with SessionLocal() as session:
+            subs = (
+                await session.scalars(select(WeeklySubscription).where(WeeklySubscription.is_active.is_(True)))
+            ).all()
+        for sub in subs:
+            await ReminderService.schedule_for_weekly(scheduler, sub)
+        log.info("reminders.weekly restored %s subscriptions", len(subs))
+        return len(subs)
+
     @staticmethod
     async def cancel_for_weekly(scheduler, sub_id: int):
         if not settings.reminders_enabled or scheduler is None:
@@ -207,18 +651,17 @@ class ReminderService:
         from sqlalchemy import select
         from app.storage.db import SessionLocal
         from app.storage.models import WeeklySubscription as WS, User as U
-        from app.runtime import get_bot
 
         async with SessionLocal() as session:
             res = await session.execute(select(WS).where(WS.id == sub_id))
             sub: Optional[WS] = res.scalar_one_or_none()
-            if not sub or not sub.is_active:
+            if not sub or not sub.is_active or sub.minute_of_day is None:
                 log.info("reminders.weekly.fire sub=%s -> not found or inactive", sub_id)
                 return
 
             tz = ZoneInfo(tz_name)
             now = datetime.now(tz)
-            hh, mm = map(int, sub.time_hhmm.split(":"))
+            hh, mm = divmod(sub.minute_of_day, 60)
             days_ahead = (sub.weekday - now.weekday()) % 7
             start_at = (now + timedelta(days=days_ahead)).replace(
                 hour=hh, minute=mm, second=0, microsecond=0
@@ -227,24 +670,25 @@ class ReminderService:
             student = sub.student_name or "Ученик"
             when_txt = format_dt_ru(start_at)
 
-            bot: Bot = get_bot()
+            telegram = get_queue()
 
             ures = await session.execute(select(U).where(U.id == sub.user_id))
             user = ures.scalar_one_or_none()
 
             try:
                 if user and user.tg_id:
-                    await bot.send_message(
-                        user.tg_id, f"Напоминание о еженедельном занятии\n{when_txt}\nИмя: {student}"
+                    await telegram.send_message(
+                        user.tg_id, f"Напоминание о еженедельном занятии\n{when_txt}\nИмя: {student}", Priority.REMINDER
                     )
             except Exception as e:
-                log.error(f"Failed to send weekly reminder to user {user.tg_id}: {e}")
+                log.error(f"Failed to send weekly reminder for subscription {sub.id}: {e}")
 
             for admin_id in settings.admins:
                 try:
-                    await bot.send_message(
+                    await telegram.send_message(
                         admin_id,
                         f"Еженедельное напоминание (ученик): {student}\nКогда: {when_txt}\nКонтакт: {sub.student_contact or '—'}",
+                        Priority.REMINDER,
                     )
                 except Exception as e:
                     log.error(f"Failed to send weekly reminder to admin {admin_id}: {e}")
@@ -252,10 +696,11 @@ class ReminderService:
             email = sub.student_contact or ""
             if EmailService.is_email(email):
                 try:
-                    EmailService.send(
+                    await EmailOutboxService.submit(
                         to_email=email,
                         subject="Напоминание о занятии (еженедельно)",
                         body=f"Здравствуйте!\nНапоминаем о занятии: {when_txt}\nУченик: {student}",
+                        kind="weekly",
                     )
                 except Exception as e:
                     log.error(f"Failed to send weekly email reminder to {email}: {e}")
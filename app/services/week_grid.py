@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional
+
+WEEKDAY_HOURS = (16, 17, 19)  # 16:00, 17:45, 19:30
+WEEKDAY_MINUTES = (0, 45, 30)  # минуты для каждого часа
+
+# Сетка «день × слот»: бит с номером day * SLOTS_PER_DAY + slot.
+# Слоты дня берутся из WEEKDAY_HOURS/WEEKDAY_MINUTES, дни считаются от начала окна.
+SLOT_TIMES: tuple[time, ...] = tuple(time(hour=h, minute=m) for h, m in zip(WEEKDAY_HOURS, WEEKDAY_MINUTES))
+SLOTS_PER_DAY = len(SLOT_TIMES)
+_DAY_MASK = (1 << SLOTS_PER_DAY) - 1
+_SLOT_BY_TIME: Dict[tuple[int, int], int] = {(t.hour, t.minute): i for i, t in enumerate(SLOT_TIMES)}
+
+
+@lru_cache(maxsize=64)
+def _candidates_mask(first_weekday: int, days: int) -> int:
+    """Все рабочие (Пн–Пт) слоты окна"""
+    mask = 0
+    for d in range(days):
+        if (first_weekday + d) % 7 < 5:
+            mask |= _DAY_MASK << (d * SLOTS_PER_DAY)
+    return mask
+
+
+class SlotGrid:
+    """Битовая сетка занятости слотов на окно из `days` дней начиная со `start`"""
+
+    __slots__ = ("start", "days", "busy", "weekly")
+
+    def __init__(self, start: date, days: int) -> None:
+        self.start = start
+        self.days = days
+        self.busy = 0     # разовые занятия (slots/bookings)
+        self.weekly = 0   # занятия интервальных серий (occurrences)
+
+    # --- адресация ---
+
+    def bit_of(self, dt: datetime) -> Optional[int]:
+        day = (dt.date() - self.start).days
+        slot = _SLOT_BY_TIME.get((dt.hour, dt.minute))
+        if slot is None or not 0 <= day < self.days:
+            return None
+        return day * SLOTS_PER_DAY + slot
+
+    def _time_of(self, bit: int) -> datetime:
+        day, slot = divmod(bit, SLOTS_PER_DAY)
+        return datetime.combine(self.start + timedelta(days=day), SLOT_TIMES[slot])
+
+    def _not_before(self, now: datetime) -> int:
+        """Маска слотов, которые ещё не начались"""
+        day = (now.date() - self.start).days
+        if day < 0:
+            return -1
+        if day >= self.days:
+            return 0
+        first = day * SLOTS_PER_DAY
+        for t in SLOT_TIMES:
+            if t >= now.time():
+                break
+            first += 1
+        return ~((1 << first) - 1)
+
+    # --- изменения ---
+
+    def occupy(self, dt: datetime) -> None:
+        bit = self.bit_of(dt)
+        if bit is not None:
+            self.busy |= 1 << bit
+
+    def release(self, dt: datetime) -> None:
+        bit = self.bit_of(dt)
+        if bit is not None:
+            self.busy &= ~(1 << bit)
+
+    def occupy_recurring(self, dt: datetime) -> None:
+        """Одно занятие серии — с учётом пропусков и переносов"""
+        bit = self.bit_of(dt)
+        if bit is not None:
+            self.weekly |= 1 << bit
+
+    def release_recurring(self, dt: datetime) -> None:
+        bit = self.bit_of(dt)
+        if bit is not None:
+            self.weekly &= ~(1 << bit)
+
+    # --- чтение ---
+
+    @property
+    def candidates(self) -> int:
+        return _candidates_mask(self.start.weekday(), self.days)
+
+    def free_mask(self, now: Optional[datetime] = None) -> int:
+        free = self.candidates & ~(self.busy | self.weekly)
+        return free & self._not_before(now) if now is not None else free
+
+    def free_counts(self, now: Optional[datetime] = None) -> Dict[date, int]:
+        free = self.free_mask(now)
+        counts: Dict[date, int] = {}
+        day = 0
+        while free:
+            cnt = (free & _DAY_MASK).bit_count()
+            if cnt:
+                counts[self.start + timedelta(days=day)] = cnt
+            free >>= SLOTS_PER_DAY
+            day += 1
+        return counts
+
+    def free_times(self, day: date, now: Optional[datetime] = None) -> List[datetime]:
+        offset = (day - self.start).days
+        if not 0 <= offset < self.days:
+            return []
+        bits = (self.free_mask(now) >> (offset * SLOTS_PER_DAY)) & _DAY_MASK
+        return [datetime.combine(day, t) for slot, t in enumerate(SLOT_TIMES) if bits >> slot & 1]
+
+    def weekly_times(self, day: date) -> List[datetime]:
+        offset = (day - self.start).days
+        if not 0 <= offset < self.days:
+            return []
+        bits = (self.weekly >> (offset * SLOTS_PER_DAY)) & _DAY_MASK
+        return [datetime.combine(day, t) for slot, t in enumerate(SLOT_TIMES) if bits >> slot & 1]
+
+    def busy_times(self) -> Iterator[datetime]:
+        mask = (self.busy | self.weekly) & self.candidates
+        while mask:
+            low = mask & -mask
+            yield self._time_of(low.bit_length() - 1)
+            mask ^= low
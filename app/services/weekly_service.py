@@ -1,9 +1,10 @@
 from sqlalchemy import select
 from sqlalchemy.orm import selectinload
 from app.storage.models import WeeklySubscription, User
-from app.services.google_calendar_service import GoogleCalendarService
+from app.integrations.google_calendar import GoogleCalendar
 from app.services.reminder_service import ReminderService
 from app.config import settings
+from app.utils.dates import hhmm_to_minutes
 
 class WeeklyService:
     @staticmethod
@@ -15,6 +16,7 @@ class WeeklyService:
             student_contact=contact,
             weekday=weekday,
             time_hhmm=time_hhmm,
+            minute_of_day=hhmm_to_minutes(time_hhmm),
             duration_min=duration_min,
             is_active=True,
         )
@@ -22,7 +24,7 @@ class WeeklyService:
         await session.flush()
 
         if settings.google_calendar_enabled:
-            ev_id = GoogleCalendarService.create_recurring_event(
+            ev_id = await GoogleCalendar.create_recurring_event(
                 summary=f"Занятие: {student_name}",
                 weekday=weekday,
                 time_hhmm=time_hhmm,
@@ -64,7 +66,7 @@ class WeeklyService:
 
         try:
             if sub.gcal_event_id:
-                GoogleCalendarService.delete_recurring_series(sub.gcal_event_id)
+                await GoogleCalendar.delete_recurring_series(sub.gcal_event_id)
         except Exception:
             pass
 
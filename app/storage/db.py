@@ -4,24 +4,93 @@ from __future__ import annotations
 from contextlib import asynccontextmanager
 from typing import AsyncGenerator, AsyncIterator
 
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
     AsyncSession,
     async_sessionmaker,
     create_async_engine,
 )
 from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 from app.config import settings
 
 class Base(DeclarativeBase):
     pass
 
-engine = create_async_engine(
-    settings.db_url,
-    future=True,
-    pool_pre_ping=True,
-    echo=False,
-)
+# URL без async-драйвера (как их выдают хостинги) приводим к асинхронному
+_ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgres": "postgresql+asyncpg",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+}
+
+def async_db_url(url: str | None = None) -> str:
+    parsed = make_url(url or settings.db_url)
+    parsed = parsed.set(drivername=_ASYNC_DRIVERS.get(parsed.drivername, parsed.drivername))
+    return parsed.render_as_string(hide_password=False)
+
+def sqlite_pragmas() -> dict[str, object]:
+    """PRAGMA профиля SQLite из настроек, в порядке применения"""
+    return {
+        "journal_mode": settings.sqlite_journal_mode,
+        "synchronous": settings.sqlite_synchronous,
+        "busy_timeout": settings.sqlite_busy_timeout_ms,
+        "mmap_size": settings.sqlite_mmap_size,
+        # Отрицательное значение — размер в КиБ, а не в страницах
+        "cache_size": -settings.sqlite_cache_size_kib,
+        "temp_store": settings.sqlite_temp_store,
+    }
+
+def _apply_sqlite_pragmas(dbapi_conn, _record) -> None:
+    cursor = dbapi_conn.cursor()
+    try:
+        for name, value in sqlite_pragmas().items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+def build_engine(url: str | None = None, tuned: bool | None = None) -> AsyncEngine:
+    """Async-движок для url (по умолчанию settings.db_url).
+
+    Для PostgreSQL (asyncpg) пул настраивается DB_POOL_SIZE, DB_MAX_OVERFLOW,
+    DB_POOL_RECYCLE_SECONDS и DB_POOL_TIMEOUT_SECONDS.
+
+    Для SQLite с tuned (по умолчанию settings.sqlite_tuned) к каждому новому
+    соединению применяется профиль sqlite_pragmas(), соединения держит пул
+    DB_POOL_SIZE/DB_MAX_OVERFLOW, а pre_ping отключён: локальный файл не
+    «отваливается», а лишний SELECT на каждую выдачу из пула — заметная
+    доля коротких запросов. Для остальных баз pre_ping остаётся:
+    соединение мог закрыть сервер.
+    """
+    url = async_db_url(url)
+    tuned = settings.sqlite_tuned if tuned is None else tuned
+    is_sqlite = make_url(url).get_backend_name() == "sqlite"
+
+    if is_sqlite and not tuned:
+        return create_async_engine(url, future=True, pool_pre_ping=True, echo=False)
+
+    options: dict = {"pool_pre_ping": not is_sqlite}
+    if is_sqlite and make_url(url).database in (None, "", ":memory:"):
+        pass  # база в памяти живёт в единственном соединении — пул не трогаем
+    else:
+        if is_sqlite:
+            # По умолчанию aiosqlite работает без пула (NullPool): новое соединение,
+            # поток и PRAGMA на каждую сессию
+            options["poolclass"] = AsyncAdaptedQueuePool
+        options.update(pool_size=settings.db_pool_size, max_overflow=settings.db_max_overflow)
+    if not is_sqlite:
+        options.update(pool_recycle=settings.db_pool_recycle_seconds, pool_timeout=settings.db_pool_timeout_seconds)
+    eng = create_async_engine(url, future=True, echo=False, **options)
+    if is_sqlite:
+        event.listen(eng.sync_engine, "connect", _apply_sqlite_pragmas)
+    return eng
+
+engine = build_engine()
 
 SessionLocal: async_sessionmaker[AsyncSession] = async_sessionmaker(
     bind=engine,
@@ -30,6 +99,12 @@ SessionLocal: async_sessionmaker[AsyncSession] = async_sessionmaker(
     autoflush=False,
 )
 
+def dialect_insert(session):
+    """insert() с поддержкой ON CONFLICT для текущей БД"""
+    if session.bind.dialect.name == "postgresql":
+        return postgresql.insert
+    return sqlite.insert
+
 async def get_session() -> AsyncGenerator[AsyncSession, None]:
     async with SessionLocal() as session:
         yield session
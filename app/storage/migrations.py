@@ -0,0 +1,337 @@
+# app/storage/migrations.py
+"""Лёгкие миграции схемы поверх Base.metadata.create_all.
+
+create_all создаёт только новые таблицы и не трогает существующие, поэтому
+новые колонки, индексы и переносы данных для уже работающих баз описываются
+здесь. Каждая миграция — функция от синхронного Connection, применяется один
+раз и записывается в schema_migrations. Миграции должны быть идемпотентны:
+на свежей базе create_all уже создал всё по моделям.
+"""
+from __future__ import annotations
+
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List, Tuple
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, bindparam, inspect, select, text
+from sqlalchemy.engine import Connection
+
+from app.config import settings
+
+log = logging.getLogger("db.migrations")
+
+_meta = MetaData()
+schema_migrations = Table(
+    "schema_migrations",
+    _meta,
+    Column("version", Integer, primary_key=True),
+    Column("name", String(128), nullable=False),
+    Column("applied_at", DateTime(timezone=False), nullable=False),
+)
+
+
+def _has_column(conn: Connection, table: str, column: str) -> bool:
+    return any(c["name"] == column for c in inspect(conn).get_columns(table))
+
+
+def _has_index(conn: Connection, table: str, index: str) -> bool:
+    return any(i["name"] == index for i in inspect(conn).get_indexes(table))
+
+
+def _add_column(conn: Connection, table: str, column: str, ddl_type: str) -> None:
+    if not _has_column(conn, table, column):
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}"))
+
+
+def _add_index(conn: Connection, table: str, index: str, columns: str) -> None:
+    if not _has_index(conn, table, index):
+        conn.execute(text(f"CREATE INDEX {index} ON {table} ({columns})"))
+
+
+def _datetimes(sql: str, *names: str):
+    """text() с параметрами-временем через DateTime.
+
+    Драйвер sqlite3 сам пишет datetime как 'YYYY-MM-DD HH:MM:SS', а
+    DateTime моделей — с микросекундами; SQLite сравнивает их как строки,
+    и равенство/уникальность с записанными через ORM строками не сходятся.
+    """
+    return text(sql).bindparams(*(bindparam(name, type_=DateTime(timezone=False)) for name in names))
+
+
+def _as_datetime(value):
+    """Время из сырого SELECT: на SQLite приходит строкой"""
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+# --- миграции ---
+
+def _m001_booking_next_remind_at(conn: Connection) -> None:
+    """bookings.next_remind_at для диспетчера напоминаний + заполнение по будущим занятиям"""
+    from app.services.reminder_service import ReminderService
+
+    _add_column(conn, "bookings", "next_remind_at", "TIMESTAMP")
+    _add_index(conn, "bookings", "ix_bookings_next_remind_at", "next_remind_at")
+
+    now = ReminderService.now_local()
+    rows = conn.execute(
+        _datetimes(
+            "SELECT b.id, s.start_at FROM bookings b JOIN slots s ON s.id = b.slot_id "
+            "WHERE s.start_at > :now AND b.next_remind_at IS NULL",
+            "now",
+        ),
+        {"now": now},
+    ).all()
+    for booking_id, start_at in rows:
+        conn.execute(
+            _datetimes("UPDATE bookings SET next_remind_at = :at WHERE id = :id", "at"),
+            {"at": ReminderService.next_remind_at(_as_datetime(start_at), now), "id": booking_id},
+        )
+    log.info("migration 1: next_remind_at filled for %s bookings", len(rows))
+
+
+def _m002_interval_recurrences(conn: Connection) -> None:
+    """Интервальные записи → recurrences + occurrences.
+
+    Раньше у интервальной записи был один слот «ближайшего занятия» в
+    bookings.slot_id, который цепочка задач interval_event_* переставляла
+    раз в неделю. Теперь это правило серии; будущее занятие из слота
+    становится первым occurrence (с событием календаря и next_remind_at),
+    остальные доложит RecurrenceService.materialize() при старте.
+    """
+    from app.services.reminder_service import ReminderService
+    from app.utils.dates import hhmm_to_minutes
+
+    now = ReminderService.now_local()
+    rows = conn.execute(
+        text(
+            "SELECT b.id, b.weekday, b.time_hhmm, b.gcal_event_id, b.next_remind_at, s.id, s.start_at "
+            "FROM bookings b LEFT JOIN slots s ON s.id = b.slot_id "
+            "WHERE b.lesson_type = 'interval' AND b.weekday IS NOT NULL AND b.time_hhmm IS NOT NULL "
+            "AND b.id NOT IN (SELECT booking_id FROM recurrences)"
+        )
+    ).all()
+
+    moved = 0
+    for booking_id, weekday, time_hhmm, gcal_event_id, next_remind_at, slot_id, start_at in rows:
+        conn.execute(
+            text(
+                "INSERT INTO recurrences "
+                "(booking_id, rule, interval_weeks, weekday, time_hhmm, minute_of_day, starts_on, exceptions) "
+                "VALUES (:booking_id, 'weekly', 1, :weekday, :time_hhmm, :minute_of_day, :starts_on, '{}')"
+            ),
+            {
+                "booking_id": booking_id, "weekday": weekday, "time_hhmm": time_hhmm,
+                "minute_of_day": hhmm_to_minutes(time_hhmm), "starts_on": now.date(),
+            },
+        )
+        if slot_id is None:
+            continue
+
+        start_at = _as_datetime(start_at)
+        if start_at > now:
+            recurrence_id = conn.execute(
+                text("SELECT id FROM recurrences WHERE booking_id = :id"), {"id": booking_id}
+            ).scalar_one()
+            conn.execute(
+                _datetimes(
+                    "INSERT INTO occurrences "
+                    "(recurrence_id, booking_id, original_start_at, start_at, next_remind_at, gcal_event_id) "
+                    "VALUES (:recurrence_id, :booking_id, :start_at, :start_at, :next_remind_at, :gcal_event_id)",
+                    "start_at", "next_remind_at",
+                ),
+                {
+                    "recurrence_id": recurrence_id, "booking_id": booking_id, "start_at": start_at,
+                    "next_remind_at": _as_datetime(next_remind_at), "gcal_event_id": gcal_event_id,
+                },
+            )
+            moved += 1
+        # Слот интервальной записи больше не нужен — занятость ведут occurrences
+        conn.execute(
+            text("UPDATE bookings SET slot_id = NULL, gcal_event_id = NULL, next_remind_at = NULL WHERE id = :id"),
+            {"id": booking_id},
+        )
+        conn.execute(text("DELETE FROM slots WHERE id = :id"), {"id": slot_id})
+    log.info("migration 2: %s interval bookings converted, %s upcoming lessons moved", len(rows), moved)
+
+
+def _m003_gcal_event_ids_jsonb(conn: Connection) -> None:
+    """bookings.gcal_event_ids: строка с JSON → JSONB (только PostgreSQL)"""
+    if conn.dialect.name != "postgresql":
+        return
+    column = next(c for c in inspect(conn).get_columns("bookings") if c["name"] == "gcal_event_ids")
+    if column["type"].__class__.__name__ != "JSONB":
+        conn.execute(
+            text(
+                "ALTER TABLE bookings ALTER COLUMN gcal_event_ids TYPE JSONB "
+                "USING NULLIF(gcal_event_ids, '')::jsonb"
+            )
+        )
+
+
+def _m004_hot_query_indexes(conn: Connection) -> None:
+    """Составные индексы под частые запросы (см. scripts/test_query_plans.py)"""
+    _add_index(conn, "bookings", "ix_bookings_user_id", "user_id, id")
+    _add_index(conn, "bookings", "ix_bookings_interval_time", "lesson_type, weekday, time_hhmm")
+    _add_index(conn, "weekly_subscriptions", "ix_weekly_subscriptions_time", "weekday, time_hhmm, is_active")
+    _add_index(conn, "reminder_deliveries", "ix_reminder_deliveries_retry", "status, start_at")
+
+
+def _m005_minute_of_day(conn: Connection) -> None:
+    """minute_of_day (минуты от начала суток) рядом с time_hhmm + индексы по нему вместо строки"""
+    from app.utils.dates import hhmm_to_minutes
+
+    filled = 0
+    for table in ("bookings", "recurrences", "weekly_subscriptions"):
+        _add_column(conn, table, "minute_of_day", "INTEGER")
+        rows = conn.execute(
+            text(f"SELECT id, time_hhmm FROM {table} WHERE time_hhmm IS NOT NULL AND minute_of_day IS NULL")
+        ).all()
+        for row_id, time_hhmm in rows:
+            try:
+                minutes = hhmm_to_minutes(time_hhmm)
+            except ValueError:
+                log.warning("migration 5: %s #%s has bad time_hhmm=%r, left NULL", table, row_id, time_hhmm)
+                continue
+            conn.execute(text(f"UPDATE {table} SET minute_of_day = :m WHERE id = :id"), {"m": minutes, "id": row_id})
+            filled += 1
+
+    # Индексы миграции 4 по строке заменяются индексами по минутам
+    conn.execute(text("DROP INDEX IF EXISTS ix_bookings_interval_time"))
+    conn.execute(text("DROP INDEX IF EXISTS ix_weekly_subscriptions_time"))
+    _add_index(conn, "bookings", "ix_bookings_interval_minute", "lesson_type, weekday, minute_of_day")
+    _add_index(conn, "weekly_subscriptions", "ix_weekly_subscriptions_minute", "weekday, minute_of_day, is_active")
+    log.info("migration 5: minute_of_day filled for %s rows", filled)
+
+
+# Колонки с моментами занятий (UTCDateTime в моделях)
+_UTC_COLUMNS = (
+    ("slots", "start_at"),
+    ("bookings", "next_remind_at"),
+    ("occurrences", "original_start_at"),
+    ("occurrences", "start_at"),
+    ("occurrences", "next_remind_at"),
+    ("reminder_deliveries", "start_at"),
+)
+
+
+def _m006_utc_instants(conn: Connection) -> None:
+    """Времена занятий и напоминаний: локальное время settings.tz → UTC.
+
+    Строки обновляются по порядку значений в сторону сдвига, чтобы
+    уникальные индексы (slots.start_at, uq_occurrence, uq_reminder_delivery)
+    не ловили временный конфликт с ещё не сдвинутой строкой.
+    """
+    from app.utils.dates import to_utc
+
+    east = (ZoneInfo(settings.tz).utcoffset(datetime.now()) or timedelta(0)) >= timedelta(0)
+    total = 0
+    for table, column in _UTC_COLUMNS:
+        rows = conn.execute(
+            text(
+                f"SELECT id, {column} FROM {table} WHERE {column} IS NOT NULL "
+                f"ORDER BY {column} {'ASC' if east else 'DESC'}"
+            )
+        ).all()
+        for row_id, value in rows:
+            conn.execute(
+                _datetimes(f"UPDATE {table} SET {column} = :at WHERE id = :id", "at"),
+                {"at": to_utc(_as_datetime(value)).replace(tzinfo=None), "id": row_id},
+            )
+        total += len(rows)
+    log.info("migration 6: %s values converted from %s to UTC", total, settings.tz)
+
+
+def _m007_reminder_claimed_at(conn: Connection) -> None:
+    """reminder_deliveries.claimed_at — аренда pending-строк журнала напоминаний"""
+    _add_column(conn, "reminder_deliveries", "claimed_at", "TIMESTAMP")
+    conn.execute(text("UPDATE reminder_deliveries SET claimed_at = created_at WHERE claimed_at IS NULL"))
+
+
+def _m008_drop_apscheduler_jobs(conn: Connection) -> None:
+    """Таблица постоянного хранилища задач APScheduler больше не используется"""
+    conn.execute(text("DROP TABLE IF EXISTS apscheduler_jobs"))
+
+
+def _host_time_to_utc(conn: Connection, columns) -> int:
+    """Служебные отметки времени, записанные datetime.now() (локальное время хоста), → UTC.
+
+    Уникальных индексов на этих колонках нет, поэтому порядок обновления
+    не важен. Наивный datetime.astimezone() берёт пояс хоста — тот же,
+    которым их записывал datetime.now().
+    """
+    total = 0
+    for table, column in columns:
+        rows = conn.execute(text(f"SELECT id, {column} FROM {table} WHERE {column} IS NOT NULL")).all()
+        for row_id, value in rows:
+            conn.execute(
+                _datetimes(f"UPDATE {table} SET {column} = :at WHERE id = :id", "at"),
+                {"at": _as_datetime(value).astimezone(timezone.utc).replace(tzinfo=None), "id": row_id},
+            )
+        total += len(rows)
+    return total
+
+
+def _m009_reminder_ledger_utc(conn: Connection) -> None:
+    """created_at, claimed_at, sent_at журнала напоминаний — в UTC"""
+    columns = ("created_at", "claimed_at", "sent_at")
+    total = _host_time_to_utc(conn, [("reminder_deliveries", column) for column in columns])
+    log.info("migration 9: %s reminder ledger timestamps converted to UTC", total)
+
+
+def _m010_outbox_utc(conn: Connection) -> None:
+    """Отметки времени calendar_outbox и email_outbox — в UTC"""
+    columns = [
+        ("calendar_outbox", "next_attempt_at"),
+        ("calendar_outbox", "created_at"),
+        ("calendar_outbox", "done_at"),
+        ("email_outbox", "next_attempt_at"),
+        ("email_outbox", "created_at"),
+        ("email_outbox", "sent_at"),
+    ]
+    log.info("migration 10: %s outbox timestamps converted to UTC", _host_time_to_utc(conn, columns))
+
+
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "booking_next_remind_at", _m001_booking_next_remind_at),
+    (2, "interval_recurrences", _m002_interval_recurrences),
+    (3, "gcal_event_ids_jsonb", _m003_gcal_event_ids_jsonb),
+    (4, "hot_query_indexes", _m004_hot_query_indexes),
+    (5, "minute_of_day", _m005_minute_of_day),
+    (6, "utc_instants", _m006_utc_instants),
+    (7, "reminder_claimed_at", _m007_reminder_claimed_at),
+    (8, "drop_apscheduler_jobs", _m008_drop_apscheduler_jobs),
+    (9, "reminder_ledger_utc", _m009_reminder_ledger_utc),
+    (10, "outbox_utc", _m010_outbox_utc),
+]
+
+# Ключ advisory-блокировки PostgreSQL: реплики не меняют схему одновременно
+_SCHEMA_LOCK_KEY = 0x74757472
+
+
+def lock_schema(conn: Connection) -> None:
+    """Блокировка схемы до конца транзакции init_db (только PostgreSQL).
+
+    Вызывается первой: вторая реплика ждёт, пока первая создаст таблицы и
+    применит миграции.
+    """
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _SCHEMA_LOCK_KEY})
+
+
+def run_migrations(conn: Connection) -> List[int]:
+    """Применяет недостающие миграции по порядку; вызывается из init_db через run_sync"""
+    _meta.create_all(conn)
+    applied = set(conn.execute(select(schema_migrations.c.version)).scalars())
+
+    done: List[int] = []
+    for version, name, migrate in MIGRATIONS:
+        if version in applied:
+            continue
+        log.info("applying migration %s: %s", version, name)
+        migrate(conn)
+        conn.execute(
+            schema_migrations.insert().values(version=version, name=name, applied_at=datetime.now())
+        )
+        done.append(version)
+    return done
@@ -1,10 +1,33 @@
 from __future__ import annotations
 from typing import Optional
 
-from sqlalchemy import String, Integer, ForeignKey, DateTime, Boolean, UniqueConstraint
+from sqlalchemy import JSON, String, Integer, ForeignKey, Date, DateTime, Boolean, Index, UniqueConstraint, Text
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy.types import TypeDecorator
 from app.storage.db import Base
-from datetime import datetime
+from app.utils.dates import to_utc, utcnow
+from datetime import date, datetime, timezone
+
+class UTCDateTime(TypeDecorator):
+    """Момент времени: в базе — UTC без tzinfo, в Python — aware UTC.
+
+    Сравнения и диапазоны в SQL идут по UTC и не зависят от перехода на
+    летнее время. Наивное значение на входе (в том числе параметр запроса)
+    считается локальным временем settings.tz.
+    """
+    impl = DateTime(timezone=False)
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return to_utc(value).replace(tzinfo=None)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return value.replace(tzinfo=timezone.utc)
 
 class User(Base):
     __tablename__ = "users"
@@ -18,7 +41,7 @@ class User(Base):
 class Slot(Base):
     __tablename__ = "slots"
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    start_at: Mapped[datetime] = mapped_column(DateTime(timezone=False), index=True, unique=True)
+    start_at: Mapped[datetime] = mapped_column(UTCDateTime(), index=True, unique=True)
     is_active: Mapped[bool] = mapped_column(Boolean, default=True)
 
     booking: Mapped[Optional["Booking"]] = relationship(back_populates="slot", uselist=False)
@@ -38,22 +61,89 @@ class Booking(Base):
     # Для интервальных занятий - день недели (0=Пн, 6=Вс)
     weekday: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
     
-    # Для интервальных занятий - время в формате HH:MM
+    # Для интервальных занятий - время в формате HH:MM (для показа)
     time_hhmm: Mapped[Optional[str]] = mapped_column(String(5), nullable=True)
+    # То же время в минутах от начала суток — для запросов и расчётов
+    minute_of_day: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
 
     remind_24h_sent: Mapped[bool] = mapped_column(Boolean, default=False)
     remind_1h_sent: Mapped[bool] = mapped_column(Boolean, default=False)
 
+    # Ближайшее неотправленное напоминание (UTC), NULL — больше нет
+    next_remind_at: Mapped[Optional[datetime]] = mapped_column(UTCDateTime(), nullable=True, index=True)
+
     user: Mapped["User"] = relationship(back_populates="bookings")
     slot: Mapped[Optional["Slot"]] = relationship(back_populates="booking")
 
     gcal_event_id: Mapped[Optional[str]] = mapped_column(nullable=True)
     
-    # Для интервальных занятий - JSON список ID событий календаря
-    gcal_event_ids: Mapped[Optional[str]] = mapped_column(nullable=True)
+    # Список ID событий календаря (JSON; в PostgreSQL — JSONB)
+    gcal_event_ids: Mapped[Optional[list[str]]] = mapped_column(
+        JSON().with_variant(JSONB(), "postgresql"), nullable=True
+    )
 
     __table_args__ = (
         UniqueConstraint("slot_id", name="uq_booking_slot"),
+        # «Мои записи»: по пользователю, новые сверху
+        Index("ix_bookings_user_id", "user_id", "id"),
+        # Занятость интервальных времён дня недели (book_interval, выбор времени)
+        # и выборки по диапазону времени
+        Index("ix_bookings_interval_minute", "lesson_type", "weekday", "minute_of_day"),
+    )
+
+class Recurrence(Base):
+    """Правило интервального занятия: каждую interval_weeks-ю неделю в weekday, minute_of_day.
+
+    Серия начинается с starts_on и заканчивается на until или после count
+    занятий (оба пустые — бессрочно). exceptions — JSON {"ГГГГ-ММ-ДД": null}
+    для пропуска недели или {"ГГГГ-ММ-ДД": "ГГГГ-ММ-ДДTЧЧ:ММ"} для разового
+    переноса; ключ — дата занятия по правилу (даты и время здесь локальные,
+    settings.tz). Конкретные занятия лежат в
+    occurrences (app/services/recurrence_service.py)
+    """
+    __tablename__ = "recurrences"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    booking_id: Mapped[int] = mapped_column(ForeignKey("bookings.id", ondelete="CASCADE"), unique=True)
+
+    # Пока поддерживается только 'weekly'
+    rule: Mapped[str] = mapped_column(String(16), default="weekly")
+    interval_weeks: Mapped[int] = mapped_column(Integer, default=1)
+    weekday: Mapped[int] = mapped_column(Integer)
+    time_hhmm: Mapped[str] = mapped_column(String(5))
+    # Минуты от начала суток; NULL только до миграции 5
+    minute_of_day: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+
+    starts_on: Mapped[date] = mapped_column(Date)
+    until: Mapped[Optional[date]] = mapped_column(Date, nullable=True)
+    count: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    exceptions: Mapped[str] = mapped_column(Text, default="{}")
+
+    booking: Mapped["Booking"] = relationship()
+
+class Occurrence(Base):
+    """Одно занятие серии на скользящем горизонте вперёд.
+
+    original_start_at — время по правилу (ключ исключения), start_at —
+    фактическое с учётом переноса. По start_at работают индекс свободных
+    слотов, напоминания (next_remind_at) и события календаря (gcal_event_id)
+    """
+    __tablename__ = "occurrences"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    recurrence_id: Mapped[int] = mapped_column(ForeignKey("recurrences.id", ondelete="CASCADE"), index=True)
+    booking_id: Mapped[int] = mapped_column(ForeignKey("bookings.id", ondelete="CASCADE"), index=True)
+
+    original_start_at: Mapped[datetime] = mapped_column(UTCDateTime())
+    start_at: Mapped[datetime] = mapped_column(UTCDateTime(), index=True)
+
+    next_remind_at: Mapped[Optional[datetime]] = mapped_column(UTCDateTime(), nullable=True, index=True)
+    gcal_event_id: Mapped[Optional[str]] = mapped_column(String(128), nullable=True)
+
+    booking: Mapped["Booking"] = relationship()
+
+    __table_args__ = (
+        UniqueConstraint("recurrence_id", "original_start_at", name="uq_occurrence"),
     )
 
 class WeeklySubscription(Base):
@@ -66,9 +156,105 @@ class WeeklySubscription(Base):
 
     weekday: Mapped[int] = mapped_column(Integer)
     time_hhmm: Mapped[str] = mapped_column(String(5))
+    # Минуты от начала суток; NULL только до миграции 5
+    minute_of_day: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
     duration_min: Mapped[int] = mapped_column(Integer, default=60)
 
     gcal_event_id: Mapped[Optional[str]] = mapped_column(String(128), nullable=True)
 
     is_active: Mapped[bool] = mapped_column(Boolean, default=True)
-    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow)
\ No newline at end of file
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow)
+
+    __table_args__ = (
+        # Занятые времена дня недели при выборе еженедельной записи
+        Index("ix_weekly_subscriptions_minute", "weekday", "minute_of_day", "is_active"),
+    )
+
+class CalendarOutbox(Base):
+    """Отложенные операции с Google Calendar.
+
+    Строка пишется в той же транзакции, что и изменение записи, и потом
+    выполняется фоновым воркером (app/services/calendar_outbox.py)
+    """
+    __tablename__ = "calendar_outbox"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    booking_id: Mapped[Optional[int]] = mapped_column(Integer, index=True, nullable=True)
+
+    # 'create' | 'update' | 'delete'
+    action: Mapped[str] = mapped_column(String(16))
+    # JSON с параметрами операции (start_at, summary, event_id)
+    payload: Mapped[str] = mapped_column(Text, default="{}")
+
+    # 'pending' | 'done' | 'failed'
+    status: Mapped[str] = mapped_column(String(16), default="pending", index=True)
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    next_attempt_at: Mapped[datetime] = mapped_column(UTCDateTime(), default=utcnow)
+    last_error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+
+    created_at: Mapped[datetime] = mapped_column(UTCDateTime(), default=utcnow)
+    done_at: Mapped[Optional[datetime]] = mapped_column(UTCDateTime(), nullable=True)
+
+class EmailOutbox(Base):
+    """Исходящие письма.
+
+    Строка пишется в той же транзакции, что и событие, о котором письмо
+    (запись, напоминание), и отправляется фоновым воркером
+    (app/services/email_outbox.py). После исчерпания попыток строка
+    остаётся в статусе 'dead' до ручного /email_requeue
+    """
+    __tablename__ = "email_outbox"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    booking_id: Mapped[Optional[int]] = mapped_column(Integer, index=True, nullable=True)
+
+    # 'confirmation' | 'reminder' | 'weekly' — для просмотра и статистики
+    kind: Mapped[str] = mapped_column(String(32), default="other")
+    to_email: Mapped[str] = mapped_column(String(255))
+    subject: Mapped[str] = mapped_column(String(255))
+    body: Mapped[str] = mapped_column(Text)
+
+    # 'pending' | 'sent' | 'dead'
+    status: Mapped[str] = mapped_column(String(16), default="pending", index=True)
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    next_attempt_at: Mapped[datetime] = mapped_column(UTCDateTime(), default=utcnow)
+    last_error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+
+    created_at: Mapped[datetime] = mapped_column(UTCDateTime(), default=utcnow)
+    sent_at: Mapped[Optional[datetime]] = mapped_column(UTCDateTime(), nullable=True)
+
+class ReminderDelivery(Base):
+    """Журнал напоминаний: одна строка на запись × занятие × offset × канал × получателя.
+
+    Строка вставляется до отправки (ON CONFLICT DO NOTHING), поэтому
+    повторный тик, рестарт или /remindnow не отправят то же напоминание
+    второй раз (app/services/reminder_service.py)
+    """
+    __tablename__ = "reminder_deliveries"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    booking_id: Mapped[int] = mapped_column(Integer, index=True)
+    # Время занятия: после переноса или у следующего интервального занятия напоминания новые
+    start_at: Mapped[datetime] = mapped_column(UTCDateTime())
+    offset_min: Mapped[int] = mapped_column(Integer)
+
+    # 'user' | 'admin' | 'email'
+    channel: Mapped[str] = mapped_column(String(16))
+    # tg_id или email получателя
+    recipient: Mapped[str] = mapped_column(String(200))
+
+    # 'pending' | 'sent' | 'failed'
+    status: Mapped[str] = mapped_column(String(16), default="pending")
+    attempts: Mapped[int] = mapped_column(Integer, default=1)
+    last_error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+
+    created_at: Mapped[datetime] = mapped_column(UTCDateTime(), default=utcnow)
+    # Последний захват строки на отправку: pending дольше аренды считается брошенным
+    claimed_at: Mapped[Optional[datetime]] = mapped_column(UTCDateTime(), default=utcnow, nullable=True)
+    sent_at: Mapped[Optional[datetime]] = mapped_column(UTCDateTime(), nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint("booking_id", "start_at", "offset_min", "channel", "recipient", name="uq_reminder_delivery"),
+        # Повтор неудачных отправок на каждом тике диспетчера
+        Index("ix_reminder_deliveries_retry", "status", "start_at"),
+    )
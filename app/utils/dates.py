@@ -1,5 +1,8 @@
 from __future__ import annotations
-from datetime import date, datetime
+from datetime import date, datetime, timezone
+from zoneinfo import ZoneInfo
+
+from app.config import settings
 
 _DAYS_RU_SHORT = {
     "Mon": "Пн",
@@ -20,4 +23,39 @@ def format_day_ru(d: date, with_count: int | None = None) -> str:
     return f"{base} ({with_count})" if with_count is not None else base
 
 def format_dt_ru(dt: datetime) -> str:
-    return f"{day_short_ru(dt)} {dt.strftime('%d.%m %H:%M')}"
\ No newline at end of file
+    """Время для показа — всегда в локальном поясе (settings.tz)"""
+    dt = to_local(dt)
+    return f"{day_short_ru(dt)} {dt.strftime('%d.%m %H:%M')}"
+
+# --- моменты времени ---
+# Времена занятий хранятся и сравниваются в UTC (aware); в локальное время
+# (settings.tz) переводятся только для показа и сетки слотов. Наивное
+# datetime на входе — это локальное время, выбранное пользователем.
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+def to_utc(dt: datetime) -> datetime:
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=ZoneInfo(settings.tz))
+    return dt.astimezone(timezone.utc)
+
+def to_local(dt: datetime) -> datetime:
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=ZoneInfo(settings.tz))
+    return dt.astimezone(ZoneInfo(settings.tz))
+
+def to_naive_local(dt: datetime) -> datetime:
+    """Локальное время без tzinfo — адресация сетки слотов и ключи исключений серий"""
+    return to_local(dt).replace(tzinfo=None)
+
+def hhmm_to_minutes(hhmm: str) -> int:
+    """"ЧЧ:ММ" → минуты от начала суток (0..1439); ValueError на кривой строке"""
+    hh, mm = hhmm.split(":")
+    minutes = int(hh) * 60 + int(mm)
+    if not 0 <= int(mm) < 60 or not 0 <= minutes < 24 * 60:
+        raise ValueError(f"bad time: {hhmm!r}")
+    return minutes
+
+def minutes_to_hhmm(minutes: int) -> str:
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator
+
+# Сколько последних замеров держим на метрику для перцентилей
+_SAMPLES = 1000
+
+
+class Metrics:
+    """Счётчики и замеры длительности в памяти процесса.
+
+    Без внешних зависимостей: /metrics у администратора показывает снимок.
+    Замеры хранятся в скользящем окне последних _SAMPLES значений.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters: Counter = Counter()
+        self._samples: Dict[str, Deque[float]] = {}
+        self._gauges: Dict[str, float] = {}
+
+    def incr(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += n
+
+    def set(self, name: str, value: float) -> None:
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name: str, value: float) -> None:
+        with self._lock:
+            self._samples.setdefault(name, deque(maxlen=_SAMPLES)).append(value)
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def counter(self, name: str) -> int:
+        with self._lock:
+            return self._counters[name]
+
+    def gauge(self, name: str, default: float = 0.0) -> float:
+        with self._lock:
+            return self._gauges.get(name, default)
+
+    def summary(self, name: str) -> Dict[str, float]:
+        with self._lock:
+            values = sorted(self._samples.get(name, ()))
+        if not values:
+            return {"count": 0}
+        return {
+            "count": len(values),
+            "p50": values[len(values) // 2],
+            "p99": values[min(len(values) - 1, int(len(values) * 0.99))],
+            "max": values[-1],
+        }
+
+    def render(self, prefix: str = "") -> str:
+        with self._lock:
+            counters = {k: v for k, v in self._counters.items() if k.startswith(prefix)}
+            gauges = {k: v for k, v in self._gauges.items() if k.startswith(prefix)}
+            timed = [k for k in self._samples if k.startswith(prefix)]
+
+        lines = [f"{k}: {v}" for k, v in sorted(counters.items())]
+        lines += [f"{k}: {v:g}" for k, v in sorted(gauges.items())]
+        for name in sorted(timed):
+            s = self.summary(name)
+            if s["count"]:
+                lines.append(
+                    f"{name}: n={s['count']} p50={s['p50'] * 1000:.0f}ms "
+                    f"p99={s['p99'] * 1000:.0f}ms max={s['max'] * 1000:.0f}ms"
+                )
+        return "\n".join(lines)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._samples.clear()
+            self._gauges.clear()
+
+
+metrics = Metrics()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк запроса занятых слотов: полная история против окна WINDOW_DAYS
+
+Создаёт временные SQLite-базы (пустую и со 100k прошедших занятий) и сравнивает
+старый запрос по всем бронированиям с оконным _occupied_grid. Отдельно
+сравнивает подсчёт свободных слотов по дням через set[datetime] и через
+битовую сетку для окон 14/90/365 дней.
+"""
+
+import asyncio
+import sys
+import tempfile
+import time
+from datetime import date, datetime, time as dtime, timedelta
+from pathlib import Path
+
+# Добавляем корневую директорию проекта в путь
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from sqlalchemy import insert, join, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app.services.slot_service import _occupied_grid
+from app.services.week_grid import WEEKDAY_HOURS, WEEKDAY_MINUTES, SlotGrid
+from app.storage.db import Base
+from app.storage.models import Booking, Slot, User
+
+HISTORY_SLOTS = 100_000
+FUTURE_SLOTS = 20
+REPEAT = 20
+
+
+async def _legacy_occupied(session) -> set:
+    """Запрос в прежнем виде — без ограничения по времени"""
+    j = join(Slot, Booking, Slot.id == Booking.slot_id)
+    res = await session.execute(select(Slot.start_at).select_from(j))
+    return set(res.scalars().all())
+
+
+async def _seed(engine, history: int) -> None:
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(insert(User), [{"tg_id": 1, "name": "bench"}])
+
+        now = datetime.now().replace(minute=0, second=0, microsecond=0)
+        starts = [now - timedelta(hours=2 * (i + 1)) for i in range(history)]
+        starts += [
+            datetime.combine(now.date() + timedelta(days=i + 1), dtime(hour=16)) for i in range(FUTURE_SLOTS)
+        ]
+
+        chunk = 5000
+        for i in range(0, len(starts), chunk):
+            part = starts[i:i + chunk]
+            await conn.execute(insert(Slot), [{"id": i + k + 1, "start_at": dt} for k, dt in enumerate(part)])
+            await conn.execute(
+                insert(Booking),
+                [
+                    {
+                        "user_id": 1,
+                        "slot_id": i + k + 1,
+                        "student_name": "bench",
+                        "student_contact": "bench@example.com",
+                        "lesson_type": "single",
+                    }
+                    for k in range(len(part))
+                ],
+            )
+
+
+async def _measure(session_factory, fn) -> tuple[float, int]:
+    async with session_factory() as session:
+        await fn(session)  # прогрев
+        started = time.perf_counter()
+        for _ in range(REPEAT):
+            result = await fn(session)
+        elapsed = (time.perf_counter() - started) / REPEAT
+    return elapsed * 1000, len(result)
+
+
+async def bench_case(title: str, history: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp}/bench.sqlite3")
+        await _seed(engine, history)
+        factory = async_sessionmaker(bind=engine, expire_on_commit=False)
+
+        today = datetime.now().date()
+
+        async def windowed(session):
+            return list((await _occupied_grid(session, today)).busy_times())
+
+        legacy_ms, legacy_rows = await _measure(factory, _legacy_occupied)
+        window_ms, window_rows = await _measure(factory, windowed)
+        await engine.dispose()
+
+    print(f"\n{title} ({history + FUTURE_SLOTS} слотов в БД)")
+    print(f"   Весь исторический набор: {legacy_ms:8.2f} мс  ({legacy_rows} строк)")
+    print(f"   Окно от {today:%d.%m}:           {window_ms:8.2f} мс  ({window_rows} занятых слотов)")
+
+
+def _legacy_counts(start: date, days: int, busy: set) -> dict:
+    """Прежний способ: список кандидатов и сравнение с множеством занятых"""
+    candidates = []
+    for i in range(days):
+        day = start + timedelta(days=i)
+        if day.weekday() < 5:
+            for h, m in zip(WEEKDAY_HOURS, WEEKDAY_MINUTES):
+                candidates.append(datetime.combine(day, dtime(hour=h, minute=m)))
+    counts: dict = {}
+    for dt in candidates:
+        if dt not in busy:
+            counts[dt.date()] = counts.get(dt.date(), 0) + 1
+    return counts
+
+
+def bench_grid() -> None:
+    print("\nСвободные слоты по дням (на один запрос)")
+    start = datetime.now().date()
+    for days in (14, 90, 365):
+        grid = SlotGrid(start, days)
+        busy = set()
+        for i in range(0, days, 2):
+            dt = datetime.combine(start + timedelta(days=i), dtime(hour=16))
+            grid.occupy(dt)
+            busy.add(dt)
+        # Интервальное занятие по средам в 17:45
+        for i in range(days):
+            day = start + timedelta(days=i)
+            if day.weekday() == 2:
+                grid.occupy_recurring(datetime.combine(day, dtime(hour=17, minute=45)))
+
+        n = 200
+        started = time.perf_counter()
+        for _ in range(n):
+            _legacy_counts(start, days, busy)
+        legacy_us = (time.perf_counter() - started) / n * 1e6
+
+        started = time.perf_counter()
+        for _ in range(n):
+            grid.free_counts()
+        grid_us = (time.perf_counter() - started) / n * 1e6
+        print(f"   {days:3d} дней: set[datetime] {legacy_us:8.1f} мкс, SlotGrid {grid_us:8.1f} мкс")
+
+
+async def main() -> None:
+    print("Бенчмарк _occupied_grid")
+    print("=" * 50)
+    await bench_case("Новая база", 0)
+    await bench_case("База с историей", HISTORY_SLOTS)
+    bench_grid()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк профиля SQLite: настройки по умолчанию против SQLITE_TUNED
+
+На временной базе одновременно работают писатели (BookingService.book_at,
+каждая запись на свой слот) и читатели (_occupied_grid — то, что делает
+перестройка индекса свободных слотов). Для каждого профиля печатает p50/p99
+задержки записи и чтения, пропускную способность и число ошибок
+«database is locked».
+
+    python scripts/bench_sqlite_profile.py [--writers 8] [--readers 8] [--ops 100] [--history 5000]
+"""
+
+import argparse
+import asyncio
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# Добавляем корневую директорию проекта в путь
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from sqlalchemy import insert, text
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app.config import settings
+from app.services.booking_service import BookingService
+from app.services.slot_service import _occupied_grid
+from app.storage.db import Base, build_engine
+from app.storage.models import Booking, Slot, User
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def _seed(engine, users: int, history: int) -> None:
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(insert(User), [{"id": i + 1, "tg_id": 1000 + i, "name": f"u{i}"} for i in range(users)])
+        if history:
+            now = datetime.now().replace(minute=0, second=0, microsecond=0)
+            await conn.execute(
+                insert(Slot), [{"id": i + 1, "start_at": now - timedelta(hours=2 * (i + 1))} for i in range(history)]
+            )
+            await conn.execute(
+                insert(Booking),
+                [
+                    {"user_id": 1, "slot_id": i + 1, "student_name": "bench", "student_contact": "—", "lesson_type": "single"}
+                    for i in range(history)
+                ],
+            )
+
+
+async def bench_profile(title: str, tuned: bool, args) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = build_engine(f"sqlite+aiosqlite:///{tmp}/bench.sqlite3", tuned=tuned)
+        await _seed(engine, args.writers, args.history)
+        factory = async_sessionmaker(bind=engine, expire_on_commit=False, autoflush=False)
+
+        writes: list[float] = []
+        reads: list[float] = []
+        errors: dict[str, int] = {}
+        base = datetime.now().replace(second=0, microsecond=0) + timedelta(days=1)
+        today = datetime.now().date()
+
+        async def writer(w: int) -> None:
+            for k in range(args.ops):
+                start_at = base + timedelta(minutes=w * args.ops + k)
+                started = time.perf_counter()
+                try:
+                    async with factory() as session:
+                        user = await session.get(User, w + 1)
+                        await BookingService.book_at(session, user, start_at, f"S{w}", "bench")
+                    writes.append(time.perf_counter() - started)
+                except Exception as e:
+                    errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+
+        async def reader() -> None:
+            for _ in range(args.ops):
+                started = time.perf_counter()
+                try:
+                    async with factory() as session:
+                        await _occupied_grid(session, today)
+                    reads.append(time.perf_counter() - started)
+                except Exception as e:
+                    errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(writer(w) for w in range(args.writers)), *(reader() for _ in range(args.readers)))
+        elapsed = time.perf_counter() - started
+
+        async with engine.connect() as conn:
+            mode = (await conn.execute(text("PRAGMA journal_mode"))).scalar()
+        await engine.dispose()
+
+    print(f"\n{title} (journal_mode={mode}, пул {type(engine.pool).__name__})")
+    print(f"   Запись:  p50={percentile(writes, 0.5) * 1000:7.1f}мс  p99={percentile(writes, 0.99) * 1000:7.1f}мс  ({len(writes)} успешно)")
+    print(f"   Чтение:  p50={percentile(reads, 0.5) * 1000:7.1f}мс  p99={percentile(reads, 0.99) * 1000:7.1f}мс  ({len(reads)} успешно)")
+    print(f"   Всего:   {(len(writes) + len(reads)) / elapsed:7.1f} оп/с за {elapsed:.1f}с")
+    print(f"   Ошибки:  {', '.join(f'{k}={v}' for k, v in errors.items()) or 'нет'}")
+    return {"writes": writes, "reads": reads, "errors": errors}
+
+
+async def main(args) -> None:
+    # Внешние интеграции в бенчмарке не участвуют
+    settings.google_calendar_enabled = False
+    settings.smtp_enabled = False
+    settings.reminders_enabled = False
+
+    print("Бенчмарк профиля SQLite")
+    print("=" * 50)
+    print(f"{args.writers} писателей и {args.readers} читателей по {args.ops} операций, {args.history} прошедших занятий в базе")
+    default = await bench_profile("По умолчанию", False, args)
+    tuned = await bench_profile("SQLITE_TUNED", True, args)
+
+    print("\nИтого (по умолчанию → профиль):")
+    for kind, label in (("writes", "запись"), ("reads", "чтение")):
+        print(
+            f"   {label}: p50 {percentile(default[kind], 0.5) * 1000:.1f} → {percentile(tuned[kind], 0.5) * 1000:.1f}мс, "
+            f"p99 {percentile(default[kind], 0.99) * 1000:.1f} → {percentile(tuned[kind], 0.99) * 1000:.1f}мс"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--ops", type=int, default=100)
+    parser.add_argument("--history", type=int, default=5000)
+    asyncio.run(main(parser.parse_args()))
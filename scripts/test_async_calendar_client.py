@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+"""
+Проверка AsyncCalendarClient на локальном стенде вместо Google Calendar API
+
+Поднимает aiohttp-сервер с минимальной реализацией events/freeBusy, направляет
+на него клиент (base_url + подставной token_provider) и проверяет CRUD, список,
+freebusy, повтор при 401, таймаут на вызов и переиспользование соединения,
+PATCH-обновления через фасад GoogleCalendar, а также outbox календаря на
+временной SQLite: повтор create после потерянного ответа не создаёт второе
+событие, а событие записи, удалённой во время create, удаляется.
+"""
+
+import asyncio
+from collections import Counter
+from datetime import datetime, timedelta
+
+from testkit import check, finish, reset_schema, use_test_db
+
+use_test_db("calendar")
+
+from aiohttp import web
+from sqlalchemy import select, update
+
+from app.config import settings
+from app.integrations import gcal_client
+from app.integrations.gcal_client import AsyncCalendarClient, CalendarApiError
+from app.integrations.google_calendar import GoogleCalendar
+from app.services.booking_service import BookingService
+from app.services.calendar_outbox import CalendarOutboxService
+from app.services.google_calendar_service import GoogleCalendarService
+from app.storage.db import SessionLocal, engine
+from app.storage.models import Booking, CalendarOutbox, Slot, User
+from app.utils.metrics import metrics
+
+
+class FakeCalendar:
+    """Стенд Calendar API v3: события в памяти, счётчики вызовов и соединений"""
+
+    def __init__(self) -> None:
+        self.events: dict[str, dict] = {}
+        self.calls: Counter = Counter()
+        self.connections: set[int] = set()
+        self.delay = 0.0
+        self.reject_next_401 = False
+        # Создать событие, но ответить 500 — как потерянный ответ
+        self.lose_next_insert = False
+        self._next_id = 1
+
+    def app(self) -> web.Application:
+        app = web.Application(middlewares=[self._middleware])
+        base = "/calendar/v3/calendars/{cal}/events"
+        app.router.add_post(base, self.insert)
+        app.router.add_get(base, self.list)
+        app.router.add_get(base + "/{id}", self.get)
+        app.router.add_put(base + "/{id}", self.put)
+        app.router.add_patch(base + "/{id}", self.patch)
+        app.router.add_delete(base + "/{id}", self.delete)
+        app.router.add_post("/calendar/v3/freeBusy", self.freebusy)
+        return app
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler):
+        self.connections.add(id(request.transport))
+        if request.headers.get("Authorization", "") not in ("Bearer token-1", "Bearer token-2"):
+            return web.json_response({"error": {"code": 401}}, status=401)
+        if self.reject_next_401:
+            self.reject_next_401 = False
+            return web.json_response({"error": {"code": 401, "message": "expired"}}, status=401)
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.calls[request.method] += 1
+        return await handler(request)
+
+    def _event(self, request: web.Request) -> dict:
+        ev = self.events.get(request.match_info["id"])
+        if ev is None:
+            raise web.HTTPNotFound(text='{"error": {"code": 404}}', content_type="application/json")
+        return ev
+
+    async def insert(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        ev_id = body.get("id")
+        if ev_id in self.events:
+            return web.json_response({"error": {"code": 409, "message": "The requested identifier already exists."}}, status=409)
+        if not ev_id:
+            ev_id = f"ev{self._next_id}"
+            self._next_id += 1
+        self.events[ev_id] = {**body, "id": ev_id, "htmlLink": f"https://calendar.test/{ev_id}"}
+        if self.lose_next_insert:
+            self.lose_next_insert = False
+            return web.json_response({"error": {"code": 500}}, status=500)
+        return web.json_response(self.events[ev_id])
+
+    async def get(self, request: web.Request) -> web.Response:
+        return web.json_response(self._event(request))
+
+    async def put(self, request: web.Request) -> web.Response:
+        ev = self._event(request)
+        self.events[ev["id"]] = {**(await request.json()), "id": ev["id"]}
+        return web.json_response(self.events[ev["id"]])
+
+    async def patch(self, request: web.Request) -> web.Response:
+        ev = self._event(request)
+        ev.update(await request.json())
+        return web.json_response(ev)
+
+    async def delete(self, request: web.Request) -> web.Response:
+        self._event(request)
+        del self.events[request.match_info["id"]]
+        return web.Response(status=204)
+
+    async def list(self, request: web.Request) -> web.Response:
+        items = sorted(self.events.values(), key=lambda e: e["start"]["dateTime"])
+        return web.json_response({"items": items})
+
+    async def freebusy(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        busy = [{"start": e["start"]["dateTime"], "end": e["end"]["dateTime"]} for e in self.events.values()]
+        return web.json_response({"calendars": {i["id"]: {"busy": busy} for i in body["items"]}})
+
+
+class FakeTokens:
+    """Подставной token_provider: после принудительного обновления выдаёт новый токен"""
+
+    def __init__(self) -> None:
+        self.refreshes = 0
+
+    async def __call__(self, force_refresh: bool = False) -> str:
+        if force_refresh:
+            self.refreshes += 1
+        return f"token-{1 + min(self.refreshes, 1)}"
+
+
+async def check_patch_updates(fake: FakeCalendar, client: AsyncCalendarClient, start_at: datetime) -> list:
+    """Перенос и смена имени через фасад — по одному PATCH, пересоздание только при 404"""
+    settings.google_calendar_enabled = True
+    gcal_client._client = client
+    results = []
+
+    fake.calls.clear()
+    calls_before = metrics.counter("gcal.calls")
+    ev_id = await GoogleCalendar.upsert_event(7, start_at, "Иван", "ivan@example.com")
+    results.append(check(
+        "создание: один POST без попутного events.list",
+        dict(fake.calls) == {"POST": 1} and metrics.counter("gcal.calls") - calls_before == 1,
+    ))
+
+    fake.calls.clear()
+    new_start = start_at + timedelta(days=1)
+    same_id = await GoogleCalendar.patch_event(ev_id, new_start, "Иван", "ivan@example.com", 7, fields=("time",))
+    ev = fake.events[ev_id]
+    results.append(check(
+        "перенос: один PATCH start/end без пересоздания",
+        same_id == ev_id and dict(fake.calls) == {"PATCH": 1}
+        and ev["start"]["dateTime"].startswith(new_start.isoformat()) and ev["summary"] == "Занятие: Иван",
+    ))
+
+    fake.calls.clear()
+    await GoogleCalendar.patch_event(ev_id, new_start, "Пётр", "petr@example.com", 7, fields=("content",))
+    ev = fake.events[ev_id]
+    results.append(check(
+        "смена ученика: один PATCH summary/description/attendees",
+        dict(fake.calls) == {"PATCH": 1} and ev["summary"] == "Занятие: Пётр"
+        and ev["attendees"] == [{"email": "petr@example.com"}],
+    ))
+
+    del fake.events[ev_id]
+    fake.calls.clear()
+    recreated = await GoogleCalendar.patch_event(ev_id, new_start, "Пётр", "petr@example.com", 7)
+    results.append(check(
+        "событие удалено в календаре → пересоздание",
+        recreated not in (None, ev_id) and dict(fake.calls) == {"PATCH": 1, "POST": 1},
+    ))
+    return results
+
+
+async def check_outbox(fake: FakeCalendar, client: AsyncCalendarClient, start_at: datetime) -> list:
+    """Операции outbox календаря против стенда: идемпотентный create и удаление записи во время create"""
+    settings.google_calendar_enabled = True
+    settings.smtp_enabled = False
+    settings.reminders_enabled = False
+    gcal_client._client = client
+    await reset_schema()
+
+    async def booking(minutes: int) -> int:
+        async with SessionLocal() as session:
+            user = User(tg_id=minutes, name=f"u{minutes}")
+            slot = Slot(start_at=start_at + timedelta(minutes=minutes))
+            session.add_all([user, slot])
+            await session.flush()
+            row = Booking(user_id=user.id, slot_id=slot.id, student_name=f"S{minutes}", student_contact="—")
+            session.add(row)
+            await session.flush()
+            CalendarOutboxService.enqueue_create(session, row.id)
+            await session.commit()
+            return row.id
+
+    async def drain() -> None:
+        # Повторы не ждут паузы: строки с ошибкой сразу готовы к выполнению
+        for _ in range(5):
+            async with SessionLocal() as session:
+                await session.execute(update(CalendarOutbox).values(next_attempt_at=datetime.now() - timedelta(days=1)))
+                await session.commit()
+            await CalendarOutboxService.drain()
+            async with SessionLocal() as session:
+                if not await session.scalar(select(CalendarOutbox.id).where(CalendarOutbox.status == "pending").limit(1)):
+                    return
+
+    def events_of(booking_id: int) -> list[str]:
+        return [ev_id for ev_id, ev in fake.events.items() if f"Booking #{booking_id}" in ev.get("description", "")]
+
+    # Событие создано, но ответ потерян: повтор под тем же id получает 409
+    lost = await booking(1)
+    fake.lose_next_insert = True
+    await drain()
+    async with SessionLocal() as session:
+        event_id = await session.scalar(select(Booking.gcal_event_id).where(Booking.id == lost))
+    created = events_of(lost)
+
+    # Запись отменяют, пока create ждёт ответа
+    cancelled = await booking(2)
+    upsert = GoogleCalendar.upsert_event
+
+    async def racing_upsert(*args, **kwargs):
+        ev_id = await upsert(*args, **kwargs)
+        async with SessionLocal() as session:
+            await BookingService.admin_cancel(session, cancelled)
+        return ev_id
+
+    GoogleCalendar.upsert_event = staticmethod(racing_upsert)
+    try:
+        await drain()
+    finally:
+        GoogleCalendar.upsert_event = staticmethod(upsert)
+    await drain()
+    async with SessionLocal() as session:
+        statuses = set((await session.scalars(select(CalendarOutbox.status))).all())
+    return [
+        check(f"create после потерянного ответа: одно событие ({len(created)})", len(created) == 1),
+        check("id события записан в запись", created == [event_id]),
+        check("событие записи, удалённой во время create, удалено", events_of(cancelled) == []),
+        check(f"очередь outbox разобрана ({statuses})", statuses == {"done"}),
+    ]
+
+
+async def run() -> bool:
+    fake = FakeCalendar()
+    runner = web.AppRunner(fake.app())
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    tokens = FakeTokens()
+    client = AsyncCalendarClient(
+        base_url=f"http://127.0.0.1:{port}/calendar/v3",
+        token_provider=tokens,
+        calendar_id="tutor@example.com",
+        timeout=1.0,
+    )
+    results = []
+    try:
+        start_at = (datetime.now() + timedelta(days=1)).replace(hour=16, minute=0, second=0, microsecond=0)
+        body = GoogleCalendarService._create_body(1, start_at, "Иван", "ivan@example.com")
+
+        ev = await client.insert_event(body, conferenceDataVersion=1)
+        results.append(check("insert возвращает id", bool(ev.get("id"))))
+        ev_id = ev["id"]
+
+        got = await client.get_event(ev_id)
+        results.append(check("get возвращает событие", got["summary"] == body["summary"]))
+
+        await client.patch_event(ev_id, {"summary": "Занятие: Пётр"})
+        results.append(check("patch меняет поле", fake.events[ev_id]["summary"] == "Занятие: Пётр"))
+
+        await client.update_event(ev_id, {**body, "summary": "Занятие: Анна"})
+        results.append(check("update заменяет событие", fake.events[ev_id]["summary"] == "Занятие: Анна"))
+
+        listed = await client.list_events(start_at - timedelta(days=1), start_at + timedelta(days=1))
+        results.append(check("list находит событие", [e["id"] for e in listed["items"]] == [ev_id]))
+
+        fb = await client.freebusy(start_at - timedelta(days=1), start_at + timedelta(days=1))
+        busy = fb["calendars"]["tutor@example.com"]["busy"]
+        results.append(check("freebusy отдаёт занятость", len(busy) == 1))
+
+        fake.reject_next_401 = True
+        await client.get_event(ev_id)
+        results.append(check("401 → обновление токена и повтор", tokens.refreshes == 1))
+
+        await client.delete_event(ev_id)
+        try:
+            await client.get_event(ev_id)
+            results.append(check("get после delete → 404", False))
+        except CalendarApiError as e:
+            results.append(check("get после delete → 404", e.status == 404))
+
+        fake.delay = 0.5
+        try:
+            await client._request("GET", client._events_url(), timeout=0.1)
+            results.append(check("таймаут на вызов", False))
+        except asyncio.TimeoutError:
+            results.append(check("таймаут на вызов", True))
+        fake.delay = 0.0
+
+        # Соединение, оборванное таймаутом, закрыто — первый вызов открывает новое
+        await client.list_events(start_at, start_at + timedelta(days=1))
+        before = len(fake.connections)
+        for _ in range(20):
+            await client.list_events(start_at, start_at + timedelta(days=1))
+        results.append(check("keep-alive: 20 вызовов без новых соединений", len(fake.connections) == before))
+
+        print(f"   Вызовов по методам: {dict(fake.calls)}; соединений: {len(fake.connections)}")
+
+        results.extend(await check_patch_updates(fake, client, start_at))
+        results.extend(await check_outbox(fake, client, start_at))
+    finally:
+        await client.close()
+        await runner.cleanup()
+        await engine.dispose()
+
+    return all(results)
+
+
+if __name__ == "__main__":
+    print("Проверка AsyncCalendarClient на локальном стенде")
+    print("=" * 50)
+    finish(asyncio.run(run()))
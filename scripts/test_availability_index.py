@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Проверка инкрементального индекса свободных слотов
+
+Выполняет записи, переносы и отмены разовых занятий, создание, пропуск,
+перенос и отмену серий — по сценарию и затем в случайном порядке — и
+после каждого изменения сравнивает индекс (availability_index) со
+свежей перестройкой из БД. Для изменений, которые индекс должен отразить
+сам, дополнительно проверяется, что он не ушёл в полную перестройку.
+
+    python scripts/test_availability_index.py [seed] [--ops 200]
+"""
+
+import asyncio
+import random
+import sys
+from datetime import date, datetime, timedelta
+
+from testkit import check, finish, reset_schema, use_test_db
+
+use_test_db("availability")
+
+from sqlalchemy import select
+
+from app.config import settings
+from app.services.availability_index import availability_index
+from app.services.booking_service import BookingService
+from app.services.recurrence_service import RecurrenceService
+from app.services.slot_service import WINDOW_DAYS, _occupied_grid
+from app.services.week_grid import SLOT_TIMES
+from app.storage.db import SessionLocal, engine
+from app.storage.models import Booking, Occurrence, User
+from app.utils.dates import to_naive_local, utcnow
+
+USERS = 5
+
+
+def candidates() -> list[datetime]:
+    """Будущие рабочие слоты окна индекса — в локальном времени"""
+    now = to_naive_local(utcnow())
+    result = []
+    for d in range(WINDOW_DAYS):
+        day = now.date() + timedelta(days=d)
+        if day.weekday() < 5:
+            result.extend(at for at in (datetime.combine(day, t) for t in SLOT_TIMES) if at > now)
+    return result
+
+
+async def matches(title: str, incremental: bool = True) -> bool:
+    """Индекс совпадает со свежей перестройкой; incremental — без перестройки"""
+    kept = not availability_index.is_stale
+    async with SessionLocal() as session:
+        await availability_index.ensure(session)
+        grid = availability_index._grid
+        fresh = await _occupied_grid(session, grid.start, grid.days)
+    ok = (grid.busy, grid.weekly) == (fresh.busy, fresh.weekly)
+    if incremental:
+        ok = ok and kept
+    return check(title, ok) if title else ok
+
+
+async def book(uid: int, at: datetime):
+    async with SessionLocal() as session:
+        user = await session.get(User, uid)
+        return await BookingService.book_at(session, user, at, f"S{uid}", "—")
+
+
+async def book_series(uid: int, weekday: int, hhmm: str):
+    async with SessionLocal() as session:
+        user = await session.get(User, uid)
+        return await BookingService.book_interval(session, user, weekday, hhmm, f"W{uid}", "—")
+
+
+async def cancel(booking_id: int) -> bool:
+    async with SessionLocal() as session:
+        return await BookingService.admin_cancel(session, booking_id)
+
+
+async def reschedule(booking_id: int, at: datetime) -> bool:
+    async with SessionLocal() as session:
+        return await BookingService.reschedule_to(session, booking_id, at)
+
+
+async def skip(booking_id: int, on: date) -> bool:
+    async with SessionLocal() as session:
+        return await RecurrenceService.skip(session, booking_id, on)
+
+
+async def move(booking_id: int, on: date, at: datetime) -> bool:
+    async with SessionLocal() as session:
+        return await RecurrenceService.move(session, booking_id, on, at)
+
+
+async def bookings(lesson_type: str) -> list[int]:
+    async with SessionLocal() as session:
+        return list((await session.scalars(select(Booking.id).where(Booking.lesson_type == lesson_type))).all())
+
+
+async def occurrence_days(booking_id: int) -> list[date]:
+    """Локальные дни занятий серии по правилу (а не по перенесённому времени)"""
+    async with SessionLocal() as session:
+        starts = (
+            await session.scalars(select(Occurrence.original_start_at).where(Occurrence.booking_id == booking_id))
+        ).all()
+    return sorted(to_naive_local(at).date() for at in starts)
+
+
+async def check_scenario(slots: list[datetime]) -> list:
+    results = []
+
+    first = await book(1, slots[0])
+    second = await book(2, slots[1])
+    results.append(await matches("запись на два слота"))
+    results.append(check("повторная запись на занятый слот отклонена", await book(3, slots[0]) is None))
+    results.append(await matches("после отклонённой записи"))
+
+    results.append(check("перенос записи", await reschedule(first.id, slots[2])))
+    results.append(await matches("перенос разовой записи"))
+    results.append(check("перенос на занятый слот отклонён", not await reschedule(second.id, slots[2])))
+    results.append(await matches("после отклонённого переноса"))
+
+    results.append(check("отмена записи", await cancel(second.id)))
+    results.append(await matches("отмена разовой записи"))
+
+    # Серия на день и время свободного слота окна
+    target = next(at for at in slots[3:] if at.weekday() < 5)
+    series = await book_series(3, target.weekday(), f"{target:%H:%M}")
+    results.append(check("серия создана", series is not None))
+    results.append(await matches("создание серии"))
+
+    days = await occurrence_days(series.id)
+    results.append(check("пропуск недели", await skip(series.id, days[0])))
+    results.append(await matches("пропуск недели серии"))
+
+    free = next(at for at in slots if at.time() != target.time() and at > target)
+    results.append(check("перенос занятия серии", await move(series.id, days[1], free)))
+    results.append(await matches("перенос занятия серии"))
+
+    # Время занято серией: запись отклоняется, индекс помечается устаревшим
+    results.append(check("запись на занятие серии отклонена", await book(4, free) is None))
+    results.append(await matches("после отклонённой записи на занятие серии", incremental=False))
+    results.append(check("перенос на занятие серии отклонён", not await reschedule(first.id, free)))
+    results.append(await matches("после отклонённого переноса на занятие серии", incremental=False))
+
+    await RecurrenceService.materialize()
+    results.append(await matches("раскладка серий", incremental=False))
+
+    results.append(check("отмена серии", await cancel(series.id)))
+    results.append(await matches("отмена серии"))
+    return results
+
+
+async def check_random(rng: random.Random, slots: list[datetime], ops: int) -> list:
+    """Случайные изменения; индекс сверяется с перестройкой после каждого"""
+    mismatches = []
+    for i in range(ops):
+        op = rng.choice(("book", "book", "cancel", "reschedule", "series", "skip", "move", "cancel_series"))
+        singles = await bookings("single")
+        intervals = await bookings("interval")
+        if op == "book":
+            await book(rng.randint(1, USERS), rng.choice(slots))
+        elif op == "cancel" and singles:
+            await cancel(rng.choice(singles))
+        elif op == "reschedule" and singles:
+            await reschedule(rng.choice(singles), rng.choice(slots))
+        elif op == "series":
+            at = rng.choice(slots)
+            await book_series(rng.randint(1, USERS), at.weekday(), f"{at:%H:%M}")
+        elif op in ("skip", "move") and intervals:
+            booking_id = rng.choice(intervals)
+            days = await occurrence_days(booking_id)
+            if days:
+                if op == "skip":
+                    await skip(booking_id, rng.choice(days))
+                else:
+                    await move(booking_id, rng.choice(days), rng.choice(slots))
+        elif op == "cancel_series" and intervals:
+            await cancel(rng.choice(intervals))
+        if not await matches("", incremental=False):
+            mismatches.append(f"#{i} {op}")
+            # Дальше сравниваем с чистого листа, чтобы не тянуть одно расхождение
+            availability_index.invalidate("test: mismatch")
+    return [
+        check(
+            f"{ops} случайных изменений: индекс = перестройка" + (f" (расхождения: {mismatches[:5]})" if mismatches else ""),
+            not mismatches,
+        )
+    ]
+
+
+async def run(seed: int, ops: int) -> bool:
+    settings.google_calendar_enabled = False
+    settings.smtp_enabled = False
+    settings.reminders_enabled = False
+    # Перестройка только по invalidate, не по возрасту
+    settings.availability_rebuild_minutes = 0
+    print(f"seed={seed}, база: {engine.dialect.name}")
+
+    await reset_schema()
+    async with SessionLocal() as session:
+        session.add_all(User(tg_id=1000 + i, name=f"u{i}") for i in range(1, USERS + 1))
+        await session.commit()
+    availability_index.invalidate("test start")
+    async with SessionLocal() as session:
+        await availability_index.ensure(session)
+
+    slots = candidates()
+    try:
+        results = await check_scenario(slots) + await check_random(random.Random(seed), slots, ops)
+    finally:
+        await engine.dispose()
+    return all(results)
+
+
+if __name__ == "__main__":
+    print("Проверка индекса свободных слотов")
+    print("=" * 50)
+    ops = int(sys.argv[sys.argv.index("--ops") + 1]) if "--ops" in sys.argv else 200
+    seed = int(sys.argv[1]) if len(sys.argv) > 1 and sys.argv[1].isdigit() else 1
+    finish(asyncio.run(run(seed, ops)))
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Проверка атомарной записи: 200 одновременных попыток занять один слот
+
+Запускает BookingService.book_at параллельно из 200 сессий на временной БД
+(или на DB_URL, если он передан) и проверяет, что победил ровно один ученик.
+Затем RESCHEDULES записей одновременно переносятся на одно время —
+перенос тоже должен достаться ровно одной, без исключений.
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+from testkit import check, finish, use_test_db
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app.config import settings
+from app.services.booking_service import BookingService
+from app.storage.db import Base
+from app.storage.models import Booking, Slot, User
+
+ATTEMPTS = 200
+RESCHEDULES = 20
+
+
+async def run(db_url: str) -> bool:
+    # Внешние интеграции в проверке не участвуют
+    settings.google_calendar_enabled = False
+    settings.smtp_enabled = False
+    settings.reminders_enabled = False
+
+    # 200 писателей одновременно — стандартных 5 секунд ожидания блокировки
+    # SQLite для такой очереди не хватает
+    connect_args = {"timeout": 60} if db_url.startswith("sqlite") else {}
+    engine = create_async_engine(db_url, connect_args=connect_args)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    factory = async_sessionmaker(bind=engine, expire_on_commit=False, autoflush=False)
+
+    async with factory() as session:
+        users = [User(tg_id=100_000 + i, name=f"Ученик {i}") for i in range(ATTEMPTS)]
+        session.add_all(users)
+        await session.commit()
+
+    start_at = (datetime.now() + timedelta(days=3)).replace(hour=16, minute=0, second=0, microsecond=0)
+
+    async def attempt(user: User):
+        async with factory() as session:
+            return await BookingService.book_at(session, user, start_at, user.name, "student@example.com")
+
+    results = await asyncio.gather(*(attempt(u) for u in users), return_exceptions=True)
+
+    errors = [r for r in results if isinstance(r, BaseException)]
+    winners = [r for r in results if isinstance(r, Booking)]
+
+    async with factory() as session:
+        bookings = await session.scalar(select(func.count(Booking.id)))
+        slots = await session.scalar(select(func.count(Slot.id)))
+
+    print(f"Попыток: {ATTEMPTS}")
+    print(f"   Успешных записей: {len(winners)}")
+    print(f"   «Слот занят»:     {sum(1 for r in results if r is None)}")
+    print(f"   Исключений:       {len(errors)}")
+    print(f"   В БД: bookings={bookings}, slots={slots}")
+    for e in errors[:3]:
+        print(f"   {type(e).__name__}: {e}")
+
+    booked_ok = check(
+        "ровно одна запись на слот", len(winners) == 1 and not errors and bookings == 1 and slots == 1
+    )
+    moved_ok = await reschedule_race(factory, users[:RESCHEDULES], start_at)
+    await engine.dispose()
+    return booked_ok and moved_ok
+
+
+async def reschedule_race(factory, users: list[User], start_at: datetime) -> bool:
+    """Записи на разные часы одновременно переносятся на один и тот же час"""
+    booking_ids = []
+    for i, user in enumerate(users, start=1):
+        async with factory() as session:
+            booked = await BookingService.book_at(session, user, start_at + timedelta(hours=i), user.name, "—")
+            booking_ids.append(booked.id)
+    target = start_at - timedelta(hours=1)
+
+    async def attempt(booking_id: int):
+        async with factory() as session:
+            return await BookingService.reschedule_to(session, booking_id, target)
+
+    results = await asyncio.gather(*(attempt(b) for b in booking_ids), return_exceptions=True)
+    errors = [r for r in results if isinstance(r, BaseException)]
+    async with factory() as session:
+        on_target = await session.scalar(
+            select(func.count(Booking.id)).join(Slot, Slot.id == Booking.slot_id).where(Slot.start_at == target)
+        )
+
+    print(f"Одновременных переносов на одно время: {len(booking_ids)}")
+    print(f"   Успешных: {sum(1 for r in results if r is True)}")
+    print(f"   Исключений: {len(errors)}")
+    print(f"   Записей на новом времени: {on_target}")
+    for e in errors[:3]:
+        print(f"   {type(e).__name__}: {e}")
+    return check("перенос достался ровно одной записи", results.count(True) == 1 and not errors and on_target == 1)
+
+
+if __name__ == "__main__":
+    print("Проверка одновременной записи на один слот")
+    print("=" * 50)
+    finish(asyncio.run(run(use_test_db("concurrent"))))
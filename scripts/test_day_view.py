@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Проверка SlotService.day_view — данных экрана выбора времени
+
+- для каждого дня окна свободные времена, занятые сериями времена и
+  счётчики по дням совпадают с available_times_for_day/available_days и с
+  расчётом прямо по таблицам; уже начавшиеся слоты и дни вне окна пусты;
+- свежий индекс отвечает без запросов к БД, устаревший перестраивается
+  одним запросом;
+- хендлеры выбора дня (запись и перенос админом) строят клавиатуру из
+  свободных времён day_view.
+"""
+
+import asyncio
+from datetime import date, datetime, time, timedelta
+
+from testkit import check, finish, reset_schema, use_test_db
+
+use_test_db("dayview")
+
+from sqlalchemy import event, join, select
+
+from app.bot.handlers.booking import pick_day
+from app.bot.handlers.manage import a_edit_day_pick
+from app.config import settings
+from app.services.availability_index import availability_index
+from app.services.booking_service import BookingService
+from app.services.slot_service import WINDOW_DAYS, SlotService
+from app.services.week_grid import SLOT_TIMES
+from app.storage.db import SessionLocal, engine
+from app.storage.models import Booking, Occurrence, Slot, User
+from app.utils.dates import to_naive_local, utcnow
+
+
+class FakeMessage:
+    def __init__(self) -> None:
+        self.answers: list[tuple[str, object]] = []
+
+    async def answer(self, text: str, reply_markup=None, **kwargs):
+        self.answers.append((text, reply_markup))
+
+
+class FakeCallback:
+    """Минимум CallbackQuery, который читают хендлеры выбора дня"""
+
+    def __init__(self, data: str) -> None:
+        self.data = data
+        self.message = FakeMessage()
+
+    async def answer(self, *args, **kwargs):
+        return True
+
+
+def buttons(markup) -> list[str]:
+    return [button.text for row in markup.inline_keyboard for button in row]
+
+
+async def busy_from_tables() -> tuple[set[datetime], set[datetime]]:
+    """Занятые времена прямо из таблиц: разовые записи и занятия серий (локальное время)"""
+    async with SessionLocal() as session:
+        j = join(Slot, Booking, Slot.id == Booking.slot_id)
+        singles = (await session.scalars(select(Slot.start_at).select_from(j))).all()
+        recurring = (await session.scalars(select(Occurrence.start_at))).all()
+    return {to_naive_local(at) for at in singles}, {to_naive_local(at) for at in recurring}
+
+
+async def seed(day: date) -> None:
+    async with SessionLocal() as session:
+        users = [User(tg_id=200 + i, name=f"u{i}") for i in range(3)]
+        session.add_all(users)
+        await session.commit()
+    async with SessionLocal() as session:
+        await BookingService.book_at(session, users[0], datetime.combine(day, SLOT_TIMES[0]), "S", "—")
+    async with SessionLocal() as session:
+        await BookingService.book_interval(
+            session, users[1], day.weekday(), SLOT_TIMES[2].strftime("%H:%M"), "W", "—"
+        )
+    # Запись на следующий день не должна влиять на day
+    async with SessionLocal() as session:
+        await BookingService.book_at(
+            session, users[2], datetime.combine(day + timedelta(days=1), SLOT_TIMES[1]), "S2", "—"
+        )
+
+
+async def check_views(now: datetime) -> list:
+    singles, recurring = await busy_from_tables()
+    # Окно индекса — от сегодняшнего дня, а не от now
+    today = to_naive_local(utcnow()).date()
+    mismatched = []
+    async with SessionLocal() as session:
+        counts = await SlotService.available_days(session, now=now)
+        for i in range(-1, WINDOW_DAYS + 1):
+            day = today + timedelta(days=i)
+            view = await SlotService.day_view(session, day, now=now)
+            times = await SlotService.available_times_for_day(session, day, now=now)
+            in_window = 0 <= i < WINDOW_DAYS
+            candidates = [datetime.combine(day, t) for t in SLOT_TIMES] if day.weekday() < 5 and in_window else []
+            expected_free = [at for at in candidates if at >= now and at not in singles | recurring]
+            expected_interval = sorted(at for at in recurring if at.date() == day) if in_window else []
+            if (
+                view.day != day
+                or view.free != times
+                or view.free != expected_free
+                or view.busy_interval != expected_interval
+                or view.counts != counts
+            ):
+                mismatched.append(day.isoformat())
+    return [
+        check(
+            f"сейчас {now:%d.%m %H:%M}: day_view на {WINDOW_DAYS + 2} днях совпадает с отдельными вызовами и таблицами"
+            + (f" (расхождения: {mismatched})" if mismatched else ""),
+            not mismatched,
+        )
+    ]
+
+
+async def check_queries(day: date) -> list:
+    statements: list[str] = []
+
+    def capture(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", capture)
+    try:
+        async with SessionLocal() as session:
+            await SlotService.day_view(session, day)
+            fresh = len(statements)
+            availability_index.invalidate("test: stale index")
+            await SlotService.day_view(session, day)
+            stale = len(statements) - fresh
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", capture)
+    return [
+        check(f"свежий индекс: запросов к БД {fresh}", fresh == 0),
+        check(f"устаревший индекс: перестройка за {stale} запрос(а)", stale == 1),
+    ]
+
+
+async def check_handlers(day: date) -> list:
+    async with SessionLocal() as session:
+        view = await SlotService.day_view(session, day)
+    expected = [at.strftime("%H:%M") for at in view.free]
+
+    cb = FakeCallback(f"day:{day.isoformat()}")
+    await pick_day(cb)
+    admin = FakeCallback(f"ed:day:7:{day.isoformat()}")
+    await a_edit_day_pick(admin)
+    (_, markup), = cb.message.answers
+    (_, admin_markup), = admin.message.answers
+    return [
+        check(f"выбор дня: кнопки {buttons(markup)}", buttons(markup) == expected and bool(expected)),
+        check("перенос админом: те же времена", buttons(admin_markup) == expected),
+        check(
+            "перенос админом: callback несёт id записи",
+            all(b.callback_data.startswith("ed:time:7:") for row in admin_markup.inline_keyboard for b in row),
+        ),
+    ]
+
+
+async def run() -> bool:
+    settings.google_calendar_enabled = False
+    settings.smtp_enabled = False
+    settings.reminders_enabled = False
+    settings.availability_rebuild_minutes = 0
+    print(f"База: {engine.dialect.name}")
+    await reset_schema()
+    availability_index.invalidate("test start")
+
+    today = to_naive_local(utcnow()).date()
+    day = next(today + timedelta(days=i) for i in range(1, 8) if (today + timedelta(days=i)).weekday() < 4)
+    await seed(day)
+    try:
+        results = []
+        # «Сейчас» в разные моменты дня day, в том числе ровно на начале слота
+        for moment in (time(0, 0), SLOT_TIMES[0], time(17, 0), time(23, 0)):
+            results += await check_views(datetime.combine(day, moment))
+        results += await check_queries(day)
+        results += await check_handlers(day)
+    finally:
+        await engine.dispose()
+    return all(results)
+
+
+if __name__ == "__main__":
+    print("Проверка SlotService.day_view")
+    print("=" * 50)
+    finish(asyncio.run(run()))
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Регрессионная проверка планов частых запросов
+
+На наполненных таблицах выполняет сервисные функции горячих путей (мои
+записи, выбор времени, бронирование интервального занятия, индекс
+свободных слотов, диспетчер напоминаний, outbox-воркеры), перехватывает
+каждый их SELECT и снимает план. Проверка падает, если какой-то запрос
+читает таблицу целиком — значит, под него нет подходящего индекса.
+
+    python scripts/test_query_plans.py [-v]
+
+Без DB_URL работает на временной SQLite (EXPLAIN QUERY PLAN, «SCAN
+<таблица>»). На PostgreSQL план снимается EXPLAIN при enable_seqscan=off:
+планировщик берёт индекс всегда, когда он подходит, и «Seq Scan on
+<таблица>» остаётся только там, где подходящего индекса нет.
+"""
+
+import asyncio
+import re
+import sys
+from datetime import datetime, timedelta
+
+from testkit import check, finish, reset_schema, sync_sequences, use_test_db
+
+use_test_db("plans")
+
+from sqlalchemy import event, insert
+
+from app.bot.handlers.booking import _busy_weekly_hhmm_for_day
+from app.bot.handlers.weekly_ui import _busy_times_for_weekday
+from app.config import settings
+from app.services.booking_service import BookingService
+from app.services.calendar_outbox import CalendarOutboxService
+from app.services.email_outbox import EmailOutboxService
+from app.services.recurrence_service import RecurrenceService
+from app.services.reminder_service import ReminderService
+from app.services.slot_service import _occupied_grid
+from app.storage.db import SessionLocal, engine
+from app.storage.models import (
+    Booking, CalendarOutbox, EmailOutbox, ReminderDelivery, Slot, User, WeeklySubscription,
+)
+from app.utils.dates import minutes_to_hhmm
+
+USERS = 200
+HISTORY = 5000
+TIMES = (15 * 60, 17 * 60, 19 * 60)
+
+# Таблицы, которые читаются целиком намеренно:
+# materialize обходит все действующие серии
+EXPECTED_SCANS = {"recurrences"}
+
+# SQLite: SCAN — полный просмотр таблицы или всего индекса, поиск по индексу — SEARCH;
+# PostgreSQL: Seq Scan
+_FULL_SCAN = re.compile(r"^SCAN (\w+)|Seq Scan on (\w+)")
+
+
+async def seed() -> None:
+    now = datetime.now().replace(minute=0, second=0, microsecond=0)
+    await reset_schema()
+    async with engine.begin() as conn:
+        await conn.execute(insert(User), [{"id": i + 1, "tg_id": 1000 + i, "name": f"u{i}"} for i in range(USERS)])
+        await conn.execute(
+            insert(Slot), [{"id": i + 1, "start_at": now - timedelta(hours=2 * (i + 1))} for i in range(HISTORY)]
+        )
+        await conn.execute(
+            insert(Booking),
+            [
+                {
+                    "user_id": i % USERS + 1, "slot_id": i + 1, "student_name": "S", "student_contact": "—",
+                    "lesson_type": "single", "next_remind_at": None,
+                }
+                for i in range(HISTORY)
+            ],
+        )
+        await conn.execute(
+            insert(WeeklySubscription),
+            [
+                {
+                    "user_id": i % USERS + 1, "student_name": "W", "weekday": i % 7,
+                    "time_hhmm": minutes_to_hhmm(TIMES[i % len(TIMES)]),
+                    "minute_of_day": TIMES[i % len(TIMES)], "is_active": i % 5 != 0,
+                }
+                for i in range(HISTORY // 10)
+            ],
+        )
+        await conn.execute(
+            insert(ReminderDelivery),
+            [
+                {
+                    "booking_id": i + 1, "start_at": now - timedelta(hours=2 * (i + 1)), "offset_min": 60,
+                    "channel": "user", "recipient": str(1000 + i % USERS), "status": "sent",
+                }
+                for i in range(HISTORY)
+            ],
+        )
+        await conn.execute(
+            insert(EmailOutbox),
+            [
+                {"to_email": "s@example.com", "subject": "s", "body": "b", "status": "sent", "next_attempt_at": now}
+                for _ in range(HISTORY)
+            ],
+        )
+        await conn.execute(
+            insert(CalendarOutbox),
+            [{"booking_id": i + 1, "action": "create", "status": "done", "next_attempt_at": now} for i in range(HISTORY)],
+        )
+        # Отложенная операция: воркер её прочитает (и проверит порядок), но не выполнит
+        await conn.execute(
+            insert(CalendarOutbox).values(
+                booking_id=1, action="update", status="pending", next_attempt_at=now + timedelta(hours=1)
+            )
+        )
+
+
+async def in_session(fn, *args):
+    async with SessionLocal() as session:
+        return await fn(session, *args)
+
+
+async def book_interval(session, weekday: int, time_hhmm: str):
+    user = await session.get(User, 1)
+    return await BookingService.book_interval(session, user, weekday, time_hhmm, "S", "—")
+
+
+async def my_bookings(session):
+    user = await session.get(User, 1)
+    return await BookingService.my_bookings(session, user)
+
+
+SCENARIOS = [
+    ("мои записи", lambda: in_session(my_bookings)),
+    ("занятые интервальные времена дня", lambda: in_session(_busy_weekly_hhmm_for_day, 1)),
+    ("бронирование интервального занятия", lambda: in_session(book_interval, 2, "19:30")),
+    ("интервальные занятия в диапазоне времени", lambda: in_session(BookingService.interval_between, 1, 16 * 60, 20 * 60)),
+    ("занятые еженедельные времена", lambda: in_session(_busy_times_for_weekday, 1)),
+    ("сетка занятых слотов", lambda: in_session(_occupied_grid, datetime.now().date())),
+    ("тик диспетчера напоминаний", ReminderService.dispatch),
+    ("досылка пропущенных напоминаний", ReminderService.catch_up),
+    ("раскладка серий", RecurrenceService.materialize),
+    ("outbox писем", EmailOutboxService.drain),
+    ("outbox календаря", CalendarOutboxService.drain),
+]
+
+
+async def run(verbose: bool) -> bool:
+    settings.reminders_enabled = True
+    settings.smtp_enabled = True
+    # Календарь выключен: воркер читает очередь, но в API не ходит
+    settings.google_calendar_enabled = False
+    await seed()
+    await sync_sequences()
+    postgres = engine.dialect.name == "postgresql"
+    explain = "EXPLAIN " if postgres else "EXPLAIN QUERY PLAN "
+    print(f"База: {engine.dialect.name}")
+
+    captured: list[tuple[str, object]] = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT") and not executemany:
+            captured.append((statement, parameters))
+
+    results = []
+    for title, scenario in SCENARIOS:
+        captured.clear()
+        event.listen(engine.sync_engine, "before_cursor_execute", capture)
+        try:
+            await scenario()
+        finally:
+            event.remove(engine.sync_engine, "before_cursor_execute", capture)
+        queries = list(captured)
+
+        scans: list[str] = []
+        async with engine.connect() as conn:
+            if postgres:
+                await conn.exec_driver_sql("SET enable_seqscan = off")
+            for statement, parameters in queries:
+                plan = (await conn.exec_driver_sql(explain + statement, parameters)).all()
+                details = [row[-1] for row in plan]
+                if verbose:
+                    print(f"      {' '.join(statement.split())[:110]}")
+                    for detail in details:
+                        print(f"         {detail}")
+                for detail in details:
+                    match = _FULL_SCAN.search(detail)
+                    if match and (match.group(1) or match.group(2)) not in EXPECTED_SCANS:
+                        scans.append(detail)
+        results.append(
+            check(f"{title}: {len(queries)} запросов" + (f", полный просмотр: {'; '.join(scans)}" if scans else ""), not scans)
+            and check(f"{title}: запросы перехвачены", bool(queries))
+        )
+
+    await engine.dispose()
+    return all(results)
+
+
+if __name__ == "__main__":
+    print("Планы частых запросов")
+    print("=" * 50)
+    finish(asyncio.run(run("-v" in sys.argv)))
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Проверка серий интервальных занятий (recurrences/occurrences)
+
+- запись на серию раскладывает занятия до горизонта, повторная
+  материализация ничего не дублирует, а сдвиг «сейчас» докладывает
+  следующую неделю;
+- пропуск и перенос недели — исключения правила: ночная материализация
+  их не откатывает, перенос на занятое или прошедшее время отклоняется;
+- разовая запись и перенос на время занятия серии отклоняются
+  (RecurrenceService.occupied_at), а на время пропущенной недели — проходят;
+- неделя серии, время которой уже занято разовой записью, не
+  раскладывается, пока запись не отменят.
+"""
+
+import asyncio
+from datetime import datetime, time, timedelta
+
+from testkit import check, finish, reset_schema, use_test_db
+
+use_test_db("recurrence")
+
+from sqlalchemy import select
+
+from app.config import settings
+from app.services.booking_service import BookingService
+from app.services.recurrence_service import RecurrenceService
+from app.services.slot_service import WINDOW_DAYS
+from app.storage.db import SessionLocal, engine
+from app.storage.models import Booking, Occurrence, Recurrence, User
+from app.utils.dates import to_local, to_utc, utcnow
+
+
+async def user(tg_id: int) -> User:
+    async with SessionLocal() as session:
+        u = User(tg_id=tg_id, name=f"u{tg_id}")
+        session.add(u)
+        await session.commit()
+        return u
+
+
+async def book(uid: int, at: datetime):
+    async with SessionLocal() as session:
+        u = await session.get(User, uid)
+        return await BookingService.book_at(session, u, at, f"S{uid}", "—")
+
+
+async def book_series(uid: int, weekday: int, hhmm: str):
+    async with SessionLocal() as session:
+        u = await session.get(User, uid)
+        return await BookingService.book_interval(session, u, weekday, hhmm, f"W{uid}", "—")
+
+
+async def occurrences(booking_id: int) -> list[Occurrence]:
+    async with SessionLocal() as session:
+        return list(
+            (
+                await session.scalars(
+                    select(Occurrence).where(Occurrence.booking_id == booking_id).order_by(Occurrence.original_start_at)
+                )
+            ).all()
+        )
+
+
+async def call(fn, *args):
+    async with SessionLocal() as session:
+        return await fn(session, *args)
+
+
+def weekly(first: datetime, count: int) -> list[datetime]:
+    return [to_utc(first + timedelta(weeks=i)) for i in range(count)]
+
+
+async def check_series(uid: int) -> list:
+    today = to_local(utcnow()).date()
+    first = datetime.combine(today + timedelta(days=1), time(17, 45))
+    horizon = today + timedelta(days=max(settings.recurrence_horizon_days, WINDOW_DAYS))
+    expected = [at for at in weekly(first, 10) if to_local(at).date() <= horizon]
+
+    series = await book_series(uid, first.weekday(), "17:45")
+    created = [o.start_at for o in await occurrences(series.id)]
+    again = await RecurrenceService.materialize()
+    later = await RecurrenceService.materialize(now=utcnow() + timedelta(weeks=1))
+    after = [o.start_at for o in await occurrences(series.id)]
+    return [
+        check(f"серия разложена до горизонта ({len(created)} занятий)", created == expected),
+        check("повторная материализация ничего не добавила", again["created"] == 0),
+        check("через неделю доложена ещё одна неделя", later["created"] == 1 and after == weekly(first, len(after))),
+    ]
+
+
+async def check_exceptions(uid: int, other_uid: int) -> list:
+    today = to_local(utcnow()).date()
+    first = datetime.combine(today + timedelta(days=2), time(16, 0))
+    series = await book_series(uid, first.weekday(), "16:00")
+    skipped, moved = first + timedelta(weeks=1), first + timedelta(weeks=2)
+    target = moved.replace(hour=19, minute=30)
+
+    results = [
+        check("пропуск недели", await call(RecurrenceService.skip, series.id, skipped.date())),
+        check("перенос недели", await call(RecurrenceService.move, series.id, moved.date(), target)),
+    ]
+    await RecurrenceService.materialize()
+    starts = [o.start_at for o in await occurrences(series.id)]
+    async with SessionLocal() as session:
+        rec = await session.scalar(select(Recurrence).where(Recurrence.booking_id == series.id))
+    results += [
+        check("пропущенная неделя не восстановлена материализацией", to_utc(skipped) not in starts),
+        check("перенесённое занятие осталось на новом времени", to_utc(target) in starts and to_utc(moved) not in starts),
+        check("исключения записаны в правило", skipped.date().isoformat() in rec.exceptions),
+    ]
+
+    # Перенос на прошедшее или занятое время отклоняется
+    single = await book(other_uid, first + timedelta(weeks=3, hours=1, minutes=45))
+    other = await book_series(other_uid, first.weekday(), "19:30")
+    results += [
+        check(
+            "перенос в прошлое отклонён",
+            not await call(RecurrenceService.move, series.id, first.date(), utcnow() - timedelta(hours=1)),
+        ),
+        check(
+            "перенос на разовую запись отклонён",
+            not await call(RecurrenceService.move, series.id, first.date(), single.slot.start_at),
+        ),
+        check(
+            "перенос на занятие другой серии отклонён",
+            not await call(RecurrenceService.move, series.id, first.date(), first.replace(hour=19, minute=30)),
+        ),
+    ]
+
+    # Разовая запись и перенос не занимают время занятия серии
+    results += [
+        check("запись на занятие серии отклонена", await book(other_uid, first) is None),
+        check("запись на перенесённое занятие серии отклонена", await book(other_uid, target) is None),
+        check("перенос разовой записи на занятие серии отклонён", not await call(BookingService.reschedule_to, single.id, first)),
+        check("запись на время пропущенной недели прошла", await book(other_uid, skipped) is not None),
+    ]
+    await call(BookingService.admin_cancel, other.id)
+    return results
+
+
+async def check_taken_week(uid: int, other_uid: int) -> list:
+    today = to_local(utcnow()).date()
+    first = datetime.combine(today + timedelta(days=3), time(19, 30))
+    single = await book(other_uid, first + timedelta(weeks=1))
+    series = await book_series(uid, first.weekday(), "19:30")
+    starts = [o.start_at for o in await occurrences(series.id)]
+    blocked = to_utc(first + timedelta(weeks=1))
+
+    await call(BookingService.admin_cancel, single.id)
+    await RecurrenceService.materialize()
+    restored = [o.start_at for o in await occurrences(series.id)]
+    async with SessionLocal() as session:
+        owners = (await session.scalars(select(Booking.id).where(Booking.id.in_([single.id, series.id])))).all()
+    return [
+        check("неделя, занятая разовой записью, не разложена", blocked not in starts and to_utc(first) in starts),
+        check("после отмены записи неделя доложена", blocked in restored),
+        check("разовая запись отменена, серия на месте", list(owners) == [series.id]),
+    ]
+
+
+async def run() -> bool:
+    settings.google_calendar_enabled = False
+    settings.smtp_enabled = False
+    settings.reminders_enabled = False
+    settings.recurrence_horizon_days = 28
+    print(f"База: {engine.dialect.name}")
+    await reset_schema()
+    users = [(await user(100 + i)).id for i in range(4)]
+    try:
+        results = (
+            await check_series(users[0])
+            + await check_exceptions(users[1], users[2])
+            + await check_taken_week(users[3], users[2])
+        )
+    finally:
+        await engine.dispose()
+    return all(results)
+
+
+if __name__ == "__main__":
+    print("Проверка серий интервальных занятий")
+    print("=" * 50)
+    finish(asyncio.run(run()))
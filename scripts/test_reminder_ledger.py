@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Проверка журнала напоминаний (reminder_deliveries) без сети
+
+На временной SQLite с заглушкой бота проверяет:
+- /remindnow не «съедает» плановое напоминание и не дублируется сам;
+- строка, захваченная на отправку, но не отмеченная (падение, отмена),
+  после аренды REMINDER_CLAIM_LEASE_SECONDS отправляется повторно,
+  а свежая — нет;
+- падение диспетчера между сдвигом next_remind_at и отправкой оставляет
+  в журнале pending-строку, и напоминание уходит повтором;
+- отправка, не ответившая за таймаут своего канала, не считается
+  неудачной: строка остаётся pending, исход пишется по факту, и
+  напоминание не дублируется.
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+from testkit import FakeBot, check, finish, reset_schema, use_test_db
+
+use_test_db("ledger")
+
+from sqlalchemy import select
+
+from app import runtime
+from app.config import settings
+from app.integrations.telegram_queue import get_queue
+from app.services.booking_service import BookingService
+from app.services.reminder_service import ReminderService
+from app.storage.db import SessionLocal, engine
+from app.storage.models import Booking, ReminderDelivery, User
+from app.utils.dates import utcnow
+
+
+async def book(tg_id: int, start_at: datetime) -> Booking:
+    async with SessionLocal() as session:
+        user = User(tg_id=tg_id, name=f"u{tg_id}")
+        session.add(user)
+        await session.commit()
+        return await BookingService.book_at(session, user, start_at, f"S{tg_id}", "—")
+
+
+async def claimed(booking: Booking, tg_id: int, start_at: datetime, claimed_at: datetime) -> None:
+    """Строка журнала, как после захвата без записи результата"""
+    async with SessionLocal() as session:
+        session.add(
+            ReminderDelivery(
+                booking_id=booking.id, start_at=start_at, offset_min=60, channel="user",
+                recipient=str(tg_id), status="pending", claimed_at=claimed_at,
+            )
+        )
+        await session.commit()
+
+
+async def check_manual(bot: FakeBot) -> list:
+    start_at = (utcnow() + timedelta(hours=23)).replace(second=0, microsecond=0)
+    booking = await book(101, start_at)
+    first = await ReminderService.send_reminder_job(booking.id)
+    again = await ReminderService.send_reminder_job(booking.id)
+    planned = await ReminderService.dispatch(now=start_at - timedelta(minutes=60) + timedelta(seconds=5))
+    to_user = [text for _, chat, text in bot.sent if chat == 101]
+    return [
+        check("/remindnow отправляет", first == 1),
+        check("повторный /remindnow не дублируется", again == 0),
+        check("плановое напоминание за час после /remindnow уходит", planned == 1),
+        check(f"ученику ушло два сообщения ({len(to_user)})", len(to_user) == 2),
+    ]
+
+
+async def check_abandoned(bot: FakeBot) -> list:
+    """Брошенная строка подхватывается и как наступившая, и повтором журнала"""
+    now = utcnow()
+    lease = timedelta(seconds=settings.reminder_claim_lease_seconds)
+    start_at = (utcnow() + timedelta(hours=3)).replace(second=0, microsecond=0)
+    stale_due = await book(102, start_at)
+    fresh_due = await book(103, start_at + timedelta(minutes=1))
+    stale_retry = await book(104, start_at + timedelta(minutes=2))
+    await claimed(stale_due, 102, start_at, now - lease - timedelta(minutes=1))
+    await claimed(fresh_due, 103, start_at + timedelta(minutes=1), now)
+    await claimed(stale_retry, 104, start_at + timedelta(minutes=2), now - lease - timedelta(minutes=1))
+    async with SessionLocal() as session:
+        # У stale_retry напоминание уже «прошло» диспетчер — остаётся только повтор журнала
+        (await session.get(Booking, stale_retry.id)).next_remind_at = None
+        await session.commit()
+
+    bot.sent.clear()
+    await ReminderService.dispatch(now=start_at - timedelta(minutes=60) + timedelta(seconds=90))
+    chats = {chat for _, chat, _ in bot.sent}
+    async with SessionLocal() as session:
+        statuses = dict(
+            (await session.execute(select(ReminderDelivery.booking_id, ReminderDelivery.status))).all()
+        )
+    return [
+        check("брошенная наступившая отправка повторена", 102 in chats),
+        check("брошенная строка подхвачена повтором журнала", 104 in chats),
+        check("свежая pending-строка не задублирована", 103 not in chats),
+        check(
+            "повторы отмечены в журнале",
+            statuses.get(stale_due.id) == "sent" and statuses.get(stale_retry.id) == "sent",
+        ),
+    ]
+
+
+async def check_crash(bot: FakeBot) -> list:
+    """Тик, упавший после commit, но до отправки"""
+    start_at = (utcnow() + timedelta(hours=5)).replace(second=0, microsecond=0)
+    booking = await book(105, start_at)
+    fire = start_at - timedelta(minutes=60) + timedelta(seconds=5)
+
+    async def crash(*args, **kwargs):
+        raise RuntimeError("процесс упал")
+
+    deliver = ReminderService._deliver
+    ReminderService._deliver = crash
+    try:
+        await ReminderService.dispatch(now=fire)
+    except RuntimeError:
+        pass
+    finally:
+        ReminderService._deliver = deliver
+    async with SessionLocal() as session:
+        next_at = (await session.get(Booking, booking.id)).next_remind_at
+        pending = (
+            await session.scalars(
+                select(ReminderDelivery.status).where(ReminderDelivery.booking_id == booking.id)
+            )
+        ).all()
+
+    bot.sent.clear()
+    lease = settings.reminder_claim_lease_seconds
+    settings.reminder_claim_lease_seconds = 0
+    try:
+        await ReminderService.dispatch(now=fire + timedelta(seconds=30))
+    finally:
+        settings.reminder_claim_lease_seconds = lease
+    return [
+        check("после падения next_remind_at сдвинут", next_at is None),
+        check(f"после падения в журнале pending-строки ({pending})", bool(pending) and set(pending) == {"pending"}),
+        check("после аренды напоминание ушло повтором", 105 in {chat for _, chat, _ in bot.sent}),
+    ]
+
+
+async def check_slow(bot: FakeBot) -> list:
+    """Ученику Telegram отвечает дольше таймаута канала, администратору — быстрее своего"""
+    start_at = (utcnow() + timedelta(hours=7)).replace(second=0, microsecond=0)
+    booking = await book(106, start_at)
+    fire = start_at - timedelta(minutes=60) + timedelta(seconds=5)
+    settings.admins_raw = "900"
+    settings.reminder_user_timeout_seconds = 0.2
+    settings.reminder_admin_timeout_seconds = 5
+    bot.delays = {106: 0.6, 900: 0.3}
+    bot.sent.clear()
+
+    async def statuses() -> dict:
+        async with SessionLocal() as session:
+            rows = await session.execute(
+                select(ReminderDelivery.channel, ReminderDelivery.status).where(ReminderDelivery.booking_id == booking.id)
+            )
+            return dict(rows.all())
+
+    lease = settings.reminder_claim_lease_seconds
+    try:
+        reminded = await ReminderService.dispatch(now=fire)
+        after_timeout = await statuses()
+        await asyncio.sleep(1)
+        settled = await statuses()
+        settings.reminder_claim_lease_seconds = 0
+        await ReminderService.dispatch(now=fire + timedelta(seconds=30))
+    finally:
+        settings.reminder_claim_lease_seconds = lease
+        settings.admins_raw = ""
+        bot.delays = {}
+    to_user = [chat for _, chat, _ in bot.sent if chat == 106]
+    return [
+        check(f"администратору в пределах своего таймаута — sent ({after_timeout})", after_timeout.get("admin") == "sent"),
+        check("ученику после таймаута — pending, а не failed", after_timeout.get("user") == "pending"),
+        check("тик засчитан по администратору, ученик ещё не подтверждён", reminded == 1),
+        check(f"исход досланной отправки записан ({settled})", settled.get("user") == "sent"),
+        check(f"ученику ушло одно сообщение ({len(to_user)})", len(to_user) == 1),
+    ]
+
+
+async def run() -> bool:
+    settings.reminders_enabled = True
+    settings.smtp_enabled = False
+    settings.google_calendar_enabled = False
+    settings.admins_raw = ""
+    settings.remind_offsets_minutes = [1440, 60]
+    settings.telegram_chat_interval_seconds = 0
+    bot = FakeBot()
+    runtime.set_bot(bot)
+    await reset_schema()
+    try:
+        results = await check_manual(bot) + await check_abandoned(bot) + await check_crash(bot) + await check_slow(bot)
+    finally:
+        await get_queue().close()
+        await engine.dispose()
+    return all(results)
+
+
+if __name__ == "__main__":
+    print("Проверка журнала напоминаний")
+    print("=" * 50)
+    finish(asyncio.run(run()))
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Проверка диспетчера напоминаний (ReminderService.dispatch) и досылки
+после простоя (ReminderService.catch_up) без сети
+
+- напоминание уходит в тик, когда наступил next_remind_at, и ни тиком
+  раньше; колонка сдвигается на следующий offset, после последнего — NULL;
+- повторный тик с тем же «сейчас» ничего не дублирует;
+- то же для занятий интервальной серии (occurrences);
+- напоминание, опоздавшее сильнее grace, пропускается, а следующий offset
+  уходит как обычно;
+- limit ограничивает пачку тика, остаток забирают следующие тики;
+- после простоя catch_up досылает по каждой записи и занятию серии ровно
+  одно «запоздалое» напоминание — по самому позднему наступившему offset,
+  пачками по reminder_catchup_per_second; уже прошедшие занятия не
+  трогает; повторный catch_up и тик диспетчера ничего не дублируют, а
+  следующий offset уходит как обычно;
+- записи, наступившие в один тик, приходят каждому администратору одним
+  общим сообщением (ученикам — по своему), журнал отмечает его для всех
+  записей пачки, а после сбоя повтор снова уходит одним сообщением.
+"""
+
+import asyncio
+from datetime import datetime, time, timedelta
+
+from testkit import FakeBot, check, finish, reset_schema, use_test_db
+
+use_test_db("reminders")
+
+from sqlalchemy import select
+
+from app import runtime
+from app.config import settings
+from app.integrations.telegram_queue import get_queue
+from app.services.booking_service import BookingService
+from app.services.reminder_service import ReminderService
+from app.storage.db import SessionLocal, engine
+from app.storage.models import Booking, Occurrence, ReminderDelivery, User
+from app.utils.dates import to_local, to_utc, utcnow
+
+DAY, HOUR = timedelta(minutes=1440), timedelta(minutes=60)
+
+
+async def user(tg_id: int) -> User:
+    async with SessionLocal() as session:
+        u = User(tg_id=tg_id, name=f"u{tg_id}")
+        session.add(u)
+        await session.commit()
+        return u
+
+
+async def book(tg_id: int, start_at: datetime) -> Booking:
+    u = await user(tg_id)
+    async with SessionLocal() as session:
+        return await BookingService.book_at(session, u, start_at, f"S{tg_id}", "—")
+
+
+async def next_at(booking_id: int):
+    async with SessionLocal() as session:
+        return (await session.get(Booking, booking_id)).next_remind_at
+
+
+def to(bot: FakeBot, chat: int) -> list[str]:
+    return [text for _, c, text in bot.sent if c == chat]
+
+
+async def check_single(bot: FakeBot) -> list:
+    await reset_schema()
+    bot.sent.clear()
+    start_at = (utcnow() + timedelta(days=3)).replace(second=0, microsecond=0)
+    booking = await book(101, start_at)
+    scheduled = await next_at(booking.id)
+
+    early = await ReminderService.dispatch(now=start_at - DAY - timedelta(seconds=30))
+    early_sent = len(bot.sent)
+    day = await ReminderService.dispatch(now=start_at - DAY + timedelta(seconds=5))
+    after_day = await next_at(booking.id)
+    again = await ReminderService.dispatch(now=start_at - DAY + timedelta(seconds=10))
+    hour = await ReminderService.dispatch(now=start_at - HOUR + timedelta(seconds=5))
+    after_hour = await next_at(booking.id)
+    texts = to(bot, 101)
+    return [
+        check("после записи next_remind_at — за сутки до занятия", scheduled == start_at - DAY),
+        check("тик до срока ничего не отправляет", early == 0 and early_sent == 0),
+        check("напоминание за сутки ушло в свой тик", day == 1),
+        check("next_remind_at сдвинут на напоминание за час", after_day == start_at - HOUR),
+        check("повторный тик не дублирует", again == 0),
+        check("напоминание за час ушло", hour == 1),
+        check("после последнего offset next_remind_at пуст", after_hour is None),
+        check(f"ученику два сообщения ({len(texts)})", len(texts) == 2 and all(t.startswith("Напоминание о занятии") for t in texts)),
+        check(f"администратору два сообщения ({len(to(bot, 900))})", len(to(bot, 900)) == 2),
+    ]
+
+
+async def check_series(bot: FakeBot) -> list:
+    await reset_schema()
+    bot.sent.clear()
+    day = to_local(utcnow()).date() + timedelta(days=2)
+    u = await user(102)
+    async with SessionLocal() as session:
+        series = await BookingService.book_interval(session, u, day.weekday(), "16:00", "W102", "—")
+    start_at = to_utc(datetime.combine(day, time(16, 0)))
+
+    async def occurrence() -> Occurrence:
+        async with SessionLocal() as session:
+            return await session.scalar(
+                select(Occurrence).where(Occurrence.booking_id == series.id, Occurrence.start_at == start_at)
+            )
+
+    scheduled = (await occurrence()).next_remind_at
+    first = await ReminderService.dispatch(now=start_at - DAY + timedelta(seconds=5))
+    first_sent = to(bot, 102)
+    moved = (await occurrence()).next_remind_at
+    again = await ReminderService.dispatch(now=start_at - DAY + timedelta(seconds=10))
+    second = await ReminderService.dispatch(now=start_at - HOUR + timedelta(seconds=5))
+    done = (await occurrence()).next_remind_at
+    return [
+        check("у занятия серии next_remind_at — за сутки", scheduled == start_at - DAY),
+        check("напоминание по занятию серии ушло", first == 1 and len(first_sent) == 1),
+        check("next_remind_at занятия сдвинут на час", moved == start_at - HOUR),
+        check("повторный тик по серии не дублирует", again == 0),
+        check("напоминание за час по серии ушло, колонка пуста", second == 1 and done is None),
+    ]
+
+
+async def check_missed(bot: FakeBot) -> list:
+    await reset_schema()
+    bot.sent.clear()
+    start_at = (utcnow() + timedelta(days=3)).replace(second=0, microsecond=0)
+    booking = await book(103, start_at)
+    # Тик спустя десять минут после срока — дальше grace
+    late = await ReminderService.dispatch(now=start_at - DAY + timedelta(minutes=10))
+    late_sent = len(bot.sent)
+    after = await next_at(booking.id)
+    hour = await ReminderService.dispatch(now=start_at - HOUR + timedelta(seconds=5))
+    return [
+        check("опоздавшее сильнее grace напоминание пропущено", late == 0 and late_sent == 0),
+        check("после пропуска next_remind_at — на час", after == start_at - HOUR),
+        check("напоминание за час ушло как обычно", hour == 1 and len(to(bot, 103)) == 1),
+    ]
+
+
+async def check_limit(bot: FakeBot) -> list:
+    await reset_schema()
+    bot.sent.clear()
+    base = (utcnow() + timedelta(days=3)).replace(second=0, microsecond=0)
+    for i in range(5):
+        await book(110 + i, base + timedelta(seconds=5 * i))
+    now = base - DAY + timedelta(seconds=25)
+    ticks = [await ReminderService.dispatch(now=now, limit=2) for _ in range(4)]
+    return [
+        check(f"пачки по limit=2: {ticks}", ticks == [2, 2, 1, 0]),
+        check("каждый ученик получил одно сообщение", all(len(to(bot, 110 + i)) == 1 for i in range(5))),
+    ]
+
+
+async def check_disabled(bot: FakeBot) -> list:
+    await reset_schema()
+    bot.sent.clear()
+    start_at = (utcnow() + timedelta(days=3)).replace(second=0, microsecond=0)
+    booking = await book(120, start_at)
+    settings.reminders_enabled = False
+    try:
+        off = await ReminderService.dispatch(now=start_at - DAY + timedelta(seconds=5))
+    finally:
+        settings.reminders_enabled = True
+    return [
+        check("при REMINDERS_ENABLED=false тик ничего не делает", off == 0 and not bot.sent),
+        check("next_remind_at не тронут", await next_at(booking.id) == start_at - DAY),
+    ]
+
+
+async def check_catch_up(bot: FakeBot) -> list:
+    await reset_schema()
+    bot.sent.clear()
+    day = to_local(utcnow()).date() + timedelta(days=3)
+    u = await user(130)
+    async with SessionLocal() as session:
+        series = await BookingService.book_interval(session, u, day.weekday(), "16:00", "W130", "—")
+    lesson = to_utc(datetime.combine(day, time(16, 0)))
+    # Бот «поднялся» за полчаса до занятия серии
+    restart = lesson - timedelta(minutes=30)
+    hour_late = await book(131, lesson + timedelta(minutes=10))
+    day_late = await book(132, lesson + timedelta(hours=5))
+    await book(133, lesson - timedelta(hours=2))
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    first = await ReminderService.catch_up(now=restart)
+    elapsed = loop.time() - started
+    sent = list(bot.sent)
+    again = await ReminderService.catch_up(now=restart)
+    tick = await ReminderService.dispatch(now=restart + timedelta(seconds=5))
+    repeated = len(bot.sent) - len(sent)
+
+    async with SessionLocal() as session:
+        offsets = dict(
+            (
+                await session.execute(
+                    select(ReminderDelivery.booking_id, ReminderDelivery.offset_min).where(
+                        ReminderDelivery.channel == "user"
+                    )
+                )
+            ).all()
+        )
+        occurrence_next = await session.scalar(
+            select(Occurrence.next_remind_at).where(Occurrence.booking_id == series.id, Occurrence.start_at == lesson)
+        )
+    hour_next, day_next = await next_at(hour_late.id), await next_at(day_late.id)
+
+    regular = await ReminderService.dispatch(now=day_late.slot.start_at - HOUR + timedelta(seconds=5))
+    late = [text for _, chat, text in sent if chat in (130, 131, 132)]
+    return [
+        check(f"досланы три напоминания: {first}", first == {"missed": 3, "recovered": 3}),
+        check(
+            "каждому ученику ровно одно запоздалое",
+            sorted(chat for _, chat, _ in sent if chat != 900) == [130, 131, 132]
+            and all(text.startswith("Запоздалое напоминание о занятии") for text in late),
+        ),
+        check("прошедшее занятие не напомнено", 133 not in {chat for _, chat, _ in bot.sent}),
+        check(
+            f"в журнале самый поздний наступивший offset ({offsets})",
+            offsets == {series.id: 60, hour_late.id: 60, day_late.id: 1440},
+        ),
+        check(
+            "next_remind_at сдвинут после «сейчас»",
+            occurrence_next is None and hour_next is None and day_next == day_late.slot.start_at - HOUR,
+        ),
+        check(f"пачки по 2 в секунду: {elapsed:.1f} с", elapsed >= 1),
+        check(
+            "повторный catch_up и тик ничего не дублируют",
+            again == {"missed": 0, "recovered": 0} and tick == 0 and repeated == 0,
+        ),
+        check(
+            "следующий offset ушёл обычным напоминанием",
+            regular == 1 and to(bot, 132)[-1].startswith("Напоминание о занятии") and len(to(bot, 132)) == 2,
+        ),
+    ]
+
+
+async def admin_statuses() -> dict[int, str]:
+    async with SessionLocal() as session:
+        rows = await session.execute(
+            select(ReminderDelivery.booking_id, ReminderDelivery.status).where(ReminderDelivery.channel == "admin")
+        )
+        return dict(rows.all())
+
+
+async def check_batch(bot: FakeBot) -> list:
+    await reset_schema()
+    bot.sent.clear()
+    base = (utcnow() + timedelta(days=3)).replace(second=0, microsecond=0)
+    for i in range(3):
+        await book(140 + i, base + timedelta(seconds=10 * i))
+    alone = await book(150, base + timedelta(hours=6))
+    settings.admins_raw = "900,901"
+    try:
+        reminded = await ReminderService.dispatch(now=base - DAY + timedelta(seconds=25))
+        single = await ReminderService.dispatch(now=alone.slot.start_at - DAY + timedelta(seconds=5))
+    finally:
+        settings.admins_raw = "900"
+    batched, last = to(bot, 900), to(bot, 901)
+    statuses = await admin_statuses()
+    return [
+        check("пачка из трёх записей напомнена", reminded == 3),
+        check(
+            f"каждому администратору два сообщения ({len(batched)}, {len(last)})",
+            len(batched) == 2 and len(last) == 2,
+        ),
+        check(
+            "общее сообщение перечисляет всех учеников пачки",
+            batched[0].startswith("Напоминание: 3 занятий") and all(f"S{140 + i}" in batched[0] for i in range(3)),
+        ),
+        check("одиночная запись — обычным сообщением", single == 1 and batched[1].startswith("Напоминание (ученик): S150")),
+        check("ученикам — по своему сообщению", all(len(to(bot, 140 + i)) == 1 for i in range(3))),
+        check(f"общее сообщение отмечено для всех записей ({statuses})", set(statuses.values()) == {"sent"} and len(statuses) == 4),
+    ]
+
+
+async def check_batch_retry(bot: FakeBot) -> list:
+    """Общее сообщение администратору не дошло: повтор — снова одним сообщением"""
+    await reset_schema()
+    bot.sent.clear()
+    base = (utcnow() + timedelta(days=3)).replace(second=0, microsecond=0)
+    bookings = [await book(160 + i, base + timedelta(seconds=10 * i)) for i in range(3)]
+    bot.errors = {900: 1}
+    try:
+        await ReminderService.dispatch(now=base - DAY + timedelta(seconds=25))
+        failed = await admin_statuses()
+        await ReminderService.dispatch(now=base - DAY + timedelta(seconds=55))
+    finally:
+        bot.errors = {}
+    retried = await admin_statuses()
+    admin = to(bot, 900)
+    return [
+        check(f"сбой отмечен для всех записей пачки ({failed})", set(failed.values()) == {"failed"} and len(failed) == 3),
+        check(
+            f"повтор ушёл одним сообщением ({len(admin)})",
+            len(admin) == 1 and admin[0].startswith("Напоминание: 3 занятий"),
+        ),
+        check("после повтора отмечено для всех", set(retried.values()) == {"sent"} and len(retried) == len(bookings)),
+        check("ученикам повтор не ушёл", all(len(to(bot, 160 + i)) == 1 for i in range(3))),
+    ]
+
+
+async def run() -> bool:
+    settings.reminders_enabled = True
+    settings.smtp_enabled = False
+    settings.google_calendar_enabled = False
+    settings.admins_raw = "900"
+    settings.remind_offsets_minutes = [1440, 60]
+    settings.telegram_chat_interval_seconds = 0
+    settings.reminder_catchup_per_second = 2
+    print(f"База: {engine.dialect.name}")
+    bot = FakeBot()
+    runtime.set_bot(bot)
+    try:
+        results = (
+            await check_single(bot)
+            + await check_series(bot)
+            + await check_missed(bot)
+            + await check_limit(bot)
+            + await check_disabled(bot)
+            + await check_catch_up(bot)
+            + await check_batch(bot)
+            + await check_batch_retry(bot)
+        )
+    finally:
+        await get_queue().close()
+        await engine.dispose()
+    return all(results)
+
+
+if __name__ == "__main__":
+    print("Проверка диспетчера напоминаний и досылки после простоя")
+    print("=" * 50)
+    finish(asyncio.run(run()))
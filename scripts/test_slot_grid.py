@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Проверка битовой сетки слотов (SlotGrid) против прежнего расчёта на множествах
+
+- случайные occupy/release на сетках разной длины и с разным днём недели
+  начала совпадают с моделью на set[datetime];
+- на базе со случайными разовыми записями (в прошлом, в окне и за ним, в том
+  числе не на время сетки) и занятиями серий _occupied_grid даёт те же
+  свободные дни и времена, что прежний запрос всех занятых времён с
+  фильтрацией кандидатов в Python — для разных «сейчас», включая сутки
+  перехода на зимнее время.
+
+    python scripts/test_slot_grid.py [seed]
+"""
+
+import asyncio
+import random
+import sys
+from datetime import date, datetime, time, timedelta
+
+from testkit import check, finish, reset_schema, use_test_db
+
+use_test_db("grid")
+
+from sqlalchemy import insert, join, select
+
+from app.config import settings
+from app.services.slot_service import WINDOW_DAYS, _occupied_grid
+from app.services.week_grid import SLOT_TIMES, SlotGrid
+from app.storage.db import SessionLocal, engine
+from app.storage.models import Booking, Occurrence, Recurrence, Slot, User
+from app.utils.dates import to_naive_local, to_utc
+
+BOOKINGS = 60
+OCCURRENCES = 30
+# Сутки перехода на зимнее время в Europe/Berlin
+DST_END = date(2026, 10, 25)
+
+
+def legacy_free(busy: set[datetime], now: datetime, days: int) -> dict[date, list[datetime]]:
+    """Прежний расчёт: кандидаты окна минус занятые, не раньше now"""
+    free: dict[date, list[datetime]] = {}
+    for i in range(days):
+        day = now.date() + timedelta(days=i)
+        if day.weekday() >= 5:
+            continue
+        times = [at for at in (datetime.combine(day, t) for t in SLOT_TIMES) if at not in busy and at >= now]
+        if times:
+            free[day] = times
+    return free
+
+
+def grid_free(grid: SlotGrid, now: datetime) -> dict[date, list[datetime]]:
+    return {day: grid.free_times(day, now) for day in grid.free_counts(now)}
+
+
+def check_model(rng: random.Random) -> list:
+    ok = True
+    for days in (1, 7, 14, 90, 365):
+        for shift in range(7):
+            start = date(2026, 1, 5) + timedelta(days=shift)
+            grid = SlotGrid(start, days)
+            busy: set[datetime] = set()
+            weekly: set[datetime] = set()
+            ops = (
+                (grid.occupy, busy.add),
+                (grid.occupy_recurring, weekly.add),
+                (grid.release, busy.discard),
+                (grid.release_recurring, weekly.discard),
+            )
+            for _ in range(200):
+                # День на единицу за границами окна с обеих сторон — сетка его игнорирует
+                day = start + timedelta(days=rng.randrange(days + 2) - 1)
+                at = datetime.combine(day, rng.choice(SLOT_TIMES))
+                target, model = rng.choice(ops)
+                target(at)
+                model(at)
+            # «Сейчас» ровно на начале слота — граничный случай
+            at_time = rng.choice(SLOT_TIMES) if rng.random() < 0.5 else time(rng.randrange(24), rng.randrange(60))
+            now = datetime.combine(start + timedelta(days=rng.randrange(days)), at_time)
+            taken = {at for at in busy | weekly if 0 <= (at.date() - start).days < days}
+            expected = {
+                day: list(times)
+                for day, times in legacy_free(taken, now, (start + timedelta(days=days) - now.date()).days).items()
+            }
+            ok &= grid_free(grid, now) == expected
+            ok &= set(grid.busy_times()) == {at for at in taken if at.weekday() < 5}
+            ok &= all(grid.weekly_times(day) == sorted(at for at in weekly if at.date() == day)
+                      for day in {at.date() for at in weekly} if 0 <= (day - start).days < days)
+    return [check("случайные изменения сетки совпадают с моделью на множествах", ok)]
+
+
+async def seed(rng: random.Random, around: list[datetime]) -> None:
+    """Разовые записи и занятия серии вокруг дат проверки, часть — вне времени сетки"""
+    def random_time(base: datetime) -> datetime:
+        day = base.date() + timedelta(days=rng.randint(-20, 30))
+        at = datetime.combine(day, rng.choice(SLOT_TIMES)) if rng.random() < 0.85 else datetime.combine(
+            day, time(rng.randrange(24), rng.choice((0, 15, 30)))
+        )
+        return to_utc(at)
+
+    singles = sorted({random_time(rng.choice(around)) for _ in range(BOOKINGS)})
+    recurring = sorted({random_time(rng.choice(around)) for _ in range(OCCURRENCES)} - set(singles))
+    async with engine.begin() as conn:
+        await conn.execute(insert(User).values(id=1, tg_id=1, name="u"))
+        await conn.execute(insert(Slot), [{"id": i + 1, "start_at": at} for i, at in enumerate(singles)])
+        await conn.execute(
+            insert(Booking),
+            [
+                {"id": i + 1, "user_id": 1, "slot_id": i + 1, "student_name": "S", "student_contact": "—",
+                 "lesson_type": "single"}
+                for i in range(len(singles))
+            ],
+        )
+        # Слот без записи (после отмены слот может остаться) не занят
+        orphan = next(at for at in iter(lambda: random_time(around[0]), None) if at not in singles)
+        await conn.execute(insert(Slot).values(id=len(singles) + 1, start_at=orphan))
+        series = len(singles) + 1
+        await conn.execute(
+            insert(Booking).values(
+                id=series, user_id=1, student_name="W", student_contact="—",
+                lesson_type="interval", weekday=0, time_hhmm="16:00",
+            )
+        )
+        await conn.execute(
+            insert(Recurrence).values(
+                id=1, booking_id=series, weekday=0, time_hhmm="16:00", starts_on=around[0].date()
+            )
+        )
+        await conn.execute(
+            insert(Occurrence),
+            [
+                {"recurrence_id": 1, "booking_id": series, "original_start_at": at, "start_at": at}
+                for at in recurring
+            ],
+        )
+
+
+async def legacy_busy(session) -> set[datetime]:
+    """Прежний запрос: все занятые времена без ограничения окна"""
+    j = join(Slot, Booking, Slot.id == Booking.slot_id)
+    singles = (await session.scalars(select(Slot.start_at).select_from(j))).all()
+    recurring = (await session.scalars(select(Occurrence.start_at))).all()
+    return {to_naive_local(at) for at in [*singles, *recurring]}
+
+
+async def check_db(rng: random.Random) -> list:
+    nows = [
+        datetime.combine(DST_END + timedelta(days=d), time(h, m))
+        for d in (-10, -3, -1, 0, 1, 4) for h, m in ((0, 0), (16, 0), (17, 50), (23, 59))
+    ]
+    await reset_schema()
+    await seed(rng, nows)
+
+    mismatched = []
+    async with SessionLocal() as session:
+        busy = await legacy_busy(session)
+        for now in nows:
+            grid = await _occupied_grid(session, now.date(), WINDOW_DAYS)
+            if grid_free(grid, now) != legacy_free(busy, now, WINDOW_DAYS):
+                mismatched.append(f"{now:%d.%m %H:%M}")
+    return [
+        check(
+            f"{len(nows)} моментов: свободные дни и времена совпадают с прежним запросом"
+            + (f" (расхождения: {mismatched})" if mismatched else ""),
+            not mismatched,
+        )
+    ]
+
+
+async def run(seed_value: int) -> bool:
+    settings.tz = "Europe/Berlin"
+    print(f"seed={seed_value}, пояс {settings.tz}, база: {engine.dialect.name}")
+    rng = random.Random(seed_value)
+    try:
+        results = check_model(rng) + await check_db(rng)
+    finally:
+        await engine.dispose()
+    return all(results)
+
+
+if __name__ == "__main__":
+    print("Проверка битовой сетки слотов")
+    print("=" * 50)
+    finish(asyncio.run(run(int(sys.argv[1]) if len(sys.argv) > 1 else 3)))
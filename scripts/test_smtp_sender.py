@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Проверка асинхронной отправки писем на локальном SMTP-стенде
+
+Поднимает минимальный SMTP-сервер на asyncio (EHLO/MAIL/RCPT/DATA/QUIT),
+направляет на него SmtpSender и проверяет доставку, переиспользование
+соединений, переподключение после простоя и разрыва, повтор при 4xx и
+отказ без повторов при 5xx. В конце сравнивает пропускную способность
+(писем в секунду) с прежней отправкой через новое соединение на письмо.
+
+    python scripts/test_smtp_sender.py [--count 500] [--pool 2] [--latency-ms 2]
+
+--latency-ms задаёт задержку стенда на каждую команду, имитируя сетевой RTT.
+"""
+
+import argparse
+import asyncio
+import time
+
+from testkit import check, finish
+
+from app.config import settings
+from app.integrations.smtp_sender import SmtpSender
+from app.services.email_service import EmailService
+from app.utils.metrics import metrics
+
+
+class FakeSmtp:
+    """SMTP-стенд: письма и соединения в памяти, ответы с ошибкой по заказу"""
+
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.messages: list[str] = []
+        self.connections = 0
+        self.fail_next: list[str] = []  # ответы на DATA вместо 250, по одному на письмо
+        self.drop_after: float = 0.0    # закрывать соединение после стольких секунд простоя
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+
+        async def reply(line: str) -> None:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            writer.write(f"{line}\r\n".encode())
+            await writer.drain()
+
+        await reply("220 fake ESMTP")
+        try:
+            while True:
+                try:
+                    timeout = self.drop_after or None
+                    raw = await asyncio.wait_for(reader.readline(), timeout)
+                except asyncio.TimeoutError:
+                    await reply("421 idle timeout")
+                    break
+                if not raw:
+                    break
+                cmd = raw.decode().strip().upper()
+                if cmd.startswith("EHLO"):
+                    await reply("250-fake\r\n250 8BITMIME")
+                elif cmd.startswith("HELO"):
+                    await reply("250 fake")
+                elif cmd.startswith(("MAIL", "RCPT", "RSET", "NOOP")):
+                    await reply("250 OK")
+                elif cmd == "DATA":
+                    await reply("354 End data with <CR><LF>.<CR><LF>")
+                    lines = []
+                    while (line := await reader.readline()) not in (b".\r\n", b""):
+                        lines.append(line.decode())
+                    if self.fail_next:
+                        await reply(self.fail_next.pop(0))
+                    else:
+                        self.messages.append("".join(lines))
+                        await reply("250 queued")
+                elif cmd == "QUIT":
+                    await reply("221 bye")
+                    break
+                else:
+                    await reply("502 not implemented")
+        finally:
+            writer.close()
+
+
+def message(i: int):
+    return EmailService._message(f"student{i}@example.com", f"Напоминание #{i}", f"Письмо {i}")
+
+
+async def check_behaviour(fake: FakeSmtp) -> list:
+    results = []
+
+    sender = SmtpSender(pool_size=2, queue_size=10, max_retries=2, idle_seconds=60, backoff_seconds=0.05)
+    ok = await asyncio.gather(*(sender.send(message(i)) for i in range(20)))
+    results.append(check("20 писем доставлены", all(ok) and len(fake.messages) == 20))
+    results.append(check(f"соединений не больше размера пула ({fake.connections})", fake.connections <= 2))
+
+    await sender.close()
+
+    # Сервер закрыл соединение сам — письмо уходит через новое без ошибки
+    fake.drop_after = 0.2
+    sender = SmtpSender(pool_size=1, idle_seconds=60, backoff_seconds=0.05)
+    await sender.send(message(0))
+    await asyncio.sleep(0.4)
+    before = fake.connections
+    results.append(check("разрыв сервером → переподключение", await sender.send(message(1))))
+    results.append(check("после разрыва открыто новое соединение", fake.connections > before))
+    fake.drop_after = 0.0
+    await sender.close()
+
+    # Переоткрытие по собственному таймауту простоя
+    sender = SmtpSender(pool_size=1, idle_seconds=0.1, backoff_seconds=0.05)
+    await sender.send(message(0))
+    before = fake.connections
+    await asyncio.sleep(0.2)
+    await sender.send(message(1))
+    results.append(check("простой дольше SMTP_IDLE_SECONDS → новое соединение", fake.connections == before + 1))
+
+    fake.fail_next = ["451 try again later"]
+    sent_before = len(fake.messages)
+    results.append(check("451 → повтор и доставка", await sender.send(message(2))))
+    results.append(check("письмо доставлено один раз", len(fake.messages) == sent_before + 1))
+
+    fake.fail_next = ["550 mailbox unavailable"]
+    retries = metrics.counter("smtp.retries")
+    results.append(check("550 → отказ", not await sender.send(message(3))))
+    results.append(check("550 не повторяется", metrics.counter("smtp.retries") == retries))
+
+    # Воркер остановлен — следующее письмо его перезапускает
+    sender._workers[0].cancel()
+    await asyncio.sleep(0)
+    try:
+        restarted = await asyncio.wait_for(sender.send(message(4)), 3)
+    except asyncio.TimeoutError:
+        restarted = False
+    results.append(check("остановленный воркер перезапущен", restarted))
+    await sender.close()
+    return results
+
+
+async def throughput(fake: FakeSmtp, count: int, pool: int) -> None:
+    fake.messages.clear()
+    connections = fake.connections
+
+    started = time.perf_counter()
+    for i in range(min(count, 100)):
+        await asyncio.to_thread(EmailService.send, f"student{i}@example.com", "Напоминание", "Письмо")
+    baseline = min(count, 100) / (time.perf_counter() - started)
+
+    sender = SmtpSender(pool_size=pool, queue_size=count)
+    started = time.perf_counter()
+    await asyncio.gather(*(sender.send(message(i)) for i in range(count)))
+    pooled = count / (time.perf_counter() - started)
+    await sender.close()
+
+    latency = metrics.summary("smtp.send.latency")
+    print(f"\n   Соединение на письмо:          {baseline:8.1f} писем/с")
+    print(f"   Пул из {pool} соединений:          {pooled:8.1f} писем/с ({pooled / baseline:.1f}x)")
+    print(f"   Соединений открыто:            {fake.connections - connections}")
+    print(f"   smtp.send.latency p50={latency['p50'] * 1000:.1f}ms p99={latency['p99'] * 1000:.1f}ms")
+
+
+async def run(args) -> bool:
+    fake = FakeSmtp()
+    server = await asyncio.start_server(fake.handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+
+    settings.smtp_enabled = True
+    settings.smtp_host, settings.smtp_port = "127.0.0.1", port
+    settings.smtp_starttls = False
+    settings.smtp_user = settings.smtp_password = ""
+    settings.smtp_from = "tutor@example.com"
+
+    try:
+        results = await check_behaviour(fake)
+        fake.latency = args.latency_ms / 1000
+        await throughput(fake, args.count, args.pool)
+    finally:
+        server.close()
+        await server.wait_closed()
+    return all(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=500)
+    parser.add_argument("--pool", type=int, default=2)
+    parser.add_argument("--latency-ms", type=float, default=2.0)
+    args = parser.parse_args()
+
+    print("Проверка SmtpSender на локальном SMTP-стенде")
+    print("=" * 50)
+    finish(asyncio.run(run(args)))
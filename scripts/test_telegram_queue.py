@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Проверка очереди исходящих сообщений Telegram без сети
+
+Подставляет вместо бота заглушку, которая записывает время каждой отправки
+и по заказу отвечает 429 (TelegramRetryAfter), и проверяет общий лимит в
+секунду, интервал на чат, приоритеты, повтор после retry_after и
+перезапуск остановленного воркера без потери очереди. Ответы хендлеров
+проверяются через QueueRequestMiddleware, как в сессии aiogram.
+"""
+
+import asyncio
+
+from testkit import FakeBot, check, finish
+
+from aiogram.methods import AnswerCallbackQuery, SendMessage
+
+from app import runtime
+from app.integrations.telegram_queue import Priority, QueueRequestMiddleware, TelegramQueue
+from app.utils.metrics import metrics
+
+
+class SessionBot(FakeBot):
+    """Заглушка, у которой каждый вызов проходит через middleware сессии, как у aiogram Bot"""
+
+    def __init__(self, middleware: QueueRequestMiddleware) -> None:
+        super().__init__(latency=0.02)
+        self.middleware = middleware
+        self.direct: list[str] = []
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        return await self(SendMessage(chat_id=chat_id, text=text))
+
+    async def __call__(self, method):
+        return await self.middleware(self._make_request, self, method)
+
+    async def _make_request(self, bot, method):
+        if isinstance(method, SendMessage):
+            return await FakeBot.send_message(self, method.chat_id, method.text)
+        self.direct.append(type(method).__name__)
+        return True
+
+
+async def check_global_rate(bot: FakeBot) -> bool:
+    queue = TelegramQueue(rate=20, chat_interval=0, concurrency=8)
+    started = asyncio.get_running_loop().time()
+    await asyncio.gather(*(queue.send_message(1000 + i, f"m{i}") for i in range(60)))
+    elapsed = asyncio.get_running_loop().time() - started
+    await queue.close()
+    # 20 сразу (запас bucket), остальные 40 — со скоростью 20/с
+    print(f"   60 сообщений при лимите 20/с: {elapsed:.2f} с")
+    return check("общий лимит соблюдается", 1.8 <= elapsed <= 2.6)
+
+
+async def check_chat_interval(bot: FakeBot) -> bool:
+    bot.sent.clear()
+    queue = TelegramQueue(rate=100, chat_interval=0.5, concurrency=8)
+    await asyncio.gather(
+        *(queue.send_message(1, f"a{i}") for i in range(3)),
+        *(queue.send_message(2, f"b{i}") for i in range(3)),
+    )
+    await queue.close()
+    times = [t for t, chat, _ in bot.sent if chat == 1]
+    gaps = [b - a for a, b in zip(times, times[1:])]
+    order = [text for _, chat, text in bot.sent if chat == 1]
+    ok = check("в один чат не чаще интервала", all(g >= 0.45 for g in gaps))
+    return check("порядок в чате сохраняется", order == ["a0", "a1", "a2"]) and ok
+
+
+async def check_priority(bot: FakeBot) -> bool:
+    bot.sent.clear()
+    queue = TelegramQueue(rate=5, chat_interval=0, concurrency=1)
+    # Забиваем очередь рассылкой, потом приходит ответ пользователю
+    bulk = [asyncio.create_task(queue.send_message(2000 + i, f"bulk{i}", Priority.BROADCAST)) for i in range(10)]
+    await asyncio.sleep(0.05)
+    await queue.send_message(1, "reply", Priority.INTERACTIVE)
+    position = [text for _, _, text in bot.sent].index("reply")
+    for task in bulk:
+        task.cancel()
+    await queue.close()
+    return check(f"интерактивное сообщение обгоняет рассылку (позиция {position})", position <= 6)
+
+
+async def check_retry_after(bot: FakeBot) -> bool:
+    bot.sent.clear()
+    bot.flood = {7: 1}
+    queue = TelegramQueue(rate=100, chat_interval=0, concurrency=4)
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    result = await queue.send_message(7, "after 429")
+    elapsed = loop.time() - started
+    await queue.close()
+    ok = check("после 429 сообщение доставлено", result == "after 429")
+    return check(f"повтор не раньше retry_after ({elapsed:.2f} с)", elapsed >= 0.95) and ok
+
+
+async def check_worker_restart(bot: FakeBot) -> bool:
+    bot.sent.clear()
+    queue = TelegramQueue(rate=100, chat_interval=0, concurrency=1)
+    waiting = [asyncio.create_task(queue.send_message(3000 + i, f"w{i}")) for i in range(5)]
+    await asyncio.sleep(0.01)
+    # Воркер остановлен, пока одно сообщение в полёте, а остальные ждут в очереди
+    queue._worker.cancel()
+    await asyncio.sleep(0.05)
+    try:
+        await asyncio.wait_for(asyncio.gather(queue.send_message(3005, "w5"), *waiting), 3)
+        delivered = True
+    except asyncio.TimeoutError:
+        delivered = False
+    await queue.close()
+    texts = sorted(text for _, _, text in bot.sent)
+    ok = check("после остановки воркера ждавшие в очереди доставлены", delivered)
+    return check(f"каждое сообщение ушло один раз ({len(texts)})", texts == [f"w{i}" for i in range(6)]) and ok
+
+
+async def check_handler_replies() -> bool:
+    queue = TelegramQueue(rate=5, chat_interval=1, concurrency=1)
+    bot = SessionBot(QueueRequestMiddleware(queue))
+    runtime.set_bot(bot)
+    sent_before = metrics.counter("telegram.sent")
+    interactive_before = metrics.counter("telegram.sent.interactive")
+
+    # Рассылка идёт через очередь и сама проходит middleware — без повторной постановки
+    bulk = [asyncio.create_task(queue.send_message(2000 + i, f"bulk{i}", Priority.BROADCAST)) for i in range(10)]
+    await asyncio.sleep(0.05)
+    # Хендлер отвечает дважды подряд (message.answer) и отвечает на callback
+    await asyncio.wait_for(bot.send_message(1, "reply"), 3)
+    await asyncio.wait_for(bot.send_message(1, "reply2"), 3)
+    await asyncio.wait_for(bot(AnswerCallbackQuery(callback_query_id="1")), 1)
+    await asyncio.wait_for(asyncio.gather(*bulk), 5)
+    await queue.close()
+
+    texts = [text for _, _, text in bot.sent]
+    times = {text: t for t, _, text in bot.sent}
+    ok = check(f"ответ хендлера обгоняет рассылку (позиция {texts.index('reply')})", texts.index("reply") <= 6)
+    ok = check("ответы хендлера идут как INTERACTIVE", metrics.counter("telegram.sent.interactive") - interactive_before == 2) and ok
+    ok = check("интервал на чат ответы не задерживает", times["reply2"] - times["reply"] < 0.9) and ok
+    ok = check("callback-ответ идёт мимо очереди", bot.direct == ["AnswerCallbackQuery"]) and ok
+    return check(
+        "отправки самой очереди не ставятся в неё повторно",
+        metrics.counter("telegram.sent") - sent_before == len(bot.sent) == 12,
+    ) and ok
+
+
+async def run() -> bool:
+    bot = FakeBot(latency=0.02)
+    runtime.set_bot(bot)
+    metrics.reset()
+    results = [
+        await check_global_rate(bot),
+        await check_chat_interval(bot),
+        await check_priority(bot),
+        await check_retry_after(bot),
+        await check_worker_restart(bot),
+        await check_handler_replies(),
+    ]
+    wait = metrics.summary("telegram.queue.wait")
+    print(
+        f"   telegram.sent={metrics.counter('telegram.sent')} "
+        f"retry_after={metrics.counter('telegram.retry_after')} "
+        f"ожидание в очереди p50={wait['p50'] * 1000:.0f}ms p99={wait['p99'] * 1000:.0f}ms"
+    )
+    return all(results)
+
+
+if __name__ == "__main__":
+    print("Проверка очереди исходящих сообщений Telegram")
+    print("=" * 50)
+    finish(asyncio.run(run()))
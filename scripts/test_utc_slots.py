@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Проверка хранения времени занятий в UTC
+
+На временной SQLite со случайными (seed фиксирован) моментами, в том числе
+вокруг переходов на летнее/зимнее время, проверяет:
+- момент из UTC переживает запись в slots и чтение без изменений;
+- format_dt_ru показывает одно и то же локальное время до и после базы;
+- выбранное пользователем локальное время → UTC → показ даёт ту же строку;
+- напоминания «за сутки»/«за час» ровно за 24 ч/1 ч абсолютного времени;
+- диапазонный запрос в SQL сортирует так же, как UTC в Python;
+- миграция 6 переводит старые локальные значения в UTC, а запись и
+  перенос на мигрированный слот видят его занятым.
+
+    python scripts/test_utc_slots.py [seed]
+"""
+
+import asyncio
+import random
+import sys
+from datetime import datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from testkit import check, finish, reset_schema, sync_sequences, use_test_db
+
+use_test_db("utc")
+
+from sqlalchemy import func, select, text
+
+from app.config import settings
+from app.services.booking_service import BookingService
+from app.services.reminder_service import ReminderService
+from app.storage.db import SessionLocal, engine
+from app.storage.migrations import _m006_utc_instants
+from app.storage.models import Booking, Slot, User
+from app.utils.dates import format_dt_ru, to_utc
+
+SAMPLES = 500
+# Европейские переходы 2026 года (01:00 UTC) — ночь с субботы на воскресенье
+DST_SWITCHES = (
+    datetime(2026, 3, 29, 1, tzinfo=timezone.utc),
+    datetime(2026, 10, 25, 1, tzinfo=timezone.utc),
+)
+
+
+def random_instants(rng: random.Random, count: int) -> list[datetime]:
+    """Уникальные моменты с точностью до минуты: половина — в пределах суток от перехода"""
+    lo = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    result: set[datetime] = set()
+    while len(result) < count:
+        if rng.random() < 0.5:
+            base = rng.choice(DST_SWITCHES)
+            at = base + timedelta(minutes=rng.randint(-24 * 60, 24 * 60))
+        else:
+            at = lo + timedelta(minutes=rng.randint(0, 3 * 365 * 24 * 60))
+        result.add(at)
+    return list(result)
+
+
+def random_wall_times(rng: random.Random, count: int) -> list[datetime]:
+    """Локальные времена сетки (9:00–21:30) в дни вокруг переходов"""
+    result = []
+    for _ in range(count):
+        day = rng.choice(DST_SWITCHES).date() + timedelta(days=rng.randint(-3, 3))
+        result.append(datetime.combine(day, time(rng.randint(9, 21), rng.choice((0, 30)))))
+    return result
+
+
+async def check_roundtrip(rng: random.Random) -> list:
+    tz = ZoneInfo(settings.tz)
+    instants = random_instants(rng, SAMPLES)
+    async with SessionLocal() as session:
+        session.add_all(Slot(start_at=at) for at in instants)
+        await session.commit()
+    async with SessionLocal() as session:
+        loaded = (await session.scalars(select(Slot.start_at))).all()
+
+    expected = [format_dt_ru(at) for at in instants]
+    shown = [format_dt_ru(at) for at in loaded]
+    manual = {f"{at.astimezone(tz):%d.%m %H:%M}" for at in instants}
+    return [
+        check(f"{SAMPLES} моментов без изменений после базы", sorted(loaded) == sorted(instants)),
+        check("из базы — aware UTC", all(at.tzinfo is not None and at.utcoffset() == timedelta(0) for at in loaded)),
+        check("format_dt_ru до и после базы совпадает", sorted(shown) == sorted(expected)),
+        check("format_dt_ru — локальное время settings.tz", {s.split(" ", 1)[1] for s in shown} == manual),
+    ]
+
+
+def check_wall_times(rng: random.Random) -> list:
+    walls = random_wall_times(rng, SAMPLES)
+    bad = [w for w in walls if format_dt_ru(to_utc(w)) != format_dt_ru(w)]
+    return [check(f"локальное время → UTC → показ: {len(walls) - len(bad)} из {len(walls)}", not bad)]
+
+
+def check_reminders(rng: random.Random) -> list:
+    offsets = ReminderService.offsets()
+    walls = random_wall_times(rng, SAMPLES)
+    exact = True
+    for wall in walls:
+        start_at = to_utc(wall)
+        after = start_at - timedelta(days=2)
+        for minutes in offsets:
+            remind_at = ReminderService.next_remind_at(start_at, after)
+            exact &= (start_at - remind_at).total_seconds() == minutes * 60
+            after = remind_at
+        exact &= ReminderService.next_remind_at(start_at, after) is None
+
+    # Воскресенье перехода на летнее: сутки назад на часах было 09:00
+    start_at = to_utc(datetime(2026, 3, 29, 10, 0))
+    first = ReminderService.next_remind_at(start_at, start_at - timedelta(days=2))
+    return [
+        check(f"напоминания ровно за {offsets} мин абсолютного времени", exact),
+        check(f"за сутки до Вс 29.03 10:00 — {format_dt_ru(first)}", format_dt_ru(first) == "Сб 28.03 09:00"),
+    ]
+
+
+async def check_range_query(rng: random.Random) -> list:
+    async with SessionLocal() as session:
+        everything = sorted((await session.scalars(select(Slot.start_at))).all())
+        results = []
+        for _ in range(20):
+            lo, hi = sorted(rng.sample(everything, 2))
+            # Наивная граница — локальное время, aware — как есть
+            naive_lo = lo.astimezone(ZoneInfo(settings.tz)).replace(tzinfo=None)
+            got = (
+                await session.scalars(
+                    select(Slot.start_at).where(Slot.start_at.between(naive_lo, hi)).order_by(Slot.start_at)
+                )
+            ).all()
+            results.append(got == [at for at in everything if lo <= at <= hi])
+    return [check("диапазон и порядок в SQL совпадают с UTC", all(results))]
+
+
+async def check_migration(rng: random.Random, tz_name: str) -> list:
+    """Старые значения — локальное время; часовая сетка даёт совпадения со сдвигом пояса"""
+    settings.tz = tz_name
+    await reset_schema()
+    walls = sorted({datetime.combine(w.date(), time(w.hour)) for w in random_wall_times(rng, 60)})
+    async with engine.begin() as conn:
+        await conn.execute(text("INSERT INTO users (id, tg_id, name) VALUES (1, 1, 'u')"))
+        for i, wall in enumerate(walls, start=1):
+            await conn.execute(
+                text("INSERT INTO slots (id, start_at, is_active) VALUES (:id, :at, :yes)"),
+                {"id": i, "at": wall, "yes": True},
+            )
+            await conn.execute(
+                text(
+                    "INSERT INTO bookings (user_id, slot_id, student_name, student_contact, lesson_type, "
+                    "remind_24h_sent, remind_1h_sent, next_remind_at) "
+                    "VALUES (1, :id, 'S', '—', 'single', :no, :no, :at)"
+                ),
+                {"id": i, "at": wall - timedelta(hours=1), "no": False},
+            )
+        await conn.run_sync(_m006_utc_instants)
+    await sync_sequences()
+    async with SessionLocal() as session:
+        slots = (await session.scalars(select(Slot).order_by(Slot.id))).all()
+        bookings = (await session.scalars(select(Booking).order_by(Booking.slot_id))).all()
+
+    # Мигрированные значения должны совпадать с записанными через ORM
+    async with SessionLocal() as session:
+        user = await session.get(User, 1)
+        booked = await BookingService.book_at(session, user, walls[0], "S2", "—")
+    async with SessionLocal() as session:
+        moved = await BookingService.reschedule_to(session, 2, walls[0])
+    async with SessionLocal() as session:
+        slot_count = await session.scalar(select(func.count()).select_from(Slot))
+    return [
+        check(
+            f"миграция 6 ({tz_name}): слоты в UTC",
+            [s.start_at for s in slots] == [to_utc(w) for w in walls],
+        ),
+        check(
+            f"миграция 6 ({tz_name}): next_remind_at в UTC",
+            [b.next_remind_at for b in bookings] == [to_utc(w - timedelta(hours=1)) for w in walls],
+        ),
+        check(f"миграция 6 ({tz_name}): запись на мигрированный слот отклонена", booked is None),
+        check(f"миграция 6 ({tz_name}): перенос на мигрированный слот отклонён", not moved),
+        check(f"миграция 6 ({tz_name}): дублей слотов нет ({slot_count})", slot_count == len(walls)),
+    ]
+
+
+async def run(seed: int) -> bool:
+    rng = random.Random(seed)
+    settings.tz = "Europe/Berlin"
+    settings.remind_offsets_minutes = [1440, 60]
+    print(f"seed={seed}, пояс {settings.tz}")
+    await reset_schema()
+    try:
+        results = (
+            await check_roundtrip(rng)
+            + check_wall_times(rng)
+            + check_reminders(rng)
+            + await check_range_query(rng)
+            + await check_migration(rng, "Europe/Berlin")
+            + await check_migration(rng, "America/New_York")
+        )
+    finally:
+        await engine.dispose()
+    return all(results)
+
+
+if __name__ == "__main__":
+    print("Хранение времени занятий в UTC")
+    print("=" * 50)
+    finish(asyncio.run(run(int(sys.argv[1]) if len(sys.argv) > 1 else 25)))
@@ -0,0 +1,103 @@
+"""
+Общие части проверочных скриптов scripts/test_*.py
+
+Импортируется скриптом до модулей app: добавляет корень проекта в путь,
+а use_temp_db() выставляет DB_URL раньше, чем app.config прочитает
+настройки.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+# Добавляем корневую директорию проекта в путь
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+_tmp: Optional[tempfile.TemporaryDirectory] = None
+
+
+def use_test_db(name: str) -> str:
+    """База проверки: DB_URL из окружения, иначе временная SQLite; вызывать до импорта app
+
+    Таблицы в базе из DB_URL пересоздаются — указывать только тестовую базу.
+    """
+    global _tmp
+    if not os.getenv("DB_URL"):
+        _tmp = tempfile.TemporaryDirectory()
+        os.environ["DB_URL"] = f"sqlite+aiosqlite:///{_tmp.name}/{name}.sqlite3"
+    return os.environ["DB_URL"]
+
+
+async def reset_schema() -> None:
+    """Пересоздаёт таблицы в базе DB_URL"""
+    from app.storage.db import Base, engine
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+
+
+async def sync_sequences() -> None:
+    """После вставки строк с явными id: счётчики id в PostgreSQL продолжаются с max(id)"""
+    from sqlalchemy import text
+
+    from app.storage.db import Base, engine
+
+    if engine.dialect.name != "postgresql":
+        return
+    async with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if "id" in table.c and table.c.id.autoincrement in (True, "auto"):
+                await conn.execute(
+                    text(f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), max(id)) FROM {table.name}")
+                )
+
+
+def check(title: str, ok: bool) -> bool:
+    print(f"   {'OK  ' if ok else 'FAIL'} {title}")
+    return ok
+
+
+def finish(ok: bool) -> None:
+    """Убирает временную базу и печатает итог; при ошибках — код выхода 1"""
+    if _tmp is not None:
+        _tmp.cleanup()
+    if ok:
+        print("\nВсе проверки пройдены")
+    else:
+        print("\nЕсть ошибки")
+        sys.exit(1)
+
+
+class FakeBot:
+    """Заглушка Bot: журнал отправок (время, чат, текст), задержка ответа, 429 и сбои по заказу"""
+
+    def __init__(self, latency: float = 0) -> None:
+        self.sent: list[tuple[float, int, str]] = []
+        # Задержка ответа Bot API: общая и по отдельным чатам, секунды
+        self.latency = latency
+        self.delays: dict[int, float] = {}
+        # Сколько раз подряд ответить чату 429
+        self.flood: dict[int, int] = {}
+        # Сколько раз подряд не доставить чату сообщение (сетевая ошибка)
+        self.errors: dict[int, int] = {}
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        loop = asyncio.get_running_loop()
+        if self.flood.get(chat_id):
+            self.flood[chat_id] -= 1
+            raise TelegramRetryAfter(
+                method=SendMessage(chat_id=chat_id, text=text), message="Too Many Requests", retry_after=1
+            )
+        if self.errors.get(chat_id):
+            self.errors[chat_id] -= 1
+            raise TelegramNetworkError(method=SendMessage(chat_id=chat_id, text=text), message="Bad Gateway")
+        await asyncio.sleep(self.delays.get(chat_id, self.latency))
+        self.sent.append((loop.time(), chat_id, text))
+        return text